@@ -1,104 +1,331 @@
-import base64
-import gzip
+import asyncio
+import contextlib
+import functools
 import json
 import os
 import random
-from typing import List, Optional
+import sqlite3
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, List, Optional, Sequence
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-import requests
+from starlette.concurrency import run_in_threadpool
+import httpx
 
 # Import the system prompt used for instructing the LLM
 try:
     # Relative import when running as package
-    from .prompt import SYSTEM_PROMPT  # type: ignore
+    from .prompt import SYSTEM_PROMPT, SYSTEM_PROMPT_VERSION  # type: ignore
 except Exception:
     # Fallback import when running as a script
-    from prompt import SYSTEM_PROMPT  # type: ignore
+    from prompt import SYSTEM_PROMPT, SYSTEM_PROMPT_VERSION  # type: ignore
 
 # Import context utilities for extracting code snippets from error logs
 try:
-    from .utils.context import parse_error_log, extract_context  # type: ignore
+    from .utils.context import ContextIndex, parse_error_log, extract_context  # type: ignore
 except Exception:
-    from utils.context import parse_error_log, extract_context  # type: ignore
+    from utils.context import ContextIndex, parse_error_log, extract_context  # type: ignore
+
+# Import-graph aware selection of the definitions and imports around frames
+try:
+    from .utils.import_graph import CONTEXT_GRAPH_ENABLED, ImportGraph, select_context  # type: ignore
+except Exception:
+    from utils.import_graph import CONTEXT_GRAPH_ENABLED, ImportGraph, select_context  # type: ignore
+
+# Import bounded decoding of uploaded base64-gzip files
+try:
+    from .utils.decoding import MAX_FILE_BYTES, MAX_REQUEST_BYTES, PayloadTooLarge, decode_files  # type: ignore
+except Exception:
+    from utils.decoding import MAX_FILE_BYTES, MAX_REQUEST_BYTES, PayloadTooLarge, decode_files  # type: ignore
 
 # Import vector store utilities for embedding files and querying similar snippets
 try:
-    from .utils.vector_store import embed_files, query_snippets  # type: ignore
+    from .utils.vector_store import StoreCache, StoreSnapshot, VectorStore  # type: ignore
+except Exception:
+    from utils.vector_store import StoreCache, StoreSnapshot, VectorStore  # type: ignore
+
+# Import in-process counters and histograms exported at /metrics
+try:
+    from .utils import telemetry  # type: ignore
 except Exception:
-    from utils.vector_store import embed_files, query_snippets  # type: ignore
+    from utils import telemetry  # type: ignore
+
+# Import the token estimator used for prompt budgets and metrics
+try:
+    from .utils.tokens import estimate_tokens, prompt_budget  # type: ignore
+except Exception:
+    from utils.tokens import estimate_tokens, prompt_budget  # type: ignore
+
+# Import the response cache placed in front of upstream model calls
+try:
+    from .utils.llm_cache import HIT, MISS, ResponseCache, make_key as make_cache_key  # type: ignore
+except Exception:
+    from utils.llm_cache import HIT, MISS, ResponseCache, make_key as make_cache_key  # type: ignore
+
+# Import failure fingerprinting used to reuse diagnoses of repeat failures
+try:
+    from .utils.fingerprint import FINGERPRINT_ENABLED, FINGERPRINT_TTL_SECONDS, failure_key  # type: ignore
+except Exception:
+    from utils.fingerprint import FINGERPRINT_ENABLED, FINGERPRINT_TTL_SECONDS, failure_key  # type: ignore
+
+# Import the incremental parser used to stream model output field by field
+try:
+    from .utils.json_stream import FIELD, ITEM, JsonObjectStream  # type: ignore
+except Exception:
+    from utils.json_stream import FIELD, ITEM, JsonObjectStream  # type: ignore
+
+# Import retries, circuit breaking and hedging for upstream calls
+try:
+    from .utils.resilience import CircuitOpen, ResilientCaller, is_retryable  # type: ignore
+except Exception:
+    from utils.resilience import CircuitOpen, ResilientCaller, is_retryable  # type: ignore
+
+# Import the model router trained on the metrics history
+try:
+    from .utils.router import ROUTER_ENABLED, ModelRouter, RouteFeatures, route_features  # type: ignore
+except Exception:
+    from utils.router import ROUTER_ENABLED, ModelRouter, RouteFeatures, route_features  # type: ignore
 
 # Import metrics logging utilities
 try:
-    from .utils.metrics import init_db, log_call  # type: ignore
+    from .utils.metrics import DB_PATH as METRICS_DB_PATH, MetricsWriter, init_db  # type: ignore
+except Exception:
+    from utils.metrics import DB_PATH as METRICS_DB_PATH, MetricsWriter, init_db  # type: ignore
+
+# Import the rollup reader behind /metrics/summary
+try:
+    from .utils.rollups import METRICS_HOUR_RETENTION_DAYS, summarise as summarise_metrics  # type: ignore
+except Exception:
+    from utils.rollups import METRICS_HOUR_RETENTION_DAYS, summarise as summarise_metrics  # type: ignore
+
+# Content-addressed store of decoded files, for hash-first delta uploads
+try:
+    from .utils.blob_store import BlobStore, HashMismatch, MissingBlobs, is_valid_hash  # type: ignore
 except Exception:
-    from utils.metrics import init_db, log_call  # type: ignore
+    from utils.blob_store import BlobStore, HashMismatch, MissingBlobs, is_valid_hash  # type: ignore
+
+# Raw and archived multipart uploads, and gzip-encoded request bodies
+try:
+    from .utils.archive import ArchiveReader, MalformedArchive  # type: ignore
+    from .utils.request_encoding import DecompressRequestMiddleware  # type: ignore
+except Exception:
+    from utils.archive import ArchiveReader, MalformedArchive  # type: ignore
+    from utils.request_encoding import DecompressRequestMiddleware  # type: ignore
+
+# Whole-repository index built offline and memory-mapped at startup
+try:
+    from .utils.repo_index import merge_chunks, open_index  # type: ignore
+except Exception:
+    from utils.repo_index import merge_chunks, open_index  # type: ignore
+
+# Deterministic rules that answer common failures without a model call
+try:
+    from .utils.rules import RULES_ENABLED, RULES_PLUGINS, RuleContext, RuleEngine, RuleHit  # type: ignore
+except Exception:
+    from utils.rules import RULES_ENABLED, RULES_PLUGINS, RuleContext, RuleEngine, RuleHit  # type: ignore
 
 
 class FilePayload(BaseModel):
     filename: str
-    content: str  # base64-encoded gzip contents
+    content: str = ''  # base64-encoded gzip contents
+    # SHA-256 of the decoded UTF-8 text. With `content` the file is verified
+    # and stored; without it the file is read from the blob store
+    sha256: Optional[str] = None
+
+
+class FileHash(BaseModel):
+    path: str
+    sha256: str
+
+
+class HashCheckRequest(BaseModel):
+    files: List[FileHash]
+
+
+class UploadRequest(BaseModel):
+    files: List[FilePayload]
 
 
 class DiagnoseRequest(BaseModel):
     files: List[FilePayload]
     error_log: str
     summary: str
+    # Optional client session (e.g. workspace) whose vector store is kept
+    # between requests; without it each request gets a fresh store
+    session_id: Optional[str] = None
 
 
-app = FastAPI()
+class BatchFailure(BaseModel):
+    error_log: str
+    # Client reference echoed back with the result, e.g. a test id
+    id: Optional[str] = None
+    # Overrides the batch summary for this failure
+    summary: Optional[str] = None
+
+
+class BatchDiagnoseRequest(BaseModel):
+    files: List[FilePayload]
+    failures: List[BatchFailure]
+    summary: str = ''
+    session_id: Optional[str] = None
+
+
+# Upstream chat completions endpoint; override to point at a proxy or a stub
+OPENAI_API_BASE = os.environ.get('OPENAI_API_BASE', 'https://api.openai.com/v1')
+OPENAI_TIMEOUT = float(os.environ.get('OPENAI_TIMEOUT', '30'))
+# Serve Prometheus metrics at /metrics only when explicitly enabled
+METRICS_ENABLED = os.environ.get('ENABLE_METRICS', '').lower() in ('1', 'true', 'yes')
+OPENAI_MAX_CONNECTIONS = int(os.environ.get('OPENAI_MAX_CONNECTIONS', '100'))
+# Failures accepted per /diagnose/batch request, and model calls in flight per batch
+BATCH_MAX_FAILURES = int(os.environ.get('BATCH_MAX_FAILURES', '500'))
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', '8'))
+# Largest error log accepted as a plain /diagnose/upload form field; bigger
+# logs can be sent as a file part instead
+UPLOAD_MAX_FIELD_BYTES = int(os.environ.get('UPLOAD_MAX_FIELD_BYTES', str(16 * 1024 * 1024)))
+UPLOAD_MAX_PARTS = int(os.environ.get('UPLOAD_MAX_PARTS', '1000'))
+
+# Shared, pooled client for upstream calls. Created at startup and closed on
+# shutdown so keep-alive connections (and their TLS sessions) are reused.
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """Build the pooled upstream client, using HTTP/2 when `h2` is installed."""
+    try:
+        import h2  # type: ignore  # noqa: F401
+        http2 = True
+    except ImportError:
+        http2 = False
+    return httpx.AsyncClient(
+        http2=http2,
+        timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=10.0),
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+            keepalive_expiry=60.0,
+        ),
+    )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _http_client
+    _http_client = create_http_client()
+    try:
+        yield
+    finally:
+        client, _http_client = _http_client, None
+        await client.aclose()
+        # Write out queued metrics before the process exits
+        await run_in_threadpool(metrics_writer.close)
+
+
+app = FastAPI(lifespan=lifespan)
+# Accept request bodies sent with Content-Encoding: gzip
+app.add_middleware(DecompressRequestMiddleware)
 
 # Initialise the metrics database at application startup
 init_db()
 
+# Metrics are queued here and written in batches by a background thread
+metrics_writer = MetricsWriter()
 
-def choose_model(error_log: str, files: List[FilePayload]) -> str:
-    """Select the appropriate model based on heuristics.
+# Per-process request telemetry, rendered at /metrics
+DIAGNOSE_REQUESTS = telemetry.REGISTRY.counter('diagnose_requests_total', 'Diagnose requests received.')
+DIAGNOSE_FAILURES = telemetry.REGISTRY.counter('diagnose_failures_total', 'Diagnose requests that returned an error.')
+DIAGNOSE_FALLBACKS = telemetry.REGISTRY.counter(
+    'diagnose_fallbacks_total', 'Responses simulated instead of coming from the model.', ['reason'],
+)
+DIAGNOSE_MODEL = telemetry.REGISTRY.counter('diagnose_model_total', 'Diagnoses routed to each model.', ['model'])
+DIAGNOSE_CACHE = telemetry.REGISTRY.counter('diagnose_cache_total', 'Response cache outcomes.', ['status'])
+DIAGNOSE_STAGE_SECONDS = telemetry.REGISTRY.histogram(
+    'diagnose_stage_seconds', 'Time spent in each stage of a diagnosis.', ['stage'],
+)
+DIAGNOSE_PAYLOAD_BYTES = telemetry.REGISTRY.histogram(
+    'diagnose_payload_bytes', 'Size of uploaded files, encoded and decoded.', ['form'], telemetry.SIZE_BUCKETS,
+)
+DIAGNOSE_PROMPT_TRIMMED = telemetry.REGISTRY.counter(
+    'diagnose_prompt_trimmed_total', 'Prompt sections cut to fit the token budget.', ['section'],
+)
+DIAGNOSE_STREAM_FIRST_EVENT_SECONDS = telemetry.REGISTRY.histogram(
+    'diagnose_stream_first_event_seconds', 'Time from the model call starting to the first streamed event.',
+)
+DIAGNOSE_FILES = telemetry.REGISTRY.histogram(
+    'diagnose_files', 'Files uploaded per diagnosis.', buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+DIAGNOSE_UPSTREAM_EVENTS = telemetry.REGISTRY.counter(
+    'diagnose_upstream_events_total', 'Upstream retries, hedged requests and circuit breaker rejections.', ['event'],
+)
+DIAGNOSE_RULES = telemetry.REGISTRY.counter(
+    'diagnose_rules_total', 'Rule answers, by whether they replaced the model call.', ['rule', 'outcome'],
+)
+DIAGNOSE_RULES_SAVED_SECONDS = telemetry.REGISTRY.counter(
+    'diagnose_rules_saved_seconds_total', 'Median model latency avoided by rule answers.',
+)
 
-    Use gpt-4o-mini for trivial jobs, else gpt-4o. A trivial job is defined
-    here as having an error log shorter than 500 characters and fewer than 3
-    files uploaded.
-    """
-    if len(error_log) < 500 and len(files) < 3:
-        return "gpt-4o-mini"
-    return "gpt-4o"
+# Retries, circuit breaker and hedging around every upstream completion;
+# configured through the OPENAI_RETRY*, CIRCUIT_* and HEDGE_* variables
+upstream = ResilientCaller(on_event=lambda event: DIAGNOSE_UPSTREAM_EVENTS.inc(event=event))
 
+# Session-scoped vector stores, bounded by VECTOR_STORE_CACHE_BYTES
+vector_stores = StoreCache()
 
-def decode_files(files: List[FilePayload]) -> List[dict]:
-    """Decode base64-gzip file contents to plain text.
+# Cache of upstream responses keyed on (model, system prompt version, prompt);
+# configured through the LLM_CACHE_* environment variables
+response_cache = ResponseCache()
 
-    Returns a list of dictionaries with filename and decoded text. If decoding
-    fails, the `content` key will contain an empty string.
-    """
-    decoded = []
-    for f in files:
-        try:
-            compressed = base64.b64decode(f.content)
-            raw_bytes = gzip.decompress(compressed)
-            text = raw_bytes.decode('utf-8', errors='ignore')
-        except Exception:
-            text = ''
-        decoded.append({
-            'filename': f.filename,
-            'content': text,
-        })
-    return decoded
+# Past diagnoses keyed by failure fingerprint and relevant file contents,
+# stored beside the response cache in its own table
+fingerprint_cache = ResponseCache(ttl=FINGERPRINT_TTL_SECONDS, table='fingerprint_cache')
 
+# Cache status recorded when a diagnosis is reused by fingerprint
+FINGERPRINT_HIT = 'fingerprint'
 
-def call_openai(model: str, prompt: str) -> dict:
-    """Call the OpenAI API with the given prompt and model.
+# Decoded file contents addressed by SHA-256; configured through the
+# BLOB_STORE_DIR and BLOB_STORE_MAX_BYTES variables
+blob_store = BlobStore()
 
-    This helper assumes the environment variable OPENAI_API_KEY is set. It
-    constructs a ChatCompletion request and returns the parsed JSON content
-    from the model's response. If the API cannot be reached or returns an
-    error, it falls back to a simulated response.
+# Memory-mapped index of the whole repository, searched alongside the
+# uploaded files when REPO_INDEX_DIR points at one
+repo_index = open_index()
+
+# Rules tried before the model; RULES_MIN_CONFIDENCE sets when an answer
+# replaces the model call and RULES_PLUGINS adds rules
+rule_engine = RuleEngine()
+rule_engine.load_plugins(RULES_PLUGINS)
+
+# Cache status recorded when a rule answers without the model
+RULE_HIT = 'rule'
+
+# Learns from the metrics table which model to use for which requests;
+# configured through MODEL_ROUTER and the ROUTER_* variables
+router = ModelRouter()
+
+
+def choose_model(error_log: str, files: Sequence[Any], features: Optional[RouteFeatures] = None) -> str:
+    """Select the appropriate model for a request.
+
+    With `features` and enough history in the metrics database, `router`
+    picks the model that meets the confidence target fastest for similar
+    requests. Otherwise use gpt-4o-mini for trivial jobs, else gpt-4o. A
+    trivial job is defined here as having an error log shorter than 500
+    characters and fewer than 3 files uploaded.
     """
-    api_key = os.environ.get('OPENAI_API_KEY')
-    if not api_key:
-        return simulate_response(prompt)
+    if len(error_log) < 500 and len(files) < 3:
+        default = "gpt-4o-mini"
+    else:
+        default = "gpt-4o"
+    if features is None or not ROUTER_ENABLED:
+        return default
+    return router.choose(features, default)
+
+
+def completion_request(model: str, prompt: str, stream: bool = False) -> tuple[str, dict, dict]:
+    """Return ``(url, headers, body)`` for a chat completion request."""
     headers = {
-        'Authorization': f'Bearer {api_key}',
+        'Authorization': f'Bearer {os.environ.get("OPENAI_API_KEY", "")}',
         'Content-Type': 'application/json'
     }
     data = {
@@ -115,25 +342,140 @@ def call_openai(model: str, prompt: str) -> dict:
         ],
         'temperature': 0,
     }
-    try:
-        response = requests.post('https://api.openai.com/v1/chat/completions', headers=headers, json=data, timeout=30)
+    if stream:
+        data['stream'] = True
+    return f'{OPENAI_API_BASE}/chat/completions', headers, data
+
+
+async def request_completion(model: str, prompt: str) -> dict:
+    """Send one chat completion request upstream and return the parsed JSON content.
+
+    The request goes through the shared pooled client when the application
+    has started, otherwise through a short-lived one. Any transport, HTTP or
+    parsing failure is raised to the caller.
+    """
+    url, headers, data = completion_request(model, prompt)
+    if _http_client is not None:
+        response = await _http_client.post(url, headers=headers, json=data)
+    else:
+        async with create_http_client() as client:
+            response = await client.post(url, headers=headers, json=data)
+    response.raise_for_status()
+    resp_json = response.json()
+    # Extract content from the first choice
+    content = resp_json['choices'][0]['message']['content']
+    # Parse JSON content
+    return json.loads(content)
+
+
+async def stream_completion(model: str, prompt: str) -> AsyncIterator[str]:
+    """Request a streamed chat completion and yield content deltas as they arrive.
+
+    Parses the upstream server-sent events (``data: {...}`` lines ending with
+    ``data: [DONE]``). Failures are raised to the caller.
+    """
+    url, headers, data = completion_request(model, prompt, stream=True)
+    async with contextlib.AsyncExitStack() as stack:
+        client = _http_client
+        if client is None:
+            client = await stack.enter_async_context(create_http_client())
+        response = await stack.enter_async_context(client.stream('POST', url, headers=headers, json=data))
         response.raise_for_status()
-        resp_json = response.json()
-        # Extract content from the first choice
-        content = resp_json['choices'][0]['message']['content']
-        # Parse JSON content
-        return json.loads(content)
+        async for line in response.aiter_lines():
+            if not line.startswith('data:'):
+                continue
+            payload = line[len('data:'):].strip()
+            if payload == '[DONE]':
+                break
+            choices = json.loads(payload).get('choices') or [{}]
+            delta = (choices[0].get('delta') or {}).get('content')
+            if delta:
+                yield delta
+
+
+async def resilient_completion(model: str, prompt: str) -> tuple[dict, str]:
+    """`request_completion` with retries, circuit breaking and hedging (see `upstream`).
+
+    Returns ``(result, answered_by)``; `answered_by` differs from `model`
+    when a hedged request to `HEDGE_MODEL` won.
+    """
+    return await upstream.call_with_model(lambda chosen: request_completion(chosen, prompt), model)
+
+
+# Result key carrying the answering model while a result is shared between
+# coalesced callers; stripped before results leave `cached_call_openai`
+_ANSWERED_BY = '_answered_by'
+
+
+async def call_openai(model: str, prompt: str) -> dict:
+    """Call the OpenAI API with the given prompt and model.
+
+    This helper assumes the environment variable OPENAI_API_KEY is set. It
+    returns the parsed JSON content of the model's response. If the API
+    cannot be reached or returns an error after retries, it falls back to a
+    simulated response flagged with ``fallback: true``.
+    """
+    if not os.environ.get('OPENAI_API_KEY'):
+        return simulate_response(prompt, 'no_api_key')
+    try:
+        result, _ = await resilient_completion(model, prompt)
+        return result
+    except CircuitOpen:
+        return simulate_response(prompt, 'circuit_open')
     except Exception:
         # In case of failure, provide a dummy response
-        return simulate_response(prompt)
+        return simulate_response(prompt, 'upstream_error')
+
+
+async def cached_call_openai(model: str, prompt: str) -> tuple[dict, Optional[str], str]:
+    """Like `call_openai`, but answered from the response cache when possible.
+
+    Returns ``(result, cache_status, answered_by)`` where cache_status is
+    'hit', 'miss' or 'coalesced', or None when no upstream call was possible
+    and the response was simulated, and `answered_by` is the model that
+    produced the result. Identical prompts in flight at the same time share
+    one upstream call. Simulated fallbacks are never cached, and an answer
+    from a hedge to another model is cached under that model's key only.
+    """
+    if not os.environ.get('OPENAI_API_KEY'):
+        return fallback_response(prompt, 'no_api_key'), None, model
+    key = make_cache_key(model, SYSTEM_PROMPT_VERSION, prompt)
+
+    async def compute() -> dict:
+        result, answered_by = await resilient_completion(model, prompt)
+        if answered_by != model:
+            with contextlib.suppress(Exception):
+                await response_cache.set_async(make_cache_key(answered_by, SYSTEM_PROMPT_VERSION, prompt), result)
+        return {**result, _ANSWERED_BY: answered_by}
+
+    try:
+        result, cache_status = await response_cache.get_or_compute(
+            key, compute, cacheable=lambda value: value.get(_ANSWERED_BY, model) == model,
+        )
+    except CircuitOpen:
+        return fallback_response(prompt, 'circuit_open'), None, model
+    except Exception:
+        return fallback_response(prompt, 'upstream_error'), None, model
+    DIAGNOSE_CACHE.inc(status=cache_status)
+    result = dict(result)
+    answered_by = result.pop(_ANSWERED_BY, model)
+    return result, cache_status, answered_by
+
+
+def fallback_response(prompt: str, reason: str) -> dict:
+    """Count a fallback for `reason` and return the simulated response."""
+    DIAGNOSE_FALLBACKS.inc(reason=reason)
+    return simulate_response(prompt, reason)
 
 
-def simulate_response(prompt: str) -> dict:
+def simulate_response(prompt: str, reason: str = 'simulated') -> dict:
     """Produce a deterministic dummy JSON response when the OpenAI API is unavailable.
 
     This function analyses the prompt superficially to decide on a confidence
     score and generates placeholder patches. It ensures the response is
-    syntactically valid JSON matching the expected schema.
+    syntactically valid JSON matching the expected schema, and marks it with
+    ``fallback: true`` and ``fallback_reason`` set to `reason` so clients
+    never mistake it for a real diagnosis.
     """
     # Custom simple heuristics for simulation
     lower_prompt = prompt.lower()
@@ -152,7 +494,9 @@ def simulate_response(prompt: str) -> dict:
             'confidence': 0.95,
             'patches': [patch],
             'follow_up': None,
-            'agent_block': 'Simulated fix for circular import.'
+            'agent_block': 'Simulated fix for circular import.',
+            'fallback': True,
+            'fallback_reason': reason,
         }
     # Default simulation: generate a fake confidence based on prompt length
     confidence = 0.9 if len(prompt) < 1000 else 0.75
@@ -170,7 +514,9 @@ def simulate_response(prompt: str) -> dict:
         'confidence': confidence,
         'patches': [dummy_patch],
         'follow_up': follow_up,
-        'agent_block': 'Simulated response. Replace with real model output when available.'
+        'agent_block': 'Simulated response. Replace with real model output when available.',
+        'fallback': True,
+        'fallback_reason': reason,
     }
 
 
@@ -179,79 +525,717 @@ async def healthz():
     return {"status": "ok"}
 
 
+@app.get('/metrics')
+async def metrics():
+    """Expose request telemetry in Prometheus text format.
+
+    Disabled unless the `ENABLE_METRICS` environment variable is set.
+    """
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail='Not Found')
+    return PlainTextResponse(telemetry.REGISTRY.render(), media_type=telemetry.CONTENT_TYPE)
+
+
+def read_metrics_summary(window: float) -> dict:
+    """Summarise the metrics rollups over the last `window` seconds."""
+    conn = sqlite3.connect(metrics_writer.db_path or METRICS_DB_PATH, timeout=5)
+    try:
+        return summarise_metrics(conn, window)
+    finally:
+        conn.close()
+
+
+@app.get('/metrics/summary')
+async def metrics_summary(window: float = Query(3600, ge=60, le=METRICS_HOUR_RETENTION_DAYS * 86400)):
+    """Latency percentiles, token usage and confidence over the last `window` seconds.
+
+    Served from the per-minute (windows up to six hours) or per-hour rollup
+    tables, so the cost does not grow with traffic. Calls from the last
+    `METRICS_ROLLUP_SECONDS` may not be included yet. Disabled unless the
+    `ENABLE_METRICS` environment variable is set.
+    """
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail='Not Found')
+    return await run_in_threadpool(read_metrics_summary, window)
+
+
+class IndexedFiles:
+    """Uploaded files decoded and indexed once, shared by every prompt built from them."""
+
+    def __init__(self, files: Sequence[Any], decoded_files: List[dict], chunks: StoreSnapshot) -> None:
+        self.files = files
+        self.decoded_files = decoded_files
+        # Embedded chunks of exactly these files, even if the session store changes later
+        self.chunks = chunks
+        self.context_index = ContextIndex(decoded_files)
+        self.decoded_chars = sum(len(f['content']) for f in decoded_files)
+
+    @functools.cached_property
+    def import_graph(self) -> ImportGraph:
+        """Imports between the Python files, built on first use."""
+        return ImportGraph(self.decoded_files)
+
+
+def diagnosis_features(indexed: IndexedFiles, error_log: str) -> RouteFeatures:
+    """Return the routing features of one failure against indexed files."""
+    return route_features(error_log, len(indexed.files), indexed.decoded_chars)
+
+
+def resolve_files(files: List[FilePayload]) -> List[dict]:
+    """Return the decoded text of `files`, in order.
+
+    Files with inline `content` are decoded; if they also carry a `sha256`
+    the text is verified against it and kept in `blob_store`. Files with only
+    a `sha256` are read from `blob_store`. Stored text counts towards the
+    per-request decoding limit.
+
+    Raises `MissingBlobs` listing every referenced hash the store lacks,
+    `HashMismatch` when inline content does not match its hash and
+    `PayloadTooLarge` when the files exceed the decoding limits.
+    """
+    inline = [f for f in files if f.content or not f.sha256]
+    if len(inline) == len(files):
+        decoded = decode_files(files)
+    else:
+        stored = {}
+        missing = []
+        for f in files:
+            if not f.content and f.sha256 not in stored:
+                text = blob_store.get(f.sha256)
+                if text is None:
+                    missing.append(f.sha256)
+                else:
+                    stored[f.sha256] = text
+        if missing:
+            raise MissingBlobs(missing)
+        stored_bytes = sum(len(text) for text in stored.values())
+        if stored_bytes > MAX_REQUEST_BYTES:
+            raise PayloadTooLarge('decompressed files exceed the per-request limit')
+        inline_decoded = iter(decode_files(inline, max_request_bytes=MAX_REQUEST_BYTES - stored_bytes))
+        decoded = [
+            next(inline_decoded) if f.content or not f.sha256 else {'filename': f.filename, 'content': stored[f.sha256]}
+            for f in files
+        ]
+    for f, d in zip(files, decoded):
+        if f.content and f.sha256:
+            # A full disk only costs the client a re-upload next time
+            with contextlib.suppress(OSError):
+                blob_store.put(d['content'], f.sha256)
+    return decoded
+
+
+def upload_error(exc: Exception) -> HTTPException:
+    """Map an error raised while resolving uploaded files to an HTTP error."""
+    if isinstance(exc, MissingBlobs):
+        return HTTPException(status_code=409, detail={'message': str(exc), 'missing': exc.digests})
+    if isinstance(exc, (HashMismatch, MalformedArchive)):
+        return HTTPException(status_code=400, detail=str(exc))
+    return HTTPException(status_code=413, detail=str(exc))
+
+
+def index_files(files: List[FilePayload], session_id: Optional[str] = None) -> IndexedFiles:
+    """Decode and embed uploaded files.
+
+    Raises `PayloadTooLarge` when the files exceed the decoding limits, and
+    `MissingBlobs` or `HashMismatch` for bad references to stored files.
+    """
+    stage = DIAGNOSE_STAGE_SECONDS.time
+    # Decode file contents (for context extraction and embedding)
+    with stage(stage='decode'):
+        decoded_files = resolve_files(files)
+    DIAGNOSE_PAYLOAD_BYTES.observe(sum(len(f.content) for f in files), form='encoded')
+    return index_decoded(files, decoded_files, session_id)
+
+
+def index_decoded(files: Sequence[Any], decoded_files: List[dict], session_id: Optional[str] = None) -> IndexedFiles:
+    """Embed already decoded files."""
+    stage = DIAGNOSE_STAGE_SECONDS.time
+    DIAGNOSE_FILES.observe(len(files))
+    DIAGNOSE_PAYLOAD_BYTES.observe(sum(len(f['content']) for f in decoded_files), form='decoded')
+    # Build vector embeddings for the uploaded files in a store owned by this
+    # request or session, so concurrent requests cannot see each other's files
+    store = vector_stores.get(session_id) if session_id else VectorStore()
+    with store:
+        with stage(stage='embed'):
+            store.embed(decoded_files)
+            # Taken under the same lock, before another request of the session can embed
+            chunks = store.snapshot()
+    if session_id:
+        vector_stores.trim()
+    return IndexedFiles(files, decoded_files, chunks)
+
+
+def build_diagnosis_prompt(
+    indexed: IndexedFiles,
+    error_log: str,
+    summary: str,
+    features: Optional[RouteFeatures] = None,
+) -> tuple[str, str]:
+    """Return ``(model, prompt)`` for one failure against already indexed files.
+
+    `features` (from `diagnosis_features`) are computed when not given.
+    """
+    stage = DIAGNOSE_STAGE_SECONDS.time
+    # Query vector store for relevant snippets based on the error log and summary
+    query_text = f"{error_log}\n{summary}"
+    with stage(stage='query'):
+        retrieved_chunks = indexed.chunks.query_chunks(query_text, k=5)
+    if repo_index is not None:
+        # Uploaded files are fresher than their indexed versions
+        with stage(stage='query_repo'):
+            shadowed = repo_index.file_ids(f['filename'] for f in indexed.decoded_files)
+            repo_chunks = repo_index.query_chunks(query_text, k=5, exclude_files=shadowed)
+        retrieved_chunks = merge_chunks(retrieved_chunks, repo_chunks, k=5)
+    # Choose the appropriate model based on heuristics
+    if features is None:
+        features = diagnosis_features(indexed, error_log)
+    model_name = choose_model(error_log, indexed.files, features)
+    DIAGNOSE_MODEL.inc(model=model_name)
+    with stage(stage='extract_context'):
+        # Parse error log to find file and line number references
+        refs = parse_error_log(error_log)
+        # Extract code around each reference from decoded files: the needed
+        # definitions and imports by import-graph distance, or line windows
+        if CONTEXT_GRAPH_ENABLED:
+            context_snippets = select_context(
+                indexed.decoded_files, refs, index=indexed.context_index, graph=indexed.import_graph,
+            )
+        else:
+            context_snippets = extract_context(indexed.decoded_files, refs, index=indexed.context_index)
+    with stage(stage='build_prompt'):
+        # Build one context section per window so the budget can drop whole windows
+        context_sections = [
+            f"Context from {snip['filename']} (lines {snip['start']}-{snip['end']}):\n{snip['snippet']}"
+            for snip in context_snippets
+        ]
+        # Label retrieved chunks with their origin so the model can cite them
+        vector_snippets = [
+            f"From {chunk['filename']} (lines {chunk['start']}-{chunk['end']}):\n{chunk['snippet']}"
+            for chunk in retrieved_chunks
+        ]
+        # Build the prompt using the dedicated prompt builder (includes few-shot
+        # examples), trimmed to the chosen model's token budget
+        from . import prompt_builder  # local import to avoid cycles
+        assembly = prompt_builder.assemble_prompt(
+            error_log=error_log,
+            summary=summary,
+            retrieved_snippets=vector_snippets,
+            context_snippets=context_sections,
+            max_tokens=prompt_budget(model_name),
+        )
+    for section in assembly.trimmed:
+        DIAGNOSE_PROMPT_TRIMMED.inc(section=section)
+    return model_name, assembly.prompt
+
+
+def reuse_key(indexed: IndexedFiles, error_log: str) -> Optional[str]:
+    """Return the fingerprint key under which this failure's diagnosis is reused."""
+    if not FINGERPRINT_ENABLED:
+        return None
+    return failure_key(error_log, indexed.decoded_files, SYSTEM_PROMPT_VERSION)
+
+
+def apply_rules(indexed: IndexedFiles, error_log: str) -> Optional[RuleHit]:
+    """Return the rule answer that replaces the model call for this failure, if any."""
+    if not RULES_ENABLED:
+        return None
+    context = RuleContext(
+        error_log, parse_error_log(error_log), indexed.decoded_files, indexed.context_index, indexed.import_graph,
+    )
+    with DIAGNOSE_STAGE_SECONDS.time(stage='rules'):
+        hit = rule_engine.evaluate(context)
+    if hit is None:
+        return None
+    if hit.confidence < rule_engine.min_confidence:
+        DIAGNOSE_RULES.inc(rule=hit.rule, outcome='below_threshold')
+        return None
+    DIAGNOSE_RULES.inc(rule=hit.rule, outcome='answered')
+    return hit
+
+
+def rule_answer(hit: RuleHit, duration_ms: int) -> dict:
+    """Return the response body for a rule answer and record its metrics.
+
+    The saved time is the median upstream latency minus the time taken to
+    reach the answer; it is unknown until the model has been called.
+    """
+    body = normalise_result(hit.body)
+    median = upstream.latencies.percentile(50)
+    saved_ms = None
+    if median is not None:
+        saved_ms = max(0, int(median * 1000) - duration_ms)
+        DIAGNOSE_RULES_SAVED_SECONDS.inc(saved_ms / 1000)
+    record_metrics('', body, duration_ms, RULE_HIT, rule=hit.rule, saved_ms=saved_ms)
+    return body
+
+
+def prepare_prompt(req: DiagnoseRequest) -> tuple[str, str]:
+    """Run the CPU-bound part of a diagnosis and return ``(model, prompt)``.
+
+    Decoding, embedding and context extraction are synchronous; the async
+    endpoint runs this in the threadpool so the event loop stays free for
+    in-flight upstream calls.
+    """
+    indexed = index_files(req.files, req.session_id)
+    return build_diagnosis_prompt(indexed, req.error_log, req.summary)
+
+
+@app.post('/files/check')
+async def files_check(req: HashCheckRequest):
+    """Return the hashes, among `req.files`, that the server does not store.
+
+    Clients send ``(path, sha256)`` pairs for every file, upload only the
+    missing ones (to `/files/upload` or inline) and then refer to the rest
+    by hash alone.
+    """
+    invalid = [f.path for f in req.files if not is_valid_hash(f.sha256)]
+    if invalid:
+        raise HTTPException(status_code=422, detail={'message': 'Invalid SHA-256 hex digest', 'paths': invalid})
+    missing = await run_in_threadpool(blob_store.missing, [f.sha256 for f in req.files])
+    return {'missing': missing}
+
+
+def store_files(files: List[FilePayload]) -> List[dict]:
+    """Decode `files` and add them to `blob_store`, verifying any given hashes."""
+    decoded = decode_files(files)
+    return [
+        {'path': f.filename, 'sha256': blob_store.put(d['content'], f.sha256)}
+        for f, d in zip(files, decoded)
+    ]
+
+
+@app.post('/files/upload')
+async def files_upload(req: UploadRequest):
+    """Store base64-gzip encoded files and return their hashes.
+
+    A file's `sha256`, when given, must match its decoded text.
+    """
+    try:
+        stored = await run_in_threadpool(store_files, req.files)
+    except (PayloadTooLarge, HashMismatch) as exc:
+        raise upload_error(exc)
+    return {'stored': stored}
+
+
 @app.post('/diagnose')
-def diagnose(req: DiagnoseRequest):
+async def diagnose(req: DiagnoseRequest):
     """Diagnose compilation or test failures using an AI model.
 
     The endpoint accepts base64-gzip encoded files along with an error log and a
     summary of recent changes. It routes the request to either a light or
     full model based on heuristics, then returns the model's JSON response.
+    When the model could not be used the response is simulated and carries
+    ``"fallback": true`` with a `fallback_reason`.
     """
-    # Decode file contents (for context extraction and embedding)
-    decoded_files = decode_files(req.files)
-    # Build vector embeddings for the uploaded files
-    embed_files(decoded_files)
-    # Choose the appropriate model based on heuristics
-    model_name = choose_model(req.error_log, req.files)
-    # Parse error log to find file and line number references
-    refs = parse_error_log(req.error_log)
-    # Extract code snippets around each reference from decoded files
-    context_snippets = extract_context(decoded_files, refs)
-    # Build context section text
-    context_sections: list[str] = []
-    for snip in context_snippets:
-        header = f"Context from {snip['filename']} (lines {snip['start']}-{snip['end']}):"
-        context_sections.append(header + "\n" + snip['snippet'])
-    context_section = "\n\n".join(context_sections)
-    # Query vector store for relevant snippets based on the error log and summary
-    query_text = f"{req.error_log}\n{req.summary}"
-    vector_snippets = query_snippets(query_text, k=5)
-    # Build the prompt using the dedicated prompt builder (includes few-shot examples)
-    from . import prompt_builder  # local import to avoid cycles
-    prompt = prompt_builder.build_prompt(
-        error_log=req.error_log,
-        summary=req.summary,
-        retrieved_snippets=vector_snippets,
-        context_snippets=[context_section] if context_section else None,
+    DIAGNOSE_REQUESTS.inc()
+    try:
+        return await run_diagnosis(req)
+    except Exception:
+        DIAGNOSE_FAILURES.inc()
+        raise
+
+
+async def run_diagnosis(req: DiagnoseRequest) -> dict:
+    """Produce the diagnosis response body for `req`."""
+    try:
+        indexed = await run_in_threadpool(index_files, req.files, req.session_id)
+    except (PayloadTooLarge, MissingBlobs, HashMismatch) as exc:
+        raise upload_error(exc)
+    return await diagnose_failure(indexed, req.error_log, req.summary)
+
+
+@app.post('/diagnose/upload')
+async def diagnose_upload(request: Request):
+    """Diagnose a failure from a multipart upload instead of base64 JSON.
+
+    Form fields are `error_log`, `summary` and optionally `session_id`. Each
+    `files` part holds raw bytes: a source file, a gzip-compressed source
+    file, or a tar, tar.gz or zip archive of many, detected from its content.
+    A large `error_log` may be sent as a file part rather than a field. The
+    response is the same as for `/diagnose`.
+    """
+    DIAGNOSE_REQUESTS.inc()
+    try:
+        return await run_upload_diagnosis(request)
+    except Exception:
+        DIAGNOSE_FAILURES.inc()
+        raise
+
+
+def read_uploads(parts: List[Any]) -> List[dict]:
+    """Decode the `files` parts of a multipart upload."""
+    reader = ArchiveReader()
+    for part in parts:
+        reader.add(part.filename or 'upload', part.file)
+    return reader.files
+
+
+async def form_text(value: Any) -> str:
+    """Return a form field, or the text of a file part, as a string."""
+    if isinstance(value, str):
+        return value
+    if value.size is not None and value.size > MAX_FILE_BYTES:
+        raise HTTPException(status_code=413, detail='error_log exceeds the per-file limit')
+    return str(await value.read(), 'utf-8', 'ignore')
+
+
+async def run_upload_diagnosis(request: Request) -> dict:
+    """Produce the diagnosis response body for a multipart upload."""
+    async with request.form(
+        max_files=UPLOAD_MAX_PARTS, max_fields=UPLOAD_MAX_PARTS, max_part_size=UPLOAD_MAX_FIELD_BYTES,
+    ) as form:
+        if 'error_log' not in form:
+            raise HTTPException(status_code=422, detail='error_log is required')
+        parts = form.getlist('files')
+        if any(isinstance(part, str) for part in parts):
+            raise HTTPException(status_code=422, detail='files must be file parts')
+        error_log = await form_text(form['error_log'])
+        summary = await form_text(form.get('summary', ''))
+        session_id = form.get('session_id')
+        try:
+            decoded_files = await run_in_threadpool(read_uploads, parts)
+        except (PayloadTooLarge, MalformedArchive) as exc:
+            raise upload_error(exc)
+        DIAGNOSE_PAYLOAD_BYTES.observe(sum(part.size or 0 for part in parts), form='encoded')
+    indexed = await run_in_threadpool(
+        index_decoded, decoded_files, decoded_files, session_id if isinstance(session_id, str) else None,
     )
+    return await diagnose_failure(indexed, error_log, summary)
+
+
+async def lookup_fingerprint(key: Optional[str]) -> Optional[dict]:
+    """Return a past diagnosis stored under fingerprint `key`, if any."""
+    if key is None:
+        return None
+    body = await fingerprint_cache.get_async(key)
+    if body is not None:
+        DIAGNOSE_CACHE.inc(status=FINGERPRINT_HIT)
+    return body
+
+
+async def diagnose_failure(indexed: IndexedFiles, error_log: str, summary: str) -> dict:
+    """Diagnose one failure against indexed files.
+
+    A failure whose fingerprint matches a past diagnosis over the same
+    relevant file contents is answered from `fingerprint_cache`, and one a
+    rule answers confidently from `rule_engine`, without building a prompt
+    or calling the model.
+    """
+    import time
+    start_time = time.perf_counter()
+    key = await run_in_threadpool(reuse_key, indexed, error_log)
+    body = await lookup_fingerprint(key)
+    if body is not None:
+        record_metrics('', body, int((time.perf_counter() - start_time) * 1000), FINGERPRINT_HIT)
+        return body
+    hit = await run_in_threadpool(apply_rules, indexed, error_log)
+    if hit is not None:
+        return rule_answer(hit, int((time.perf_counter() - start_time) * 1000))
+    features = diagnosis_features(indexed, error_log)
+    model_name, prompt = await run_in_threadpool(build_diagnosis_prompt, indexed, error_log, summary, features)
+    return await complete_diagnosis(model_name, prompt, key, features)
+
+
+async def complete_diagnosis(
+    model_name: str,
+    prompt: str,
+    fingerprint_key: Optional[str] = None,
+    features: Optional[RouteFeatures] = None,
+) -> dict:
+    """Call the model for a prepared prompt and return the validated response body.
+
+    Real (not simulated) answers are also stored under `fingerprint_key`.
+    The model that answered (the hedge model when a hedged request won) and
+    the request `features` are recorded with the metrics so the router can
+    learn from the call.
+    """
     # Record start time for duration metric
     import time
     start_time = time.perf_counter()
-    result = call_openai(model_name, prompt)
+    result, cache_status, answered_by = await cached_call_openai(model_name, prompt)
     end_time = time.perf_counter()
+    DIAGNOSE_STAGE_SECONDS.observe(end_time - start_time, stage='model')
     duration_ms = int((end_time - start_time) * 1000)
     # Ensure response adheres to the expected schema
     try:
-        # Validate presence of keys and correct types
-        root_cause = result.get('root_cause', '')
-        confidence = float(result.get('confidence', 0.0))
-        patches = result.get('patches', [])
-        follow_up = result.get('follow_up')
-        agent_block = result.get('agent_block', '')
+        body = normalise_result(result)
     except Exception as exc:
         raise HTTPException(status_code=500, detail=f'Invalid response from model: {exc}')
+    record_metrics(prompt, body, duration_ms, cache_status, answered_by, features)
+    if fingerprint_key is not None and cache_status is not None:
+        try:
+            await fingerprint_cache.set_async(fingerprint_key, body)
+        except Exception:
+            pass  # reuse is best effort
+    return body
+
 
-    # Compute approximate token counts for metrics
-    # Prompt tokens: split prompt by whitespace
-    prompt_tokens = len(prompt.split())
+def normalise_result(result: dict) -> dict:
+    """Return the response body for a model result, coercing field types.
+
+    Raises if the result is not a mapping or `confidence` is not numeric.
+    `fallback` is true only for simulated responses, with `fallback_reason`
+    saying why the model was not used.
+    """
+    fallback = result.get('fallback') is True
+    # Validate presence of keys and correct types
+    return {
+        'root_cause': result.get('root_cause', ''),
+        'confidence': float(result.get('confidence', 0.0)),
+        'patches': result.get('patches', []),
+        'follow_up': result.get('follow_up'),
+        'agent_block': result.get('agent_block', ''),
+        'fallback': fallback,
+        'fallback_reason': result.get('fallback_reason') if fallback else None,
+    }
+
+
+def record_metrics(
+    prompt: str,
+    body: dict,
+    duration_ms: int,
+    cache_status: Optional[str],
+    model: Optional[str] = None,
+    features: Optional[RouteFeatures] = None,
+    rule: Optional[str] = None,
+    saved_ms: Optional[int] = None,
+) -> None:
+    """Queue the metrics row for a completed diagnosis.
+
+    `model` and `features` describe the routing decision; they are left
+    empty for diagnoses that did not reach model selection. `rule` and
+    `saved_ms` are set for diagnoses answered by a rule.
+    """
+    # Compute token counts for metrics with the same estimator used for budgets
+    prompt_tokens = estimate_tokens(prompt)
     # Completion tokens: count tokens from root cause, patches, follow_up (if any), and agent_block
     def count_tokens(text: str) -> int:
-        return len(text.split()) if text else 0
-    completion_tokens = count_tokens(str(root_cause)) + sum(count_tokens(patch) for patch in (patches or []))
-    if follow_up:
-        completion_tokens += count_tokens(str(follow_up))
-    completion_tokens += count_tokens(str(agent_block))
+        return estimate_tokens(text) if text else 0
+    completion_tokens = count_tokens(str(body['root_cause'])) + sum(count_tokens(patch) for patch in (body['patches'] or []))
+    if body['follow_up']:
+        completion_tokens += count_tokens(str(body['follow_up']))
+    completion_tokens += count_tokens(str(body['agent_block']))
     total_tokens = prompt_tokens + completion_tokens
-    # Log metrics
+    # Log metrics; this only queues the row, the writer thread does the I/O
     try:
-        log_call(duration_ms, prompt_tokens, completion_tokens, total_tokens, confidence)
+        metrics_writer.log(
+            duration_ms, prompt_tokens, completion_tokens, total_tokens, body['confidence'],
+            cache_status=cache_status,
+            model=model,
+            log_chars=features.log_chars if features else None,
+            file_count=features.file_count if features else None,
+            exception=(features.exception or None) if features else None,
+            input_tokens=features.input_tokens if features else None,
+            rule=rule,
+            saved_ms=saved_ms,
+        )
     except Exception:
         # Ignore logging errors to avoid failing the request
         pass
-    return {
-        'root_cause': root_cause,
-        'confidence': confidence,
-        'patches': patches,
-        'follow_up': follow_up,
-        'agent_block': agent_block
-    }
\ No newline at end of file
+
+
+@app.post('/diagnose/batch')
+async def diagnose_batch(req: BatchDiagnoseRequest):
+    """Diagnose many failures against one shared set of files.
+
+    The files are decoded and embedded once; context is then extracted and a
+    prompt built per failure, and up to `BATCH_CONCURRENCY` model calls run at
+    a time. Results stream back as newline-delimited JSON in completion order,
+    one object per failure: ``{"index", "id", "status": 200, "result"}`` or,
+    if that failure could not be diagnosed, ``{"index", "id", "status",
+    "error"}``.
+    """
+    if len(req.failures) > BATCH_MAX_FAILURES:
+        raise HTTPException(status_code=413, detail=f'At most {BATCH_MAX_FAILURES} failures per batch')
+    try:
+        indexed = await run_in_threadpool(index_files, req.files, req.session_id)
+    except (PayloadTooLarge, MissingBlobs, HashMismatch) as exc:
+        raise upload_error(exc)
+    return StreamingResponse(stream_batch(req, indexed), media_type='application/x-ndjson')
+
+
+async def stream_batch(req: BatchDiagnoseRequest, indexed: IndexedFiles) -> AsyncIterator[str]:
+    """Yield one JSON line per failure as its diagnosis completes."""
+    semaphore = asyncio.Semaphore(max(1, BATCH_CONCURRENCY))
+
+    async def diagnose_one(index: int, failure: BatchFailure) -> dict:
+        DIAGNOSE_REQUESTS.inc()
+        line = {'index': index, 'id': failure.id}
+        try:
+            summary = req.summary if failure.summary is None else failure.summary
+            async with semaphore:
+                result = await diagnose_failure(indexed, failure.error_log, summary)
+        except HTTPException as exc:
+            DIAGNOSE_FAILURES.inc()
+            return {**line, 'status': exc.status_code, 'error': exc.detail}
+        except Exception as exc:
+            DIAGNOSE_FAILURES.inc()
+            return {**line, 'status': 500, 'error': str(exc)}
+        return {**line, 'status': 200, 'result': result}
+
+    tasks = [asyncio.create_task(diagnose_one(i, failure)) for i, failure in enumerate(req.failures)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield json.dumps(await next_done) + "\n"
+    finally:
+        # The client may disconnect mid-batch; do not leave model calls running
+        for task in tasks:
+            task.cancel()
+
+
+def sse_event(event: str, data) -> str:
+    """Format one server-sent event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def result_events(result: dict) -> List[str]:
+    """Return the field and patch events for a result that is already complete."""
+    events = [sse_event('field', {'name': 'root_cause', 'value': result.get('root_cause')})]
+    events.append(sse_event('field', {'name': 'confidence', 'value': result.get('confidence')}))
+    for index, patch in enumerate(result.get('patches') or []):
+        events.append(sse_event('patch', {'index': index, 'value': patch}))
+    for name in ('follow_up', 'agent_block'):
+        events.append(sse_event('field', {'name': name, 'value': result.get(name)}))
+    return events
+
+
+@app.post('/diagnose/stream')
+async def diagnose_stream(req: DiagnoseRequest):
+    """Stream a diagnosis as server-sent events.
+
+    Accepts the same body as `/diagnose`. Emits a `field` event
+    (``{"name", "value"}``) as each top-level field of the model's answer
+    completes, a `patch` event (``{"index", "value"}``) per patch, and finally
+    a `result` event carrying the validated response object. An `error`
+    event ends the stream if the model fails after output has started.
+    """
+    import time
+    DIAGNOSE_REQUESTS.inc()
+    try:
+        indexed = await run_in_threadpool(index_files, req.files, req.session_id)
+    except (PayloadTooLarge, MissingBlobs, HashMismatch) as exc:
+        DIAGNOSE_FAILURES.inc()
+        raise upload_error(exc)
+    key = await run_in_threadpool(reuse_key, indexed, req.error_log)
+    # As in `diagnose_failure`: a stored diagnosis first, then the rules
+    reused = await lookup_fingerprint(key)
+    model_name, prompt, features = '', '', None
+    if reused is None:
+        start_time = time.perf_counter()
+        hit = await run_in_threadpool(apply_rules, indexed, req.error_log)
+        if hit is not None:
+            body = rule_answer(hit, int((time.perf_counter() - start_time) * 1000))
+            return StreamingResponse(
+                iter(result_events(body) + [sse_event('result', body)]),
+                media_type='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+            )
+        features = diagnosis_features(indexed, req.error_log)
+        model_name, prompt = await run_in_threadpool(
+            build_diagnosis_prompt, indexed, req.error_log, req.summary, features,
+        )
+    return StreamingResponse(
+        stream_diagnosis(model_name, prompt, key, features, reused),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+async def stream_diagnosis(
+    model_name: str,
+    prompt: str,
+    fingerprint_key: Optional[str] = None,
+    features: Optional[RouteFeatures] = None,
+    reused: Optional[dict] = None,
+) -> AsyncIterator[str]:
+    """Yield the server-sent events for one streamed diagnosis.
+
+    `reused` is a diagnosis already found under `fingerprint_key`; it is
+    replayed instead of calling the model.
+    """
+    import time
+    start_time = time.perf_counter()
+    first_event = True
+
+    def started() -> None:
+        nonlocal first_event
+        if first_event:
+            first_event = False
+            DIAGNOSE_STREAM_FIRST_EVENT_SECONDS.observe(time.perf_counter() - start_time)
+
+    cache_status: Optional[str] = None
+    # Cached and simulated results arrive whole and are replayed as events
+    replay = True
+    result = reused
+    if result is not None:
+        cache_status = FINGERPRINT_HIT
+    elif not os.environ.get('OPENAI_API_KEY'):
+        result = fallback_response(prompt, 'no_api_key')
+    else:
+        key = make_cache_key(model_name, SYSTEM_PROMPT_VERSION, prompt)
+        result = await response_cache.get_async(key)
+        if result is not None:
+            cache_status = HIT
+        elif not upstream.breaker.allow():
+            result = fallback_response(prompt, 'circuit_open')
+        else:
+            parser = JsonObjectStream()
+            patch_index = 0
+            streamed = False
+            try:
+                async for delta in stream_completion(model_name, prompt):
+                    for kind, name, value in parser.feed(delta):
+                        if kind == ITEM and name == 'patches':
+                            event = sse_event('patch', {'index': patch_index, 'value': value})
+                            patch_index += 1
+                        elif kind == FIELD and name != 'patches':
+                            event = sse_event('field', {'name': name, 'value': value})
+                        else:
+                            continue
+                        started()
+                        streamed = True
+                        yield event
+                    if parser.done:
+                        break
+                result = parser.result()
+            except Exception as exc:
+                if is_retryable(exc):
+                    upstream.breaker.record_failure()
+                if streamed:
+                    # Part of the answer is already out; a simulated one would contradict it
+                    DIAGNOSE_FAILURES.inc()
+                    yield sse_event('error', {'detail': f'Upstream stream failed: {exc}'})
+                    return
+                result = fallback_response(prompt, 'upstream_error')
+            else:
+                upstream.breaker.record_success()
+                cache_status = MISS
+                replay = False
+                try:
+                    await response_cache.set_async(key, result)
+                except Exception:
+                    pass  # caching is best effort
+        if cache_status is not None:
+            DIAGNOSE_CACHE.inc(status=cache_status)
+    if replay:
+        for event in result_events(result):
+            started()
+            yield event
+    end_time = time.perf_counter()
+    DIAGNOSE_STAGE_SECONDS.observe(end_time - start_time, stage='model')
+    try:
+        body = normalise_result(result)
+    except Exception as exc:
+        DIAGNOSE_FAILURES.inc()
+        yield sse_event('error', {'detail': f'Invalid response from model: {exc}'})
+        return
+    yield sse_event('result', body)
+    if cache_status == FINGERPRINT_HIT:
+        record_metrics('', body, int((end_time - start_time) * 1000), cache_status)
+    else:
+        record_metrics(prompt, body, int((end_time - start_time) * 1000), cache_status, model_name, features)
+    if fingerprint_key is not None and cache_status in (HIT, MISS):
+        try:
+            await fingerprint_cache.set_async(fingerprint_key, body)
+        except Exception:
+            pass  # reuse is best effort
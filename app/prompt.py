@@ -7,6 +7,8 @@ schema, describes the required keys and their types, and specifies how to
 handle confidence gating and diff formatting.
 """
 
+import hashlib
+
 # SYSTEM_PROMPT is sent as the system message when interacting with the LLM. It
 # guides the model to return a strict JSON object with the following keys:
 #
@@ -68,4 +70,8 @@ failures and propose minimal code changes. Follow these rules strictly:
 8. Never invent file paths or code that do not exist in the provided files.
 9. Do not output any explanation outside the JSON object. The JSON must be
    valid and parseable.
-""".strip()
\ No newline at end of file
+""".strip()
+
+# Short digest of SYSTEM_PROMPT. Caches of model responses include it in their
+# keys so that editing the instructions invalidates previously cached answers.
+SYSTEM_PROMPT_VERSION: str = hashlib.sha256(SYSTEM_PROMPT.encode("utf-8")).hexdigest()[:12]
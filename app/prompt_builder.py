@@ -9,21 +9,91 @@ Composes a structured prompt with the following sections::
 5. Error log
 6. Summary of recent changes
 7. File list
+
+Sections 1 and 2 are the same for every request, so they are rendered once
+into a cached prefix and rebuilt only when the exemplar file changes on disk.
+
+`assemble_prompt` additionally fits the prompt into a token budget. Sections
+are funded in priority order (error log, summary, code context, retrieved
+snippets, exemplars); whatever does not fit is trimmed or dropped, and the
+result records what was cut.
 """
 from __future__ import annotations
 
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Iterable, List
+from typing import Iterable, List, Optional, Tuple
 import json
+import threading
+
+try:
+    from .utils.tokens import estimate_tokens, truncate_to_tokens  # type: ignore
+except Exception:
+    from utils.tokens import estimate_tokens, truncate_to_tokens  # type: ignore
+
+# Share of the budget the error log may take before other sections are funded
+ERROR_LOG_SHARE = 0.5
+# Smallest remainder worth filling with a truncated snippet rather than dropping it
+MIN_PARTIAL_TOKENS = 200
+TRUNCATION_MARKER = "[... truncated ...]"
 
 SYSTEM_INSTR = "You are an expert software engineer assisting with automated bug fixing.  Respond **only** with valid JSON that follows the provided schema."
 
 _EXEMPLAR_PATH = Path(__file__).with_suffix(".examples.json")
 
+# Exemplars and the rendered static prefix, keyed by the exemplar file's
+# (mtime_ns, size) so edits are picked up without a restart
+_cache_lock = threading.Lock()
+_cache_signature: Optional[Tuple[int, int]] = None
+_cache_loaded = False
+_cached_examples: List[dict] = []
+_cached_prefix: str = SYSTEM_INSTR
+
+
+def _file_signature() -> Optional[Tuple[int, int]]:
+    try:
+        stat = _EXEMPLAR_PATH.stat()
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _refresh() -> Tuple[List[dict], str]:
+    """Return ``(examples, prefix)``, re-reading the exemplar file only if it changed."""
+    global _cache_signature, _cache_loaded, _cached_examples, _cached_prefix
+    signature = _file_signature()
+    with _cache_lock:
+        if not _cache_loaded or signature != _cache_signature:
+            examples = json.loads(_EXEMPLAR_PATH.read_text(encoding="utf-8")) if signature else []
+            parts = [SYSTEM_INSTR]
+            if examples:
+                parts.append("Few-shot examples:\n" + "\n\n".join(ex["example"] for ex in examples))
+            _cached_examples = examples
+            _cached_prefix = "\n\n".join(parts)
+            _cache_signature = signature
+            _cache_loaded = True
+        return _cached_examples, _cached_prefix
+
+
 def _load_examples() -> List[dict]:
-    if _EXEMPLAR_PATH.exists():
-        return json.loads(_EXEMPLAR_PATH.read_text(encoding="utf-8"))
-    return []
+    return _refresh()[0]
+
+
+@dataclass
+class PromptAssembly:
+    """A prompt fitted to a token budget.
+
+    Attributes:
+      prompt: The assembled prompt text.
+      tokens: Estimated token count of `prompt`.
+      budget: The budget it was fitted to, or None when unbounded.
+      trimmed: Names of sections that were truncated or dropped.
+    """
+
+    prompt: str
+    tokens: int
+    budget: Optional[int] = None
+    trimmed: List[str] = field(default_factory=list)
 
 
 def build_prompt(error_log: str,
@@ -31,13 +101,8 @@ def build_prompt(error_log: str,
                  retrieved_snippets: Iterable[str] | None = None,
                  context_snippets: Iterable[str] | None = None) -> str:
     """Return the full prompt string given all components."""
-    parts: list[str] = [SYSTEM_INSTR]
-
-    # Few-shot examples
-    examples = _load_examples()
-    if examples:
-        example_section = "\n\n".join(ex["example"] for ex in examples)
-        parts.append("Few-shot examples:\n" + example_section)
+    # System instructions and few-shot examples, rendered once per file version
+    parts: list[str] = [_refresh()[1]]
 
     if retrieved_snippets:
         parts.append("Relevant retrieved snippets:\n" + "\n\n".join(retrieved_snippets))
@@ -48,3 +113,101 @@ def build_prompt(error_log: str,
     parts.append(f"Summary of changes:\n{summary}")
     prompt = "\n\n".join(parts)
     return prompt
+
+
+def _fit_items(items: List[str], header: str, remaining: int) -> Tuple[List[str], int, bool]:
+    """Keep whole items in order while they fit, truncating the first that does not.
+
+    Returns ``(kept, tokens_used, trimmed)``.
+    """
+    kept: List[str] = []
+    used = estimate_tokens(header) + 2
+    if not items or used >= remaining:
+        return [], 0, bool(items)
+    for i, item in enumerate(items):
+        cost = estimate_tokens(item) + 2
+        if used + cost <= remaining:
+            kept.append(item)
+            used += cost
+            continue
+        room = remaining - used - estimate_tokens(TRUNCATION_MARKER) - 3
+        if room >= MIN_PARTIAL_TOKENS:
+            partial = truncate_to_tokens(item, room, keep="head")
+            kept.append(f"{partial}\n{TRUNCATION_MARKER}")
+            used += estimate_tokens(kept[-1]) + 2
+        return kept, (used if kept else 0), True
+    return kept, used, False
+
+
+def assemble_prompt(error_log: str,
+                    summary: str,
+                    retrieved_snippets: Iterable[str] | None = None,
+                    context_snippets: Iterable[str] | None = None,
+                    max_tokens: Optional[int] = None) -> PromptAssembly:
+    """Build the prompt, trimming low-priority sections to fit `max_tokens`.
+
+    Parameters:
+      error_log: Raw error log; when too long its tail (where the failing
+        frame and exception are) is kept.
+      summary: Summary of recent changes.
+      retrieved_snippets: Vector search results, best first.
+      context_snippets: Code windows around referenced lines, in log order.
+      max_tokens: Token budget for the whole prompt; None disables trimming.
+
+    The system instructions are always included. The error log may use at
+    most `ERROR_LOG_SHARE` of the budget, then the summary, code context,
+    retrieved snippets and exemplars are funded in that order. Section order
+    in the prompt is the same as `build_prompt`.
+    """
+    retrieved = list(retrieved_snippets or [])
+    context = list(context_snippets or [])
+    if max_tokens is None:
+        prompt = build_prompt(error_log, summary, retrieved, context)
+        return PromptAssembly(prompt, estimate_tokens(prompt))
+
+    examples, prefix = _refresh()
+    trimmed: List[str] = []
+    used = estimate_tokens(SYSTEM_INSTR)
+
+    log_room = int(max_tokens * ERROR_LOG_SHARE) - estimate_tokens("Error log:\n") - 2
+    kept_log = error_log
+    if estimate_tokens(error_log) > log_room:
+        kept_log = TRUNCATION_MARKER + "\n" + truncate_to_tokens(
+            error_log, log_room - estimate_tokens(TRUNCATION_MARKER) - 1, keep="tail"
+        )
+        trimmed.append("error_log")
+    used += estimate_tokens(f"Error log:\n{kept_log}") + 2
+
+    summary_room = max_tokens - used - estimate_tokens("Summary of changes:\n") - 2
+    kept_summary = truncate_to_tokens(summary, summary_room, keep="head")
+    if kept_summary != summary:
+        trimmed.append("summary")
+    used += estimate_tokens(f"Summary of changes:\n{kept_summary}") + 2
+
+    kept_context, cost, cut = _fit_items(context, "Relevant code context:\n", max_tokens - used)
+    used += cost
+    if cut:
+        trimmed.append("context")
+    kept_retrieved, cost, cut = _fit_items(retrieved, "Relevant retrieved snippets:\n", max_tokens - used)
+    used += cost
+    if cut:
+        trimmed.append("retrieved")
+    exemplar_texts = [ex["example"] for ex in examples]
+    kept_examples, cost, cut = _fit_items(exemplar_texts, "Few-shot examples:\n", max_tokens - used)
+    if cut:
+        trimmed.append("exemplars")
+        kept_examples = [text for text in kept_examples if text in exemplar_texts]  # whole exemplars only
+        parts = [SYSTEM_INSTR]
+        if kept_examples:
+            parts.append("Few-shot examples:\n" + "\n\n".join(kept_examples))
+        prefix = "\n\n".join(parts)
+
+    parts = [prefix]
+    if kept_retrieved:
+        parts.append("Relevant retrieved snippets:\n" + "\n\n".join(kept_retrieved))
+    if kept_context:
+        parts.append("Relevant code context:\n" + "\n\n".join(kept_context))
+    parts.append(f"Error log:\n{kept_log}")
+    parts.append(f"Summary of changes:\n{kept_summary}")
+    prompt = "\n\n".join(parts)
+    return PromptAssembly(prompt, estimate_tokens(prompt), max_tokens, trimmed)
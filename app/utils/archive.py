@@ -0,0 +1,168 @@
+"""
+Reading uploaded files from raw multipart parts and archives.
+
+The JSON API carries each file as gzip inside base64 inside a JSON string:
+a third larger on the wire, two full copies to decode, and megabyte-long
+strings for Pydantic to validate. `/diagnose/upload` instead takes
+multipart parts holding the bytes themselves, spooled to disk or memory by
+the multipart parser and read here in fixed-size chunks.
+
+A part may be a single source file, a gzip-compressed source file, or an
+archive (tar, tar.gz/.bz2/.xz, or zip) holding many. The format is detected
+from the leading bytes rather than the file name. Tar archives are read as
+a stream, member by member; zip archives are read through their central
+directory, which the spooled part allows. Every member is read with the
+same per-file and per-request output limits as `decode_files`, so a small
+archive cannot expand without bound; exceeding a limit raises
+`PayloadTooLarge`. Contents become text as in `decode_content`: UTF-8 with
+undecodable bytes dropped.
+"""
+
+import os
+import posixpath
+import tarfile
+import zipfile
+import zlib
+from typing import BinaryIO, Dict, List, Optional
+
+from .decoding import MAX_FILE_BYTES, MAX_REQUEST_BYTES, PayloadTooLarge, _Budget
+
+# Files accepted from all archives of one request
+ARCHIVE_MAX_FILES = int(os.environ.get("ARCHIVE_MAX_FILES", "10000"))
+
+_READ_CHUNK = 256 * 1024
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZIP_MAGIC = b"PK\x03\x04"
+BZIP2_MAGIC = b"BZh"
+XZ_MAGIC = b"\xfd7zXZ\x00"
+
+
+class MalformedArchive(ValueError):
+    """Raised when an upload looks like an archive but cannot be read."""
+
+
+def _read_limited(stream: BinaryIO, max_bytes: int, budget: Optional[_Budget]) -> str:
+    out = bytearray()
+    while True:
+        chunk = stream.read(_READ_CHUNK)
+        if not chunk:
+            break
+        if len(out) + len(chunk) > max_bytes:
+            raise PayloadTooLarge("decompressed file exceeds the per-file limit")
+        if budget is not None:
+            budget.consume(len(chunk))
+        out += chunk
+    return str(out, "utf-8", "ignore")
+
+
+def _inflate_gzip(stream: BinaryIO, max_bytes: int, budget: Optional[_Budget]) -> str:
+    out = bytearray()
+    inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    while True:
+        data = inflater.unconsumed_tail or stream.read(_READ_CHUNK)
+        if not data:
+            break
+        chunk = inflater.decompress(data, _READ_CHUNK)
+        if inflater.eof and inflater.unused_data:
+            # Concatenated gzip members
+            tail = inflater.unused_data
+            inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            chunk += inflater.decompress(tail, _READ_CHUNK)
+        if len(out) + len(chunk) > max_bytes:
+            raise PayloadTooLarge("decompressed file exceeds the per-file limit")
+        if budget is not None:
+            budget.consume(len(chunk))
+        out += chunk
+    if not inflater.eof:
+        raise EOFError("truncated gzip stream")
+    return str(out, "utf-8", "ignore")
+
+
+def _member_name(name: str) -> str:
+    return posixpath.normpath(name.replace("\\", "/")).lstrip("/")
+
+
+class ArchiveReader:
+    """Collect decoded files from the parts of one upload request.
+
+    Parameters:
+      max_file_bytes: Size limit for each file, after decompression.
+      max_request_bytes: Size limit for all files together.
+      max_files: Largest number of files accepted.
+    """
+
+    def __init__(
+        self,
+        max_file_bytes: int = MAX_FILE_BYTES,
+        max_request_bytes: int = MAX_REQUEST_BYTES,
+        max_files: int = ARCHIVE_MAX_FILES,
+    ) -> None:
+        self.max_file_bytes = max_file_bytes
+        self.max_files = max_files
+        self._budget = _Budget(max_request_bytes)
+        self.files: List[Dict[str, str]] = []
+
+    def _add(self, filename: str, content: str) -> None:
+        if len(self.files) >= self.max_files:
+            raise PayloadTooLarge(f"more than {self.max_files} files uploaded")
+        self.files.append({"filename": filename, "content": content})
+
+    def add(self, filename: str, fileobj: BinaryIO) -> None:
+        """Read one uploaded part, which may be a plain file or an archive.
+
+        Archive members are named by their path inside the archive.
+
+        Raises `PayloadTooLarge` when a limit is exceeded and
+        `MalformedArchive` when the part cannot be read.
+        """
+        head = fileobj.read(8)
+        fileobj.seek(0)
+        try:
+            if head.startswith(ZIP_MAGIC):
+                self._add_zip(fileobj)
+            elif head.startswith((GZIP_MAGIC, BZIP2_MAGIC, XZ_MAGIC)) or self._is_tar(fileobj):
+                self._add_compressed(filename, fileobj, gzipped=head.startswith(GZIP_MAGIC))
+            else:
+                self._add(filename, _read_limited(fileobj, self.max_file_bytes, self._budget))
+        except (tarfile.TarError, zipfile.BadZipFile, zlib.error, EOFError, OSError) as exc:
+            raise MalformedArchive(f"{filename}: {exc}") from exc
+
+    @staticmethod
+    def _is_tar(fileobj: BinaryIO) -> bool:
+        block = fileobj.read(tarfile.BLOCKSIZE)
+        fileobj.seek(0)
+        return len(block) == tarfile.BLOCKSIZE and block[257:262] == b"ustar"
+
+    def _add_compressed(self, filename: str, fileobj: BinaryIO, gzipped: bool) -> None:
+        try:
+            self._add_tar(fileobj)
+        except tarfile.ReadError:
+            if not gzipped:
+                raise
+            # Not a tarball: a single gzip-compressed source file
+            fileobj.seek(0)
+            name = filename[:-3] if filename.endswith(".gz") else filename
+            self._add(name, _inflate_gzip(fileobj, self.max_file_bytes, self._budget))
+
+    def _add_tar(self, fileobj: BinaryIO) -> None:
+        with tarfile.open(fileobj=fileobj, mode="r|*") as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                if member.size > self.max_file_bytes:
+                    raise PayloadTooLarge("decompressed file exceeds the per-file limit")
+                stream = tar.extractfile(member)
+                if stream is not None:
+                    self._add(_member_name(member.name), _read_limited(stream, self.max_file_bytes, self._budget))
+
+    def _add_zip(self, fileobj: BinaryIO) -> None:
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                # The declared size may lie; reading is capped regardless
+                if info.file_size > self.max_file_bytes:
+                    raise PayloadTooLarge("decompressed file exceeds the per-file limit")
+                with archive.open(info) as stream:
+                    self._add(_member_name(info.filename), _read_limited(stream, self.max_file_bytes, self._budget))
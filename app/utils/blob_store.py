@@ -0,0 +1,198 @@
+"""
+Content-addressed, size-capped on-disk store of decoded file contents.
+
+Clients used to upload every file, in full, on every diagnosis, although
+almost all of them are unchanged between calls. With the blob store the
+client first asks which SHA-256 hashes the server lacks, uploads only those,
+and then refers to files by hash; the server reads the decoded text back
+from disk instead of decoding base64-gzip again.
+
+Blobs are stored as UTF-8 text under ``<root>/<hash[:2]>/<hash>``, written
+to a temporary file and renamed into place so readers never see partial
+content. The hash is always the SHA-256 of the stored UTF-8 text, verified
+on insert. The store is capped at `BLOB_STORE_MAX_BYTES`; the least recently
+used blobs are evicted first. Recency is kept in memory and mirrored in file
+modification times, so it survives restarts.
+
+Several processes may share one store directory. Each keeps its own index,
+so a digest missing from it is looked up on disk before being reported
+missing, and blobs written by other processes are adopted on first use.
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Iterable, List, Optional
+
+BLOB_STORE_DIR = os.environ.get("BLOB_STORE_DIR", "blobs")
+BLOB_STORE_MAX_BYTES = int(os.environ.get("BLOB_STORE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+_HASH = re.compile(r"^[0-9a-f]{64}$")
+
+
+class HashMismatch(ValueError):
+    """Raised when content does not hash to the digest it was uploaded under."""
+
+
+class MissingBlobs(LookupError):
+    """Raised when a request refers to hashes the store does not hold."""
+
+    def __init__(self, digests: List[str]) -> None:
+        super().__init__(f"{len(digests)} referenced file(s) not stored")
+        self.digests = digests
+
+
+def content_hash(text: str) -> str:
+    """Return the SHA-256 hex digest of `text` encoded as UTF-8."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def is_valid_hash(digest: str) -> bool:
+    """Return whether `digest` is a lowercase SHA-256 hex digest."""
+    return bool(_HASH.match(digest))
+
+
+class BlobStore:
+    """Decoded file contents addressed by SHA-256, with LRU eviction.
+
+    Parameters:
+      root: Directory holding the blobs; created if missing.
+      max_bytes: Total size above which least recently used blobs are evicted.
+    """
+
+    def __init__(self, root: str = BLOB_STORE_DIR, max_bytes: int = BLOB_STORE_MAX_BYTES) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # digest -> size, least recently used first
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._bytes = 0
+        self._loaded = False
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    def _load(self) -> None:
+        """Index blobs already on disk, oldest access first (called with the lock held)."""
+        if self._loaded:
+            return
+        self._loaded = True
+        entries = []
+        if os.path.isdir(self.root):
+            for prefix in os.listdir(self.root):
+                folder = os.path.join(self.root, prefix)
+                if not os.path.isdir(folder):
+                    continue
+                for name in os.listdir(folder):
+                    if is_valid_hash(name):
+                        stat = os.stat(os.path.join(folder, name))
+                        entries.append((stat.st_mtime_ns, name, stat.st_size))
+        for _, digest, size in sorted(entries):
+            self._index[digest] = size
+            self._bytes += size
+        self._evict()
+
+    def _adopt(self, digest: str) -> bool:
+        """Index a blob another process stored since `_load` (called with the lock held)."""
+        if not is_valid_hash(digest):
+            return False
+        try:
+            size = os.stat(self._path(digest)).st_size
+        except FileNotFoundError:
+            return False
+        self._index[digest] = size
+        self._bytes += size
+        self._evict()
+        return digest in self._index
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._load()
+            return len(self._index)
+
+    @property
+    def nbytes(self) -> int:
+        with self._lock:
+            self._load()
+            return self._bytes
+
+    def missing(self, digests: Iterable[str]) -> List[str]:
+        """Return the digests in `digests` that are not stored, in order and without duplicates."""
+        with self._lock:
+            self._load()
+            seen = set()
+            result = []
+            for digest in digests:
+                if digest not in self._index and digest not in seen and not self._adopt(digest):
+                    seen.add(digest)
+                    result.append(digest)
+            return result
+
+    def get(self, digest: str) -> Optional[str]:
+        """Return the text stored under `digest` and mark it recently used, or None."""
+        with self._lock:
+            self._load()
+            if digest not in self._index and not self._adopt(digest):
+                return None
+            self._index.move_to_end(digest)
+        path = self._path(digest)
+        try:
+            with open(path, "rb") as fh:
+                data = fh.read()
+            os.utime(path)
+        except FileNotFoundError:
+            # Removed behind our back, e.g. by another process's eviction
+            with self._lock:
+                size = self._index.pop(digest, None)
+                if size is not None:
+                    self._bytes -= size
+            return None
+        return data.decode("utf-8")
+
+    def put(self, text: str, digest: Optional[str] = None) -> str:
+        """Store `text` and return its digest.
+
+        Raises `HashMismatch` if `digest` is given and does not match.
+        """
+        data = text.encode("utf-8")
+        actual = hashlib.sha256(data).hexdigest()
+        if digest is not None and digest != actual:
+            raise HashMismatch(f"content hashes to {actual}, not {digest}")
+        with self._lock:
+            self._load()
+            if actual in self._index:
+                self._index.move_to_end(actual)
+                return actual
+        path = self._path(actual)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except FileNotFoundError:
+                pass
+            raise
+        with self._lock:
+            if actual not in self._index:
+                self._index[actual] = len(data)
+                self._bytes += len(data)
+            self._index.move_to_end(actual)
+            self._evict()
+        return actual
+
+    def _evict(self) -> None:
+        # Never evict the most recently used blob, even if it alone exceeds the cap
+        while self._bytes > self.max_bytes and len(self._index) > 1:
+            digest, size = self._index.popitem(last=False)
+            self._bytes -= size
+            try:
+                os.unlink(self._path(digest))
+            except FileNotFoundError:
+                pass
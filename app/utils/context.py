@@ -4,56 +4,107 @@ references found in error logs.
 
 The functions here help minimise the amount of code sent to the language model by
 only including the relevant parts of files where errors occurred. A simple
-regex parser identifies filenames and line numbers in error messages, and then
+regex parser identifies filenames and line numbers in error messages in a
+single pass (deduplicated and capped, so deep recursion errors stay cheap), and then
 those lines (plus a configurable number of surrounding lines) are extracted
-from the decoded file contents.
+from the decoded file contents. A per-request `ContextIndex` resolves names
+and splits each file once, and overlapping windows are merged.
 """
 
 import os
 import re
-from typing import List, Tuple, Dict, Any
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, Union
 
 
-def parse_error_log(error_log: str) -> List[Tuple[str, int]]:
+# Maximum number of distinct references returned by parse_error_log
+MAX_ERROR_REFS = int(os.environ.get("ERROR_LOG_MAX_REFS", "200"))
+
+# One alternation so each log is scanned once; group 1/2 match
+# `File "path", line N` and group 3/4 match `path/to/file.py:N`
+_REFERENCE_PATTERN = re.compile(r'File "([^"]+?)",\s*line\s*(\d+)|([\w\.\-/]+\.py):(\d+)')
+
+
+def parse_error_log(
+    error_log: Union[str, Iterable[str]], max_refs: int = MAX_ERROR_REFS
+) -> List[Tuple[str, int]]:
     """Parse an error log for file and line number references.
 
     Supports common patterns such as:
       - File "/path/to/file.py", line 42
       - some/module/file.py:123
 
-    Returns a list of tuples (filename, line_number). The filename returned
-    is the basename of the path (e.g. 'file.py') so it can be matched
-    against decoded file names provided by the client. Line numbers are
-    returned as integers. If no line number is found, the reference is
-    omitted.
+    Returns a list of tuples (filename, line_number) in the order they appear
+    in the log. The filename returned is the basename of the path (e.g.
+    'file.py') so it can be matched against decoded file names provided by
+    the client. Line numbers are returned as integers. Repeated references,
+    such as the frames of a deep recursion, are returned once.
+
+    Parameters:
+      error_log: The log text, or an iterable of its lines (e.g. an open
+        file) so large logs can be scanned without holding a second copy.
+      max_refs: Scanning stops once this many distinct references are found.
     """
     references: List[Tuple[str, int]] = []
     if not error_log:
         return references
-    # Pattern 1: File "...", line X
-    pattern_file_line = re.compile(r'File "([^"]+?)",\s*line\s*(\d+)', re.MULTILINE)
-    # Pattern 2: path/to/file.py:X (colon separated)
-    pattern_colon = re.compile(r'([\w\.\-/]+\.py):(\d+)', re.MULTILINE)
-    for match in pattern_file_line.finditer(error_log):
-        file_path, line_str = match.groups()
-        filename = os.path.basename(file_path)
-        try:
-            line_no = int(line_str)
-            references.append((filename, line_no))
-        except ValueError:
-            continue
-    for match in pattern_colon.finditer(error_log):
-        file_path, line_str = match.groups()
-        filename = os.path.basename(file_path)
-        try:
-            line_no = int(line_str)
-            references.append((filename, line_no))
-        except ValueError:
-            continue
+    seen: Set[Tuple[str, int]] = set()
+    chunks = (error_log,) if isinstance(error_log, str) else error_log
+    for chunk in chunks:
+        for match in _REFERENCE_PATTERN.finditer(chunk):
+            file_path, line_str, colon_path, colon_line = match.groups()
+            if file_path is None:
+                file_path, line_str = colon_path, colon_line
+            ref = (os.path.basename(file_path), int(line_str))
+            if ref in seen:
+                continue
+            seen.add(ref)
+            references.append(ref)
+            if len(references) >= max_refs:
+                return references
     return references
 
 
-def extract_context(decoded_files: List[Dict[str, Any]], references: List[Tuple[str, int]], context_lines: int = 30) -> List[Dict[str, Any]]:
+class ContextIndex:
+    """Per-request lookup of decoded files by name, with cached line tables.
+
+    Builds a single map from both the full filename and its basename to the
+    first matching file, so resolving a reference is one dict lookup instead
+    of a scan over every file. Each file is split into lines at most once,
+    the first time a reference points into it.
+
+    Parameters:
+      decoded_files: list of dicts with keys 'filename' and 'content'.
+    """
+
+    def __init__(self, decoded_files: List[Dict[str, Any]]) -> None:
+        self.files = decoded_files
+        self._by_name: Dict[str, int] = {}
+        for i, file in enumerate(decoded_files):
+            filename = file.get('filename', '')
+            # setdefault keeps the first file in upload order, as a linear scan would
+            self._by_name.setdefault(os.path.basename(filename), i)
+            self._by_name.setdefault(filename, i)
+        self._lines: Dict[int, List[str]] = {}
+
+    def lookup(self, ref_filename: str) -> Optional[int]:
+        """Return the index of the first file matching `ref_filename`, if any."""
+        return self._by_name.get(ref_filename)
+
+    def lines(self, file_index: int) -> List[str]:
+        """Return the lines of the file at `file_index`, splitting it once."""
+        lines = self._lines.get(file_index)
+        if lines is None:
+            lines = self.files[file_index].get('content', '').splitlines()
+            self._lines[file_index] = lines
+        return lines
+
+
+def extract_context(
+    decoded_files: List[Dict[str, Any]],
+    references: List[Tuple[str, int]],
+    context_lines: int = 30,
+    index: Optional[ContextIndex] = None,
+) -> List[Dict[str, Any]]:
     """Extract surrounding code for each (filename, line_number) reference.
 
     Parameters:
@@ -63,6 +114,8 @@ def extract_context(decoded_files: List[Dict[str, Any]], references: List[Tuple[
         parse_error_log().
       context_lines: number of lines of context to include before and after
         the target line.
+      index: optional ContextIndex over decoded_files to reuse; one is built
+        when omitted.
 
     Returns a list of dictionaries containing:
       - filename: the name of the file
@@ -70,30 +123,50 @@ def extract_context(decoded_files: List[Dict[str, Any]], references: List[Tuple[
       - end: ending line number of the snippet (1-indexed)
       - snippet: the extracted text snippet
 
-    Only the first match for each reference is returned. If a file cannot be
-    found in decoded_files, that reference is skipped.
+    Each reference resolves to the first matching file. Windows that overlap
+    or touch within the same file are merged into one snippet, so nearby
+    frames do not repeat code in the prompt. Snippets are ordered by the
+    first reference they cover. References to unknown or empty files are
+    skipped.
     """
+    if index is None:
+        index = ContextIndex(decoded_files)
+    # file index -> list of (start_idx, end_idx, first reference position)
+    windows: Dict[int, List[Tuple[int, int, int]]] = {}
+    for position, (ref_filename, line_no) in enumerate(references):
+        file_index = index.lookup(ref_filename)
+        if file_index is None:
+            continue
+        lines = index.lines(file_index)
+        if not lines:
+            continue  # no content to extract
+        # Calculate 0-based indices
+        start_idx = max(0, line_no - context_lines - 1)
+        end_idx = min(len(lines), line_no + context_lines)
+        if start_idx >= end_idx:
+            continue  # reference points past the end of the file
+        windows.setdefault(file_index, []).append((start_idx, end_idx, position))
+
+    merged: List[Tuple[int, int, int, int]] = []
+    for file_index, spans in windows.items():
+        spans.sort()
+        cur_start, cur_end, cur_pos = spans[0]
+        for start_idx, end_idx, position in spans[1:]:
+            if start_idx <= cur_end:
+                cur_end = max(cur_end, end_idx)
+                cur_pos = min(cur_pos, position)
+            else:
+                merged.append((cur_pos, file_index, cur_start, cur_end))
+                cur_start, cur_end, cur_pos = start_idx, end_idx, position
+        merged.append((cur_pos, file_index, cur_start, cur_end))
+    merged.sort()
+
     snippets: List[Dict[str, Any]] = []
-    for ref_filename, line_no in references:
-        # Find the first file whose basename matches the reference (case sensitive)
-        for file in decoded_files:
-            # file['filename'] may contain directories; match basename and full path
-            file_basename = os.path.basename(file.get('filename', ''))
-            if file_basename == ref_filename or file.get('filename') == ref_filename:
-                content = file.get('content', '')
-                if not content:
-                    break  # no content to extract
-                lines = content.splitlines()
-                # Calculate 0-based indices
-                start_idx = max(0, line_no - context_lines - 1)
-                end_idx = min(len(lines), line_no + context_lines)
-                snippet_lines = lines[start_idx:end_idx]
-                snippet_text = "\n".join(snippet_lines)
-                snippets.append({
-                    'filename': file['filename'],
-                    'start': start_idx + 1,
-                    'end': end_idx,
-                    'snippet': snippet_text,
-                })
-                break  # stop searching decoded_files for this reference
-    return snippets
\ No newline at end of file
+    for _, file_index, start_idx, end_idx in merged:
+        snippets.append({
+            'filename': decoded_files[file_index]['filename'],
+            'start': start_idx + 1,
+            'end': end_idx,
+            'snippet': "\n".join(index.lines(file_index)[start_idx:end_idx]),
+        })
+    return snippets
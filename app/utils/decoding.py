@@ -0,0 +1,142 @@
+"""
+Bounded decoding of uploaded base64-gzip file payloads.
+
+Clients send every file as base64-encoded gzip. Decompressing with
+`gzip.decompress` inflates the whole member in one call with no upper bound,
+so a few kilobytes of crafted input can expand to gigabytes, and the
+intermediate `bytes` objects stack up several full-size copies of each file.
+
+`decode_files` instead streams each payload through a `zlib.decompressobj`,
+feeding the compressed bytes in fixed-size slices of a memoryview and
+appending output straight into one growing bytearray that is decoded to text
+in place. Output is capped per file (`DECODE_MAX_FILE_BYTES`) and per request
+(`DECODE_MAX_REQUEST_BYTES`); exceeding either raises `PayloadTooLarge`,
+which the API reports as HTTP 413. Large batches are decoded on a small
+thread pool because zlib releases the GIL while inflating.
+"""
+
+import binascii
+import os
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence
+
+MAX_FILE_BYTES = int(os.environ.get("DECODE_MAX_FILE_BYTES", str(20 * 1024 * 1024)))
+MAX_REQUEST_BYTES = int(os.environ.get("DECODE_MAX_REQUEST_BYTES", str(100 * 1024 * 1024)))
+# Total base64 characters above which a multi-file request is decoded in parallel
+PARALLEL_MIN_BYTES = int(os.environ.get("DECODE_PARALLEL_MIN_BYTES", str(1024 * 1024)))
+DECODE_WORKERS = int(os.environ.get("DECODE_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Compressed bytes fed to the decompressor per step, and the most output it may
+# produce per step; both keep per-step temporaries small regardless of file size
+_INPUT_CHUNK = 64 * 1024
+_OUTPUT_CHUNK = 256 * 1024
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+class PayloadTooLarge(ValueError):
+    """Raised when decompressed uploads exceed the configured byte limits."""
+
+
+class _Budget:
+    """Thread-safe count of decompressed bytes still allowed for one request."""
+
+    def __init__(self, limit: int) -> None:
+        self.remaining = limit
+        self._lock = threading.Lock()
+
+    def consume(self, n: int) -> None:
+        with self._lock:
+            self.remaining -= n
+            if self.remaining < 0:
+                raise PayloadTooLarge("decompressed files exceed the per-request limit")
+
+
+def _inflate(compressed: memoryview, max_bytes: int, budget: Optional[_Budget]) -> bytearray:
+    out = bytearray()
+    pos = 0
+    end = len(compressed)
+    while pos < end:
+        # One decompressor per gzip member; concatenated members are valid gzip
+        inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        while not inflater.eof:
+            if inflater.unconsumed_tail:
+                data = inflater.unconsumed_tail
+            elif pos < end:
+                data = compressed[pos:pos + _INPUT_CHUNK]
+                pos += len(data)
+            else:
+                raise zlib.error("truncated gzip stream")
+            chunk = inflater.decompress(data, _OUTPUT_CHUNK)
+            if chunk:
+                if len(out) + len(chunk) > max_bytes:
+                    raise PayloadTooLarge("decompressed file exceeds the per-file limit")
+                if budget is not None:
+                    budget.consume(len(chunk))
+                out += chunk
+        # Rewind over input the finished member did not use
+        pos -= len(inflater.unused_data)
+        if not any(compressed[pos:pos + 1]):
+            break  # trailing zero padding, as tolerated by some gzip writers
+    return out
+
+
+def decode_content(content: str, max_bytes: int = MAX_FILE_BYTES, budget: Optional[_Budget] = None) -> str:
+    """Decode one base64-gzip payload to text.
+
+    Parameters:
+      content: Base64 text of a gzip stream.
+      max_bytes: Largest decompressed size accepted for this payload.
+      budget: Optional shared per-request budget charged with the output size.
+
+    Raises `PayloadTooLarge` when a limit is exceeded and `ValueError` or
+    `zlib.error` when the payload is malformed.
+    """
+    compressed = binascii.a2b_base64(content)
+    raw = _inflate(memoryview(compressed), max_bytes, budget)
+    del compressed
+    return str(raw, "utf-8", "ignore")
+
+
+def _decode_one(item: Any, max_file_bytes: int, budget: _Budget) -> Dict[str, str]:
+    try:
+        text = decode_content(item.content, max_file_bytes, budget)
+    except PayloadTooLarge:
+        raise
+    except Exception:
+        text = ''
+    return {'filename': item.filename, 'content': text}
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix="decode")
+        return _executor
+
+
+def decode_files(
+    files: Sequence[Any],
+    max_file_bytes: int = MAX_FILE_BYTES,
+    max_request_bytes: int = MAX_REQUEST_BYTES,
+) -> List[Dict[str, str]]:
+    """Decode base64-gzip file contents to plain text.
+
+    Returns a list of dictionaries with filename and decoded text, in input
+    order. A file that fails to decode gets an empty `content`; exceeding a
+    size limit raises `PayloadTooLarge` for the whole request.
+
+    Parameters:
+      files: Objects with `filename` and `content` attributes.
+      max_file_bytes: Decompressed size limit for each file.
+      max_request_bytes: Decompressed size limit for all files together.
+    """
+    budget = _Budget(max_request_bytes)
+    total = sum(len(f.content) for f in files)
+    if len(files) < 2 or DECODE_WORKERS < 2 or total < PARALLEL_MIN_BYTES:
+        return [_decode_one(f, max_file_bytes, budget) for f in files]
+    return list(_get_executor().map(lambda f: _decode_one(f, max_file_bytes, budget), files))
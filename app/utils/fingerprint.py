@@ -0,0 +1,170 @@
+"""
+Normalised fingerprints of failures, for reusing diagnoses across requests.
+
+Two runs of the same broken test rarely produce byte-identical logs: temp
+directories, object addresses, timestamps, line numbers and parametrised test
+ids all vary, so the exact-prompt response cache misses them. A fingerprint
+keeps only what identifies the failure:
+
+* the exception type (the last ``SomethingError: message`` line),
+* the message with volatile tokens replaced by placeholders, and
+* the innermost project frames as ``file:function`` (without line numbers).
+
+Numbers and bracketed values are masked too, except in assertion and
+comparison messages, where the compared values are what tells one failure
+from another (``assert 200 == 404`` is not ``assert 200 == 500``).
+
+`failure_key` combines the fingerprint with a hash of the uploaded files
+those frames point into, so a diagnosis is only reused while the relevant
+code is unchanged. Without such a file there is nothing to tie the
+diagnosis to, and no key is produced.
+"""
+
+import hashlib
+import os
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from .context import parse_error_log
+
+# Past diagnoses are kept for a week by default
+FINGERPRINT_TTL_SECONDS = float(os.environ.get("FINGERPRINT_TTL_SECONDS", str(7 * 24 * 3600)))
+FINGERPRINT_ENABLED = os.environ.get("FINGERPRINT_CACHE", "1").lower() not in ("0", "false", "no")
+# Innermost project frames included in a fingerprint
+MAX_FRAMES = 5
+
+_EXCEPTION_LINE = re.compile(
+    r"^\s*(?:E\s+)?((?:[A-Za-z_][\w]*\.)*[A-Za-z_]\w*(?:Error|Exception|Exit|Interrupt|Failure|Warning))\b:?[ \t]*(.*)$",
+    re.MULTILINE,
+)
+_PY_FRAME = re.compile(r'File "([^"]+)", line \d+(?:, in ([^\s]+))?')
+# Volatile message fragments, most specific first
+_NORMALISERS: List[Tuple[re.Pattern, str]] = [
+    (re.compile(r"\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b", re.I), "<uuid>"),
+    (re.compile(r"\b0x[0-9a-f]+\b", re.I), "<addr>"),
+    (re.compile(r"\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:\.\d+)?(?:Z|[+-]\d{2}:?\d{2})?"), "<time>"),
+    (re.compile(r"\b\d{1,2}:\d{2}:\d{2}(?:\.\d+)?\b"), "<time>"),
+    (re.compile(r"(?:/tmp|/var/folders|/private/var/folders|[A-Za-z]:\\[^\s'\"]*\\Temp)[^\s'\":]*"), "<tmp>"),
+]
+# Masked only outside assertion and comparison messages
+_LITERAL_NORMALISERS: List[Tuple[re.Pattern, str]] = [
+    (re.compile(r"\[[^\[\]\s]*\]"), "[<param>]"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "<n>"),
+]
+_COMPARISON = re.compile(r"^\s*assert\b|\s(?:==|!=|<=|>=|<|>|is not|not in)\s")
+_THIRD_PARTY = ("site-packages", "dist-packages", "node_modules", "<frozen", "/lib/python")
+
+
+@dataclass(frozen=True)
+class Fingerprint:
+    """The stable identity of a failure.
+
+    Attributes:
+      exception: Exception type, e.g. 'ValueError'.
+      template: Exception message with volatile parts replaced.
+      frames: Innermost project frames as 'file:function', outermost first.
+      digest: SHA-256 over the three fields above.
+    """
+
+    exception: str
+    template: str
+    frames: Tuple[str, ...]
+    digest: str
+
+
+def normalise_message(message: str, keep_literals: bool = False) -> str:
+    """Replace addresses, ids, times, temp paths and numbers with placeholders.
+
+    With `keep_literals`, numbers and bracketed values are left as they are.
+    """
+    normalisers = _NORMALISERS if keep_literals else _NORMALISERS + _LITERAL_NORMALISERS
+    for pattern, placeholder in normalisers:
+        message = pattern.sub(placeholder, message)
+    return " ".join(message.split())
+
+
+def _frames(error_log: str) -> List[Tuple[str, str]]:
+    frames: List[Tuple[str, str]] = []
+    for match in _PY_FRAME.finditer(error_log):
+        frames.append((match.group(1), match.group(2) or ""))
+    if not frames:
+        # No Python traceback; fall back to the `file.py:N` references
+        frames = [(filename, "") for filename, _ in parse_error_log(error_log)]
+    return frames
+
+
+def exception_type(error_log: str, tail_chars: int = 8192) -> Optional[str]:
+    """Return the last exception type named in the tail of `error_log`, if any.
+
+    Only the last `tail_chars` characters are scanned, which is where the
+    raised exception is reported, so this stays cheap on multi-megabyte logs.
+    """
+    matches = list(_EXCEPTION_LINE.finditer(error_log[-tail_chars:]))
+    return matches[-1].group(1) if matches else None
+
+
+def fingerprint_failure(error_log: str) -> Optional[Fingerprint]:
+    """Return the fingerprint of `error_log`, or None if it names no exception.
+
+    Logs without a recognisable exception line are too generic to match
+    safely against past failures.
+    """
+    if not error_log:
+        return None
+    matches = list(_EXCEPTION_LINE.finditer(error_log))
+    if not matches:
+        return None
+    exception, message = matches[-1].group(1), matches[-1].group(2)
+    comparison = exception.endswith("AssertionError") or bool(_COMPARISON.search(message))
+    template = normalise_message(message, keep_literals=comparison)
+    project = [
+        f"{os.path.basename(path.replace(chr(92), '/'))}:{func}"
+        for path, func in _frames(error_log)
+        if not any(marker in path for marker in _THIRD_PARTY)
+    ]
+    # Collapse recursion so repeated frames do not change the fingerprint
+    unique: List[str] = []
+    for frame in project:
+        if not unique or unique[-1] != frame:
+            unique.append(frame)
+    frames = tuple(unique[-MAX_FRAMES:])
+    digest = hashlib.sha256("\0".join((exception, template, *frames)).encode("utf-8")).hexdigest()
+    return Fingerprint(exception, template, frames, digest)
+
+
+def relevant_files_digest(fingerprint: Fingerprint, decoded_files: List[Dict[str, Any]]) -> Optional[str]:
+    """Hash the uploaded files that the fingerprint's frames point into.
+
+    Returns None when no uploaded file matches a frame.
+    """
+    names = {frame.rsplit(":", 1)[0] for frame in fingerprint.frames}
+    hasher = hashlib.sha256()
+    matched = False
+    for file in sorted(decoded_files, key=lambda f: f.get("filename", "")):
+        filename = file.get("filename", "")
+        if os.path.basename(filename) in names:
+            matched = True
+            hasher.update(filename.encode("utf-8") + b"\0")
+            hasher.update(hashlib.sha256(file.get("content", "").encode("utf-8")).digest())
+    return hasher.hexdigest() if matched else None
+
+
+def failure_key(error_log: str, decoded_files: List[Dict[str, Any]], prompt_version: str) -> Optional[str]:
+    """Return the diagnosis reuse key for a failure, or None if it cannot be reused.
+
+    A failure cannot be reused when it has no fingerprint, or when none of
+    the uploaded files is one its frames point into.
+
+    Parameters:
+      error_log: The raw error log.
+      decoded_files: Uploaded files as returned by `decode_files`.
+      prompt_version: System prompt version, so prompt changes invalidate entries.
+    """
+    fingerprint = fingerprint_failure(error_log)
+    if fingerprint is None:
+        return None
+    files_digest = relevant_files_digest(fingerprint, decoded_files)
+    if files_digest is None:
+        return None
+    return hashlib.sha256(f"{fingerprint.digest}\0{files_digest}\0{prompt_version}".encode("utf-8")).hexdigest()
@@ -0,0 +1,438 @@
+"""
+Import-graph aware context selection for uploaded Python files.
+
+`extract_context` sends ±30 lines around every stack frame. For failures
+such as a circular import, what the model needs is the import statements of
+the modules involved and the definitions the failing code actually uses,
+and little else.
+
+`ImportGraph` parses each uploaded Python file once (summaries are cached by
+content hash and shared across requests), resolves its absolute and
+relative imports to other uploaded files, and records every definition with
+the names it uses. `select_context` then starts from the files of the
+failing frames and walks the graph breadth first up to
+`CONTEXT_GRAPH_MAX_DISTANCE` imports away. It keeps:
+
+* at the frames: the enclosing definition, or top-level statement, of each
+  frame line (or a window of `context_lines` around the line when that is
+  very long) plus the file's import statements;
+* one hop on: the definitions the frame code uses, whether defined in the
+  same file or imported from another;
+* further out: only the import statements between files within reach,
+  which is what a cycle is made of.
+
+Snippets are ordered by graph distance, then by the first frame they serve.
+References into files that are not Python or do not parse fall back to
+`extract_context` windows.
+"""
+
+import ast
+import hashlib
+import os
+import threading
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Any, Dict, FrozenSet, List, Optional, Sequence, Set, Tuple
+
+from .context import ContextIndex, extract_context
+
+CONTEXT_GRAPH_ENABLED = os.environ.get("CONTEXT_GRAPH", "1").lower() not in ("0", "false", "no")
+CONTEXT_GRAPH_MAX_DISTANCE = int(os.environ.get("CONTEXT_GRAPH_MAX_DISTANCE", "2"))
+# Definitions longer than this are cut to a window around the frame line
+CONTEXT_GRAPH_MAX_DEF_LINES = int(os.environ.get("CONTEXT_GRAPH_MAX_DEF_LINES", "80"))
+# Number of file summaries kept by content hash
+SUMMARY_CACHE_SIZE = 16384
+
+Span = Tuple[int, int]  # 1-indexed, inclusive line range
+
+# Spans separated by at most this many lines are sent as one snippet
+_MERGE_GAP = 2
+
+
+@dataclass(frozen=True)
+class Import:
+    """One ``import`` or ``from ... import`` statement."""
+
+    module: str  # dotted module as written, without leading dots
+    names: Tuple[str, ...]  # imported names for ``from`` imports, else ()
+    level: int  # number of leading dots
+    start: int
+    end: int
+
+
+@dataclass(frozen=True)
+class Definition:
+    """A function or class definition and the names its body uses."""
+
+    name: str
+    start: int
+    end: int
+    uses: FrozenSet[str]
+
+
+@dataclass(frozen=True)
+class FileSummary:
+    """What `ImportGraph` needs from one Python file."""
+
+    imports: Tuple[Import, ...]
+    definitions: Tuple[Definition, ...]
+    statements: Tuple[Span, ...]  # top-level statements, in order
+    # Top-level definitions and imported bindings by name
+    top_level: Dict[str, Definition]
+    bindings: Dict[str, Import]
+
+    def enclosing(self, line: int) -> Optional[Definition]:
+        """Return the innermost definition containing `line`, if any."""
+        best = None
+        for definition in self.definitions:
+            if definition.start <= line <= definition.end:
+                if best is None or definition.end - definition.start < best.end - best.start:
+                    best = definition
+        return best
+
+    def statement(self, line: int) -> Span:
+        """Return the top-level statement containing `line`, or the line alone."""
+        for start, end in self.statements:
+            if start <= line <= end:
+                return start, end
+        return line, line
+
+
+def _start(node: ast.AST) -> int:
+    decorators = getattr(node, "decorator_list", [])
+    return min([node.lineno] + [d.lineno for d in decorators])  # type: ignore[attr-defined]
+
+
+def summarise(text: str) -> Optional[FileSummary]:
+    """Parse Python source into a `FileSummary`, or None if it does not parse."""
+    try:
+        tree = ast.parse(text)
+    except (SyntaxError, ValueError):
+        return None
+    imports: List[Import] = []
+    definitions: List[Definition] = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                imports.append(Import(alias.name, (), 0, node.lineno, node.end_lineno or node.lineno))
+        elif isinstance(node, ast.ImportFrom):
+            names = tuple(alias.name for alias in node.names)
+            imports.append(Import(node.module or "", names, node.level, node.lineno, node.end_lineno or node.lineno))
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            uses = frozenset(
+                n.id for n in ast.walk(node) if isinstance(n, ast.Name) and isinstance(n.ctx, ast.Load)
+            )
+            definitions.append(Definition(node.name, _start(node), node.end_lineno or node.lineno, uses))
+    imports.sort(key=lambda imp: imp.start)
+    top_level = {}
+    bindings = {}
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            top_level[node.name] = next(d for d in definitions if d.start == _start(node) and d.name == node.name)
+    for imp in imports:
+        if imp.names:
+            for name in imp.names:
+                bindings[name] = imp
+        else:
+            bindings[imp.module.split(".")[0]] = imp
+    statements = tuple((_start(node), node.end_lineno or node.lineno) for node in tree.body)
+    return FileSummary(tuple(imports), tuple(definitions), statements, top_level, bindings)
+
+
+class SummaryCache:
+    """Thread-safe LRU of `FileSummary` objects keyed by content hash."""
+
+    def __init__(self, max_entries: int = SUMMARY_CACHE_SIZE) -> None:
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[str, Optional[FileSummary]]" = OrderedDict()
+
+    def get(self, text: str) -> Optional[FileSummary]:
+        digest = hashlib.sha256(text.encode("utf-8", errors="ignore")).hexdigest()
+        with self._lock:
+            if digest in self._items:
+                self._items.move_to_end(digest)
+                return self._items[digest]
+        summary = summarise(text)
+        with self._lock:
+            self._items[digest] = summary
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+        return summary
+
+
+# Summaries shared by every request in the process
+_shared_summaries = SummaryCache()
+
+
+def module_parts(filename: str) -> Tuple[str, ...]:
+    """Return the dotted-module path components implied by a file name."""
+    path = filename.replace("\\", "/").strip("/")
+    if path.endswith(".py"):
+        path = path[:-3]
+    parts = tuple(p for p in path.split("/") if p and p != ".")
+    if parts and parts[-1] == "__init__":
+        parts = parts[:-1]
+    return parts
+
+
+class ImportGraph:
+    """Imports between the uploaded Python files of one request.
+
+    Parameters:
+      decoded_files: Dicts with 'filename' and 'content'.
+      cache: Summary cache; the process-wide one by default.
+    """
+
+    def __init__(self, decoded_files: Sequence[Dict[str, Any]], cache: Optional[SummaryCache] = None) -> None:
+        cache = cache or _shared_summaries
+        self.files = decoded_files
+        self.summaries: Dict[int, FileSummary] = {}
+        self._packages: Dict[int, bool] = {}
+        self._by_path: Dict[Tuple[str, ...], int] = {}
+        self._by_suffix: Dict[Tuple[str, ...], List[int]] = {}
+        for i, file in enumerate(decoded_files):
+            filename = file.get("filename", "")
+            if not filename.endswith(".py"):
+                continue
+            summary = cache.get(file.get("content", ""))
+            if summary is None:
+                continue
+            self.summaries[i] = summary
+            parts = module_parts(filename)
+            self._packages[i] = filename.replace("\\", "/").endswith("__init__.py")
+            self._by_path.setdefault(parts, i)
+            for k in range(len(parts)):
+                self._by_suffix.setdefault(parts[k:], []).append(i)
+        # file -> [(import statement, target file)]
+        self.edges: Dict[int, List[Tuple[Import, int]]] = {
+            i: [(imp, target) for imp in summary.imports for target in self._resolve(i, imp)]
+            for i, summary in self.summaries.items()
+        }
+
+    def _lookup(self, parts: Tuple[str, ...], relative: bool) -> Optional[int]:
+        if not parts:
+            return None
+        if relative:
+            return self._by_path.get(parts)
+        candidates = self._by_suffix.get(parts)
+        # An absolute import that matches several files is ambiguous; skip it
+        return candidates[0] if candidates and len(candidates) == 1 else None
+
+    def _resolve(self, source: int, imp: Import) -> List[int]:
+        """Return the uploaded files `imp` in file `source` refers to."""
+        module = tuple(imp.module.split(".")) if imp.module else ()
+        if imp.level:
+            package = module_parts(self.files[source]["filename"])
+            if not self._packages[source]:
+                package = package[:-1]
+            if imp.level - 1 > len(package):
+                return []
+            base = package[:len(package) - (imp.level - 1)] + module
+        else:
+            base = module
+        relative = imp.level > 0
+        targets = []
+        for name in imp.names:
+            # `from pkg import module` imports a submodule when one exists
+            target = self._lookup(base + (name,), relative) if name != "*" else None
+            if target is not None and target != source:
+                targets.append(target)
+        if not targets:
+            target = self._lookup(base, relative)
+            if target is not None and target != source:
+                targets.append(target)
+        return targets
+
+    def distances(self, sources: Sequence[int], max_distance: int) -> Dict[int, int]:
+        """Return import-graph distances from `sources`, following edges both ways."""
+        neighbours: Dict[int, Set[int]] = {i: set() for i in self.summaries}
+        for source, edges in self.edges.items():
+            for _, target in edges:
+                neighbours[source].add(target)
+                neighbours[target].add(source)
+        dist = {s: 0 for s in sources if s in self.summaries}
+        queue = deque(dist)
+        while queue:
+            node = queue.popleft()
+            if dist[node] >= max_distance:
+                continue
+            for other in sorted(neighbours[node]):
+                if other not in dist:
+                    dist[other] = dist[node] + 1
+                    queue.append(other)
+        return dist
+
+    def cycles(self) -> List[List[int]]:
+        """Return the import cycles, as strongly connected groups of files.
+
+        Tarjan's algorithm with an explicit stack, so long import chains do
+        not hit the recursion limit.
+        """
+        index: Dict[int, int] = {}
+        low: Dict[int, int] = {}
+        stack: List[int] = []
+        on_stack: Set[int] = set()
+        result: List[List[int]] = []
+
+        for root in sorted(self.summaries):
+            if root in index:
+                continue
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            # (node, position of the next edge to follow)
+            work: List[Tuple[int, int]] = [(root, 0)]
+            while work:
+                node, position = work[-1]
+                edges = self.edges.get(node, [])
+                if position < len(edges):
+                    work[-1] = (node, position + 1)
+                    target = edges[position][1]
+                    if target not in index:
+                        index[target] = low[target] = len(index)
+                        stack.append(target)
+                        on_stack.add(target)
+                        work.append((target, 0))
+                    elif target in on_stack:
+                        low[node] = min(low[node], index[target])
+                    continue
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    group = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        group.append(member)
+                        if member == node:
+                            break
+                    if len(group) > 1:
+                        result.append(sorted(group))
+        return result
+
+
+def _merge(spans: List[Span]) -> List[Span]:
+    merged: List[Span] = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1] + _MERGE_GAP + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def select_context(
+    decoded_files: List[Dict[str, Any]],
+    references: List[Tuple[str, int]],
+    context_lines: int = 30,
+    index: Optional[ContextIndex] = None,
+    graph: Optional[ImportGraph] = None,
+    max_distance: int = CONTEXT_GRAPH_MAX_DISTANCE,
+) -> List[Dict[str, Any]]:
+    """Select code context for `references` by import-graph distance.
+
+    Parameters:
+      decoded_files: list of dicts with keys 'filename' and 'content'.
+      references: ``(filename, line)`` tuples from `parse_error_log`.
+      context_lines: Window size around frames whose definition is too long,
+        and for the `extract_context` fallback.
+      index: Optional `ContextIndex` over decoded_files to reuse.
+      graph: Optional `ImportGraph` over decoded_files to reuse.
+      max_distance: Imports to follow away from the frame files.
+
+    Returns snippet dicts like `extract_context`, with an extra 'distance'.
+    """
+    if index is None:
+        index = ContextIndex(decoded_files)
+    if graph is None:
+        graph = ImportGraph(decoded_files)
+    # file -> [(span, frame position)]
+    wanted: Dict[int, List[Tuple[Span, int]]] = {}
+    frame_files: List[int] = []
+    fallback_refs: List[Tuple[str, int]] = []
+    frame_uses: Dict[int, List[Tuple[Set[str], int]]] = {}
+    for position, (ref_filename, line_no) in enumerate(references):
+        file_index = index.lookup(ref_filename)
+        if file_index is None:
+            continue
+        summary = graph.summaries.get(file_index)
+        if summary is None:
+            fallback_refs.append((ref_filename, line_no))
+            continue
+        n_lines = len(index.lines(file_index))
+        if not 1 <= line_no <= n_lines:
+            continue
+        if file_index not in frame_files:
+            frame_files.append(file_index)
+        definition = summary.enclosing(line_no)
+        # The enclosing definition, or the top-level statement for module code
+        start, end = (definition.start, definition.end) if definition is not None else summary.statement(line_no)
+        if end - start + 1 > CONTEXT_GRAPH_MAX_DEF_LINES:
+            span = (max(start, line_no - context_lines), min(end, line_no + context_lines))
+        else:
+            span = (start, end)
+        wanted.setdefault(file_index, []).append((span, position))
+        if definition is not None:
+            frame_uses.setdefault(file_index, []).append((set(definition.uses), position))
+
+    if not frame_files:
+        return [dict(s, distance=0) for s in extract_context(decoded_files, references, context_lines, index)]
+
+    dist = graph.distances(frame_files, max_distance)
+    first_seen = {f: min(p for _, p in wanted[f]) for f in frame_files}
+    for file_index in frame_files:
+        summary = graph.summaries[file_index]
+        position = first_seen[file_index]
+        for imp in summary.imports:
+            wanted[file_index].append(((imp.start, imp.end), position))
+        # Definitions one hop away that the frame code uses
+        for uses, pos in frame_uses.get(file_index, []):
+            for name in uses:
+                local = summary.top_level.get(name)
+                if local is not None:
+                    wanted[file_index].append(((local.start, local.end), pos))
+                    continue
+                imp = summary.bindings.get(name)
+                if imp is None:
+                    continue
+                for source_imp, target in graph.edges.get(file_index, []):
+                    if source_imp is not imp:
+                        continue
+                    target_def = graph.summaries[target].top_level.get(name)
+                    if target_def is not None and target_def.end - target_def.start < CONTEXT_GRAPH_MAX_DEF_LINES:
+                        wanted.setdefault(target, []).append(((target_def.start, target_def.end), pos))
+                        first_seen.setdefault(target, pos)
+    # Files further out contribute their imports of files within reach
+    for file_index, distance in dist.items():
+        if distance == 0:
+            continue
+        for imp, target in graph.edges.get(file_index, []):
+            if target in dist:
+                position = first_seen.get(target, len(references))
+                wanted.setdefault(file_index, []).append(((imp.start, imp.end), position))
+
+    ordered: List[Tuple[int, int, int, Span]] = []
+    for file_index, spans in wanted.items():
+        distance = dist.get(file_index, 1)
+        position = min(p for _, p in spans)
+        for span in _merge([s for s, _ in spans]):
+            ordered.append((distance, position, file_index, span))
+    ordered.sort()
+
+    snippets: List[Dict[str, Any]] = []
+    for distance, _, file_index, (start, end) in ordered:
+        lines = index.lines(file_index)
+        snippets.append({
+            "filename": decoded_files[file_index]["filename"],
+            "start": start,
+            "end": end,
+            "snippet": "\n".join(lines[start - 1:end]),
+            "distance": distance,
+        })
+    if fallback_refs:
+        for snippet in extract_context(decoded_files, fallback_refs, context_lines, index):
+            snippets.append(dict(snippet, distance=0))
+    return snippets
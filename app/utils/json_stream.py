@@ -0,0 +1,133 @@
+"""
+Incremental parsing of a streamed JSON object.
+
+When the model streams its answer, the diagnosis arrives as a JSON object a
+few characters at a time. `JsonObjectStream` scans each chunk once, tracking
+string and nesting state, and reports every top-level member as soon as its
+value is complete, plus every element of a top-level array as soon as that
+element is complete. This lets `/diagnose/stream` forward `root_cause`
+within the first second of generation instead of after the whole object.
+
+Anything before the opening brace (for example a stray code fence) is
+ignored; the complete object is still parsed strictly by `result()`.
+"""
+
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+# Event kinds returned by JsonObjectStream.feed
+FIELD = "field"
+ITEM = "item"
+
+Event = Tuple[str, str, Any]
+
+
+class JsonObjectStream:
+    """Feed text chunks of one JSON object and collect completed parts.
+
+    `feed` returns a list of events: ``(FIELD, key, value)`` when a top-level
+    member completes and ``(ITEM, key, value)`` for each completed element of
+    a top-level array member (the FIELD event for the array follows once the
+    array closes).
+    """
+
+    def __init__(self) -> None:
+        self._text = ""
+        self._pos = 0  # next index of _text to scan
+        self._start: Optional[int] = None  # index of the opening brace
+        self._end: Optional[int] = None  # index just past the closing brace
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._key: Optional[str] = None
+        self._key_start: Optional[int] = None
+        self._value_start: Optional[int] = None
+        self._item_start: Optional[int] = None
+        self._array_value = False
+
+    @property
+    def done(self) -> bool:
+        """True once the top-level object has closed."""
+        return self._end is not None
+
+    def feed(self, chunk: str) -> List[Event]:
+        events: List[Event] = []
+        if self._end is not None or not chunk:
+            return events
+        self._text += chunk
+        text = self._text
+        i = self._pos
+        n = len(text)
+        while i < n:
+            ch = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._key is None and self._key_start is not None:
+                        self._key = json.loads(text[self._key_start:i + 1])
+                        self._key_start = None
+                i += 1
+                continue
+            if self._start is None:
+                if ch == "{":
+                    self._start = i
+                    self._depth = 1
+                i += 1
+                continue
+            if ch == '"':
+                self._in_string = True
+                if self._depth == 1 and self._key is None:
+                    self._key_start = i
+                elif self._depth == 2 and self._array_value and self._item_start is None:
+                    self._item_start = i
+            elif ch == ":" and self._depth == 1 and self._key is not None and self._value_start is None:
+                self._value_start = i + 1
+            elif ch in "{[":
+                if self._depth == 1 and self._value_start is not None and not text[self._value_start:i].strip():
+                    self._array_value = ch == "["
+                elif self._depth == 2 and self._array_value and self._item_start is None:
+                    self._item_start = i
+                self._depth += 1
+            elif ch in "}]" or ch == ",":
+                if self._depth == 2 and self._array_value:
+                    self._emit_item(text, i, events)
+                    if ch == "]":
+                        self._depth -= 1
+                elif self._depth == 1:
+                    self._emit_field(text, i, events)
+                    if ch == "}":
+                        self._depth = 0
+                        self._end = i + 1
+                        i += 1
+                        break
+                elif ch != ",":
+                    self._depth -= 1
+            elif self._depth == 2 and self._array_value and self._item_start is None and not ch.isspace():
+                self._item_start = i  # number, literal or other scalar element
+            i += 1
+        self._pos = i
+        return events
+
+    def _emit_item(self, text: str, end: int, events: List[Event]) -> None:
+        if self._item_start is not None and self._key is not None:
+            events.append((ITEM, self._key, json.loads(text[self._item_start:end])))
+        self._item_start = None
+
+    def _emit_field(self, text: str, end: int, events: List[Event]) -> None:
+        if self._key is not None and self._value_start is not None:
+            raw = text[self._value_start:end].strip()
+            if raw:
+                events.append((FIELD, self._key, json.loads(raw)))
+        self._key = None
+        self._value_start = None
+        self._array_value = False
+
+    def result(self) -> Dict[str, Any]:
+        """Parse and return the complete object; raises ValueError if it never closed."""
+        if self._start is None or self._end is None:
+            raise ValueError("JSON object is incomplete")
+        return json.loads(self._text[self._start:self._end])
@@ -0,0 +1,270 @@
+"""
+Response cache for upstream LLM calls.
+
+CI retries and several people hitting the same broken build produce
+byte-identical prompts, and every one of them would otherwise pay for a full
+model round trip. `ResponseCache` stores parsed model responses under a key
+derived from the model name, the system prompt version and a hash of the
+prompt.
+
+The cache has two tiers: an in-memory LRU bounded by entry count, and an
+optional SQLite tier (enabled by setting `LLM_CACHE_DB`) that survives
+restarts and is shared by workers on the same host. Entries expire after
+`LLM_CACHE_TTL_SECONDS`. Concurrent requests for a key that is already being
+computed wait for that single computation instead of issuing their own
+upstream call.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "1024"))
+CACHE_TTL_SECONDS = float(os.environ.get("LLM_CACHE_TTL_SECONDS", "3600"))
+CACHE_DB_PATH = os.environ.get("LLM_CACHE_DB") or None
+CACHE_DB_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_DB_MAX_ENTRIES", "100000"))
+
+# Cache outcomes reported by `ResponseCache.get_or_compute`
+HIT = "hit"
+MISS = "miss"
+COALESCED = "coalesced"
+
+
+class _ComputeCancelled(Exception):
+    """Raised to waiters when the task computing their key was cancelled."""
+
+
+def make_key(model: str, prompt_version: str, prompt: str) -> str:
+    """Return the cache key for a prompt sent to `model` under a system prompt version."""
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    return hashlib.sha256(f"{model}\0{prompt_version}\0{prompt_hash}".encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Two-tier TTL cache of JSON-serialisable responses with single-flight.
+
+    Parameters:
+      max_entries: Capacity of the in-memory LRU tier.
+      ttl: Seconds an entry stays valid in either tier.
+      db_path: Optional SQLite file for the persistent tier.
+      db_max_entries: Rows kept in the SQLite tier; least recently used rows
+        beyond this are deleted.
+      table: Name of the SQLite table, so several caches can share a file.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = CACHE_MAX_ENTRIES,
+        ttl: float = CACHE_TTL_SECONDS,
+        db_path: Optional[str] = CACHE_DB_PATH,
+        db_max_entries: int = CACHE_DB_MAX_ENTRIES,
+        table: str = "llm_cache",
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        self.db_max_entries = db_max_entries
+        self.table = table
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._inflight: Dict[str, "asyncio.Future[Dict[str, Any]]"] = {}
+        self._db_writes = 0
+        if db_path:
+            self._init_db()
+
+    # ------------------------------------------------------------------
+    # SQLite tier
+    # ------------------------------------------------------------------
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=5)  # type: ignore[arg-type]
+
+    def _init_db(self) -> None:
+        conn = self._connect()
+        try:
+            conn.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS {self.table} (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_accessed ON {self.table} (accessed_at)")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _db_get(self, key: str) -> Optional[Tuple[float, Dict[str, Any]]]:
+        now = time.time()
+        conn = self._connect()
+        try:
+            row = conn.execute(f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                conn.commit()
+                return None
+            conn.execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key))
+            conn.commit()
+            return row[1], json.loads(row[0])
+        finally:
+            conn.close()
+
+    def _db_set(self, key: str, expires_at: float, value: Dict[str, Any]) -> None:
+        conn = self._connect()
+        try:
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), expires_at, time.time()),
+            )
+            self._db_writes += 1
+            if self._db_writes % 100 == 0:
+                # Enforce TTL and size limits periodically rather than per write
+                conn.execute(f"DELETE FROM {self.table} WHERE expires_at <= ?", (time.time(),))
+                conn.execute(
+                    f"""
+                    DELETE FROM {self.table} WHERE key IN (
+                        SELECT key FROM {self.table} ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                    )
+                    """,
+                    (self.db_max_entries,),
+                )
+            conn.commit()
+        finally:
+            conn.close()
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached value for `key`, or None if absent or expired."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                    return entry[1]
+                del self._memory[key]
+        if self.db_path:
+            try:
+                stored = self._db_get(key)
+            except sqlite3.Error:
+                stored = None  # treat an unavailable disk tier as a miss
+            if stored is not None:
+                self._remember(key, *stored)
+                return stored[1]
+        return None
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        """Store `value` under `key` in every tier."""
+        expires_at = time.time() + self.ttl
+        self._remember(key, expires_at, value)
+        if self.db_path:
+            self._db_set(key, expires_at, value)
+
+    async def get_async(self, key: str) -> Optional[Dict[str, Any]]:
+        """`get` for event-loop callers; the SQLite tier is read off the loop."""
+        return await asyncio.to_thread(self.get, key) if self.db_path else self.get(key)
+
+    async def set_async(self, key: str, value: Dict[str, Any]) -> None:
+        """`set` for event-loop callers; the SQLite tier is written off the loop."""
+        if self.db_path:
+            await asyncio.to_thread(self.set, key, value)
+        else:
+            self.set(key, value)
+
+    def _remember(self, key: str, expires_at: float, value: Dict[str, Any]) -> None:
+        with self._lock:
+            self._memory[key] = (expires_at, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    async def get_or_compute(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[Dict[str, Any]]],
+        cacheable: Optional[Callable[[Dict[str, Any]], bool]] = None,
+    ) -> Tuple[Dict[str, Any], str]:
+        """Return ``(value, outcome)`` for `key`, computing it at most once.
+
+        The outcome is HIT when the value came from either tier, COALESCED when
+        this call waited on a computation already in flight, and MISS when it
+        ran `compute` itself. Exceptions raised by `compute` propagate to every
+        waiter and nothing is cached. If the computing task is cancelled, one
+        of the waiters takes over. A computed value for which `cacheable`
+        returns False is shared with the waiters but not stored.
+        """
+        loop = asyncio.get_running_loop()
+        checked = False
+        while True:
+            with self._lock:
+                inflight = self._inflight.get(key)
+                if inflight is not None and inflight.get_loop() is not loop:
+                    inflight = None  # computed on another event loop; do not share
+            if inflight is not None:
+                try:
+                    value = await asyncio.shield(inflight)
+                except _ComputeCancelled:
+                    continue
+                self.coalesced += 1
+                return value, COALESCED
+            if not checked:
+                checked = True
+                value = await self.get_async(key)
+                if value is not None:
+                    self.hits += 1
+                    return value, HIT
+                continue  # re-check for a computation started while we looked
+            future: "asyncio.Future[Dict[str, Any]]" = loop.create_future()
+            with self._lock:
+                if key in self._inflight and self._inflight[key].get_loop() is loop:
+                    continue
+                self._inflight[key] = future
+            break
+        self.misses += 1
+        try:
+            value = await compute()
+            try:
+                if cacheable is None or cacheable(value):
+                    await self.set_async(key, value)
+            except sqlite3.Error:
+                # A failing disk tier must not fail the call; the memory tier is already set
+                pass
+        except asyncio.CancelledError:
+            future.set_exception(_ComputeCancelled())
+            future.exception()
+            raise
+        except Exception as exc:
+            future.set_exception(exc)
+            future.exception()  # mark retrieved so a failure nobody awaited is not logged
+            raise
+        else:
+            future.set_result(value)
+            return value, MISS
+        finally:
+            with self._lock:
+                if self._inflight.get(key) is future:
+                    del self._inflight[key]
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit, miss and coalesced counters plus the memory tier size."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "entries": len(self._memory),
+        }
@@ -4,16 +4,79 @@ Metrics logging utilities for the AI Debugging Copilot backend.
 This module encapsulates SQLite interactions used to record metrics for each
 diagnostic call. Metrics include the duration of the call in milliseconds,
 approximate token counts for the prompt and completion, the total token
-count, and the confidence returned by the model. The database path can be
+count, the confidence returned by the model and, when a response cache is in
+front of the model, whether the call was a cache hit. Each row also records
+the model that was chosen and the request features the model router learns
+from (error log length, file count, exception type and estimated input
+tokens). Diagnoses answered by a deterministic rule record the rule and the
+model latency it saved. The database path can be
 configured via the `METRICS_DB` environment variable; it defaults to
 `metrics.db` in the working directory.
+
+`log_call` writes one row synchronously. The API records through a
+`MetricsWriter` instead, which queues rows and batch-inserts them from a
+background thread over a single long-lived WAL-mode connection, so request
+handlers never wait on the database. The same thread periodically folds raw
+rows into per-minute and per-hour rollups and applies retention (see
+`rollups`).
 """
 
+import atexit
+import logging
 import os
+import queue
 import sqlite3
-from typing import Optional
+import threading
+import time
+from typing import Any, List, Optional, Tuple
+
+from . import rollups
 
 DB_PATH = os.environ.get("METRICS_DB", "metrics.db")
+# Rows per transaction, and the longest a queued row waits before being written
+METRICS_BATCH_SIZE = int(os.environ.get("METRICS_BATCH_SIZE", "100"))
+METRICS_FLUSH_MS = int(os.environ.get("METRICS_FLUSH_MS", "200"))
+# Seconds between rollup runs in the writer thread; 0 disables them
+METRICS_ROLLUP_SECONDS = float(os.environ.get("METRICS_ROLLUP_SECONDS", "60"))
+
+logger = logging.getLogger(__name__)
+
+# Columns written for every call, in insert order
+_COLUMNS = (
+    "duration_ms",
+    "prompt_tokens",
+    "completion_tokens",
+    "total_tokens",
+    "confidence",
+    "cache_status",
+    "model",
+    "log_chars",
+    "file_count",
+    "exception",
+    "input_tokens",
+    "rule",
+    "saved_ms",
+)
+
+# Columns added after the original schema. init_db() adds any that are missing
+# so existing databases keep working.
+_ADDED_COLUMNS = {
+    "cache_status": "TEXT",
+    "model": "TEXT",
+    "log_chars": "INTEGER",
+    "file_count": "INTEGER",
+    "exception": "TEXT",
+    "input_tokens": "INTEGER",
+    "rule": "TEXT",
+    "saved_ms": "INTEGER",
+}
+
+
+def _add_missing_columns(conn: sqlite3.Connection) -> None:
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(metrics)")}
+    for name, decl in _ADDED_COLUMNS.items():
+        if name not in existing:
+            conn.execute(f"ALTER TABLE metrics ADD COLUMN {name} {decl}")
 
 
 def init_db(db_path: Optional[str] = None) -> None:
@@ -40,6 +103,10 @@ def init_db(db_path: Optional[str] = None) -> None:
             )
             """
         )
+        _add_missing_columns(conn)
+        # Time-window queries and retention deletes would otherwise scan every row
+        c.execute("CREATE INDEX IF NOT EXISTS idx_metrics_timestamp ON metrics(timestamp)")
+        rollups.create_tables(conn)
         conn.commit()
     finally:
         conn.close()
@@ -52,6 +119,14 @@ def log_call(
     total_tokens: int,
     confidence: float,
     db_path: Optional[str] = None,
+    cache_status: Optional[str] = None,
+    model: Optional[str] = None,
+    log_chars: Optional[int] = None,
+    file_count: Optional[int] = None,
+    exception: Optional[str] = None,
+    input_tokens: Optional[int] = None,
+    rule: Optional[str] = None,
+    saved_ms: Optional[int] = None,
 ) -> None:
     """Insert a metrics record for a diagnostic call.
 
@@ -62,19 +137,244 @@ def log_call(
       total_tokens: Sum of prompt_tokens and completion_tokens.
       confidence: The confidence value returned by the model.
       db_path: Optional override for the database file path.
+      cache_status: Response cache outcome ('hit', 'miss' or 'coalesced'),
+        or None when the call bypassed the cache.
+      model: The model the request was routed to.
+      log_chars: Length of the error log in characters.
+      file_count: Number of uploaded files.
+      exception: Exception type named in the error log, if any.
+      input_tokens: Estimated tokens of the untrimmed inputs.
+      rule: The rule that answered instead of the model, if any.
+      saved_ms: Estimated model latency the rule saved, in milliseconds.
     """
     path = db_path or DB_PATH
     conn = sqlite3.connect(path)
     try:
-        c = conn.cursor()
-        c.execute(
-            """
-            INSERT INTO metrics (
-                duration_ms, prompt_tokens, completion_tokens, total_tokens, confidence
-            ) VALUES (?, ?, ?, ?, ?)
-            """,
-            (duration_ms, prompt_tokens, completion_tokens, total_tokens, confidence),
+        conn.execute(
+            _insert_sql(),
+            (duration_ms, prompt_tokens, completion_tokens, total_tokens, confidence, cache_status,
+             model, log_chars, file_count, exception, input_tokens, rule, saved_ms),
         )
         conn.commit()
     finally:
-        conn.close()
\ No newline at end of file
+        conn.close()
+
+
+def _insert_sql() -> str:
+    placeholders = ", ".join("?" for _ in _COLUMNS)
+    return f"INSERT INTO metrics ({', '.join(_COLUMNS)}) VALUES ({placeholders})"
+
+
+# Queue markers understood by the writer thread
+_STOP = object()
+
+
+class MetricsWriter:
+    """Background, batching writer for metrics rows.
+
+    `log` only appends to an unbounded in-memory queue, so callers never
+    block on SQLite. A daemon thread, started on first use, drains the queue
+    and inserts rows in one transaction once `batch_size` rows are queued or
+    the oldest has waited `flush_interval_ms`. It keeps a single connection
+    open in WAL mode. A batch that fails to commit stays queued and is
+    retried on the next tick, so rows are not dropped on transient errors
+    such as a locked database; rows still unwritten at shutdown are logged at
+    ERROR level rather than discarded silently.
+
+    Parameters:
+      db_path: Optional override for the database file path.
+      batch_size: Rows written per transaction at most.
+      flush_interval_ms: Longest a queued row waits before being written.
+      rollup_interval: Seconds between rollup and retention runs; 0 disables them.
+    """
+
+    def __init__(
+        self,
+        db_path: Optional[str] = None,
+        batch_size: int = METRICS_BATCH_SIZE,
+        flush_interval_ms: int = METRICS_FLUSH_MS,
+        rollup_interval: float = METRICS_ROLLUP_SECONDS,
+    ) -> None:
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.rollup_interval = rollup_interval
+        self.written = 0
+        self.failed_batches = 0
+        self._queue: "queue.Queue[Any]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._atexit_registered = False
+
+    def log(
+        self,
+        duration_ms: int,
+        prompt_tokens: int,
+        completion_tokens: int,
+        total_tokens: int,
+        confidence: float,
+        cache_status: Optional[str] = None,
+        model: Optional[str] = None,
+        log_chars: Optional[int] = None,
+        file_count: Optional[int] = None,
+        exception: Optional[str] = None,
+        input_tokens: Optional[int] = None,
+        rule: Optional[str] = None,
+        saved_ms: Optional[int] = None,
+    ) -> None:
+        """Queue a metrics record; takes the same fields as `log_call`."""
+        self._ensure_started()
+        self._queue.put((duration_ms, prompt_tokens, completion_tokens, total_tokens, confidence, cache_status,
+                         model, log_chars, file_count, exception, input_tokens, rule, saved_ms))
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until every row queued so far is committed or `timeout` passes.
+
+        Returns False if the timeout expired first.
+        """
+        with self._lock:
+            running = self._thread is not None and self._thread.is_alive()
+        if not running:
+            return self._queue.empty()
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Write all queued rows and stop the writer thread.
+
+        Logging again afterwards starts a new thread.
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is None:
+                return
+            self._queue.put(_STOP)
+        thread.join(timeout)
+
+    def pending(self) -> int:
+        """Return the number of queued items not yet handled by the writer."""
+        return self._queue.qsize()
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="metrics-writer", daemon=True)
+                self._thread.start()
+                if not self._atexit_registered:
+                    atexit.register(self.close, 5.0)
+                    self._atexit_registered = True
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path or DB_PATH, timeout=5)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # WAL with synchronous=NORMAL survives process crashes and skips an
+        # fsync per transaction
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _write(self, conn: Optional[sqlite3.Connection], rows: List[Tuple[Any, ...]]) -> Optional[sqlite3.Connection]:
+        """Insert `rows` in one transaction, returning the connection to reuse.
+
+        Raises sqlite3.Error with the rows left for the caller to retry.
+        """
+        if conn is None:
+            conn = self._connect()
+        try:
+            with conn:
+                conn.executemany(_insert_sql(), rows)
+        except sqlite3.Error:
+            conn.close()
+            raise
+        return conn
+
+    def _roll_up(self, conn: Optional[sqlite3.Connection]) -> Optional[sqlite3.Connection]:
+        """Run rollups and retention, returning the connection to reuse."""
+        try:
+            if conn is None:
+                conn = self._connect()
+            rollups.roll_up(conn)
+        except sqlite3.Error:
+            logger.exception("failed to roll up metrics; will retry")
+            if conn is not None:
+                conn.close()
+            return None
+        return conn
+
+    def _run(self) -> None:
+        conn: Optional[sqlite3.Connection] = None
+        rows: List[Tuple[Any, ...]] = []
+        waiters: List[threading.Event] = []
+        stopping = False
+        next_rollup = time.monotonic() + self.rollup_interval
+        while True:
+            if rows:
+                # Wake up to retry a failed batch
+                timeout: Optional[float] = self.flush_interval
+            elif self.rollup_interval > 0:
+                timeout = max(0.0, next_rollup - time.monotonic())
+            else:
+                timeout = None
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            deadline = time.monotonic() + self.flush_interval
+            while item is not None:
+                if item is _STOP:
+                    stopping = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    rows.append(item)
+                if stopping or waiters or len(rows) >= self.batch_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if stopping:
+                # Drain anything queued behind the stop marker as well
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if isinstance(item, threading.Event):
+                        waiters.append(item)
+                    elif item is not _STOP:
+                        rows.append(item)
+            attempts = 3 if stopping else 1
+            while rows and attempts:
+                attempts -= 1
+                try:
+                    conn = self._write(conn, rows)
+                except sqlite3.Error:
+                    conn = None
+                    self.failed_batches += 1
+                    logger.exception("failed to write %d metrics rows; will retry", len(rows))
+                    if attempts:
+                        time.sleep(self.flush_interval)
+                else:
+                    self.written += len(rows)
+                    rows = []
+            if stopping and rows:
+                logger.error("discarding %d unwritten metrics rows at shutdown: %r", len(rows), rows)
+                rows = []
+            if self.rollup_interval > 0 and not rows and (stopping or time.monotonic() >= next_rollup):
+                conn = self._roll_up(conn)
+                next_rollup = time.monotonic() + self.rollup_interval
+            if not rows:
+                # Flush callers are released only once their rows are on disk
+                for waiter in waiters:
+                    waiter.set()
+                waiters = []
+            if stopping:
+                if conn is not None:
+                    conn.close()
+                return
\ No newline at end of file
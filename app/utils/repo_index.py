@@ -0,0 +1,339 @@
+"""
+Pre-built, memory-mapped TF-IDF index of a whole repository.
+
+Retrieval through `VectorStore` only sees the files uploaded with a request,
+and indexing a full repository per request is far too slow. This module
+builds the index offline and lets the server search it in milliseconds:
+
+    python -m app.utils.repo_index demo_repo --output repo_index
+
+Files are chunked and tokenised exactly as `VectorStore` does. The index is
+a directory of flat arrays:
+
+* ``postings_indptr.npy``, ``postings_chunks.npy``, ``postings_weights.npy``:
+  the L2-normalised TF-IDF matrix stored term-major (CSC), so a query
+  touches only the posting lists of its own terms;
+* ``idf.npy``, ``terms.bin`` and ``term_offsets.npy``: the sorted
+  vocabulary, searched by bisection without building a dictionary;
+* ``chunk_files.npy``, ``chunk_lines.npy``, ``chunk_offsets.npy`` and
+  ``text.bin``: where each chunk comes from and its text;
+* ``files.json`` and ``meta.json``: file paths with their SHA-256, and the
+  format version.
+
+`RepoIndex` memory-maps every array read-only, so opening is
+near-instant, pages are loaded on demand, and all worker processes on a host
+share one copy through the page cache. A rebuild writes a new directory and
+swaps it into place; running servers keep the old mapping until restarted.
+
+Set `REPO_INDEX_DIR` to have the API load an index at startup. Its chunks
+are ranked together with those of the uploaded files, and a repository file
+that was also uploaded is skipped in favour of the fresher upload.
+"""
+
+import argparse
+import bisect
+import hashlib
+import json
+import logging
+import mmap
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+import numpy as np  # type: ignore
+
+from .vector_store import _analyze, split_chunks
+
+FORMAT_VERSION = 1
+
+REPO_INDEX_DIR = os.environ.get("REPO_INDEX_DIR", "")
+# Files larger than this are left out of the index
+REPO_INDEX_MAX_FILE_BYTES = int(os.environ.get("REPO_INDEX_MAX_FILE_BYTES", str(1024 * 1024)))
+
+logger = logging.getLogger(__name__)
+
+# Directories never worth indexing
+SKIP_DIRS = frozenset({
+    ".git", ".hg", ".svn", "node_modules", "__pycache__", ".venv", "venv", ".tox", ".nox",
+    ".mypy_cache", ".pytest_cache", ".ruff_cache", "dist", "build", ".idea", ".vscode",
+})
+
+
+def iter_source_files(root: str, max_file_bytes: int = REPO_INDEX_MAX_FILE_BYTES) -> Iterator[Tuple[str, str]]:
+    """Yield ``(relative path, text)`` for the text files under `root`, sorted by path.
+
+    Binary files (a NUL byte in the first 8 KiB), files above `max_file_bytes`
+    and the directories in `SKIP_DIRS` are skipped.
+    """
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if d not in SKIP_DIRS)
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            try:
+                if not os.path.isfile(path) or os.path.getsize(path) > max_file_bytes:
+                    continue
+                with open(path, "rb") as fh:
+                    data = fh.read()
+            except OSError:
+                continue
+            if b"\0" in data[:8192]:
+                continue
+            yield os.path.relpath(path, root).replace(os.sep, "/"), str(data, "utf-8", "ignore")
+
+
+def build_index(root: str, output: str, max_file_bytes: int = REPO_INDEX_MAX_FILE_BYTES) -> Dict[str, Any]:
+    """Index the repository at `root` into the directory `output` and return its metadata.
+
+    An existing index at `output` is replaced only once the new one is
+    complete.
+    """
+    started = time.perf_counter()
+    files: List[Dict[str, str]] = []
+    chunk_files: List[int] = []
+    chunk_lines: List[Tuple[int, int]] = []
+    chunk_texts: List[bytes] = []
+    chunk_counts: List[Counter] = []
+    df: Counter = Counter()
+    for path, text in iter_source_files(root, max_file_bytes):
+        file_id = len(files)
+        files.append({"path": path, "sha256": hashlib.sha256(text.encode("utf-8")).hexdigest()})
+        for chunk in split_chunks(path, text):
+            counts = Counter(_analyze(chunk["content"]))
+            if not counts:
+                continue
+            chunk_files.append(file_id)
+            chunk_lines.append((chunk["start"], chunk["end"]))
+            chunk_texts.append(chunk["content"].encode("utf-8"))
+            chunk_counts.append(counts)
+            df.update(counts.keys())
+
+    # Sort terms by their UTF-8 bytes, the order `RepoIndex` bisects in
+    encoded_terms = sorted(term.encode("utf-8") for term in df)
+    term_ids = {term.decode("utf-8"): i for i, term in enumerate(encoded_terms)}
+    n_chunks, n_terms = len(chunk_counts), len(encoded_terms)
+    df_array = np.array([df[term.decode("utf-8")] for term in encoded_terms], dtype=np.float64)
+    # Smoothed IDF, as in VectorStore and scikit-learn
+    idf = np.log((1 + n_chunks) / (1 + df_array)) + 1.0
+
+    # Postings per term as (chunk, weight), each chunk's row L2-normalised
+    postings: List[List[Tuple[int, float]]] = [[] for _ in range(n_terms)]
+    for chunk_id, counts in enumerate(chunk_counts):
+        ids = np.fromiter((term_ids[t] for t in counts), dtype=np.int64, count=len(counts))
+        weights = np.fromiter(counts.values(), dtype=np.float64, count=len(counts)) * idf[ids]
+        weights /= np.linalg.norm(weights)
+        for term_id, weight in zip(ids.tolist(), weights.tolist()):
+            postings[term_id].append((chunk_id, weight))
+    indptr = np.zeros(n_terms + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(p) for p in postings])
+    post_chunks = np.fromiter((c for p in postings for c, _ in p), dtype=np.int32, count=int(indptr[-1]))
+    post_weights = np.fromiter((w for p in postings for _, w in p), dtype=np.float32, count=int(indptr[-1]))
+
+    meta = {
+        "format": FORMAT_VERSION,
+        "root": os.path.abspath(root),
+        "created": time.time(),
+        "files": len(files),
+        "chunks": n_chunks,
+        "terms": n_terms,
+        "build_seconds": 0.0,
+    }
+    parent = os.path.dirname(os.path.abspath(output))
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=parent, prefix=".repo-index-")
+    try:
+        # mkdtemp creates the directory private to its owner
+        os.chmod(tmp, 0o755)
+        arrays = {
+            "postings_indptr": indptr,
+            "postings_chunks": post_chunks,
+            "postings_weights": post_weights,
+            "idf": idf.astype(np.float32),
+            "term_offsets": _offsets(encoded_terms),
+            "chunk_files": np.array(chunk_files, dtype=np.int32),
+            "chunk_lines": np.array(chunk_lines, dtype=np.int32).reshape(n_chunks, 2),
+            "chunk_offsets": _offsets(chunk_texts),
+        }
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp, name + ".npy"), array)
+        with open(os.path.join(tmp, "terms.bin"), "wb") as fh:
+            fh.writelines(encoded_terms)
+        with open(os.path.join(tmp, "text.bin"), "wb") as fh:
+            fh.writelines(chunk_texts)
+        with open(os.path.join(tmp, "files.json"), "w", encoding="utf-8") as fh:
+            json.dump(files, fh)
+        meta["build_seconds"] = round(time.perf_counter() - started, 3)
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as fh:
+            json.dump(meta, fh, indent=2)
+        _swap_into_place(tmp, output)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return meta
+
+
+def _offsets(items: Sequence[bytes]) -> np.ndarray:
+    offsets = np.zeros(len(items) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(item) for item in items])
+    return offsets
+
+
+def _swap_into_place(tmp: str, output: str) -> None:
+    old = None
+    if os.path.exists(output):
+        old = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(output)), prefix=".repo-index-old-")
+        os.rmdir(old)
+        os.replace(output, old)
+    os.replace(tmp, output)
+    if old is not None:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+def _map_bytes(path: str) -> Any:
+    with open(path, "rb") as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class RepoIndex:
+    """Read-only view of an index built by `build_index`.
+
+    Parameters:
+      path: Directory written by `build_index`.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as fh:
+            self.meta = json.load(fh)
+        if self.meta.get("format") != FORMAT_VERSION:
+            raise ValueError(f"unsupported repository index format {self.meta.get('format')!r} in {path}")
+        with open(os.path.join(path, "files.json"), encoding="utf-8") as fh:
+            self.files: List[Dict[str, str]] = json.load(fh)
+
+        def load(name: str) -> np.ndarray:
+            return np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+
+        self._indptr = load("postings_indptr")
+        self._post_chunks = load("postings_chunks")
+        self._post_weights = load("postings_weights")
+        self._idf = load("idf")
+        self._term_offsets = load("term_offsets")
+        self._chunk_files = load("chunk_files")
+        self._chunk_lines = load("chunk_lines")
+        self._chunk_offsets = load("chunk_offsets")
+        self._terms = _map_bytes(os.path.join(path, "terms.bin"))
+        self._text = _map_bytes(os.path.join(path, "text.bin"))
+        self._paths = {f["path"]: i for i, f in enumerate(self.files)}
+
+    def __len__(self) -> int:
+        return len(self._chunk_files)
+
+    def _term(self, term_id: int) -> bytes:
+        return self._terms[int(self._term_offsets[term_id]):int(self._term_offsets[term_id + 1])]
+
+    def term_id(self, term: str) -> Optional[int]:
+        """Return the vocabulary id of `term`, or None if the repository lacks it."""
+        key = term.encode("utf-8")
+        n_terms = len(self._term_offsets) - 1
+        lo = bisect.bisect_left(range(n_terms), key, key=self._term)
+        if lo < n_terms and self._term(lo) == key:
+            return lo
+        return None
+
+    def file_ids(self, filenames: Iterable[str]) -> Set[int]:
+        """Return the ids of indexed files that `filenames` are newer versions of.
+
+        An uploaded name matches the indexed path it equals or ends with, so
+        absolute paths and paths relative to a parent directory both match.
+        """
+        ids = set()
+        for filename in filenames:
+            parts = filename.replace("\\", "/").strip("/").split("/")
+            for i in range(len(parts)):
+                file_id = self._paths.get("/".join(parts[i:]))
+                if file_id is not None:
+                    ids.add(file_id)
+                    break
+        return ids
+
+    def query_chunks(self, query: str, k: int = 5, exclude_files: Iterable[int] = ()) -> List[Dict[str, Any]]:
+        """Return up to `k` repository chunks most similar to the query, best first.
+
+        Results have the same keys as `VectorStore.query_chunks`. Chunks of
+        the files in `exclude_files` (ids from `file_ids`) are left out.
+        """
+        counts = Counter(_analyze(query))
+        known = [(term_id, counts[t]) for t in counts if (term_id := self.term_id(t)) is not None]
+        if not known or not len(self):
+            return []
+        ids = np.array([term_id for term_id, _ in known], dtype=np.int64)
+        weights = np.array([c for _, c in known], dtype=np.float64) * self._idf[ids]
+        weights /= np.linalg.norm(weights)
+        scores = np.zeros(len(self), dtype=np.float64)
+        for term_id, weight in zip(ids.tolist(), weights.tolist()):
+            start, end = self._indptr[term_id], self._indptr[term_id + 1]
+            # A chunk appears at most once per posting list
+            scores[self._post_chunks[start:end]] += self._post_weights[start:end] * weight
+        candidates = np.flatnonzero(scores > 0)
+        excluded = set(exclude_files)
+        if excluded:
+            keep = ~np.isin(self._chunk_files[candidates], list(excluded))
+            candidates = candidates[keep]
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        # Highest score first; ties in index order, as in VectorStore
+        candidates = candidates[np.lexsort((candidates, -scores[candidates]))]
+        return [self._chunk(int(i), float(scores[i])) for i in candidates]
+
+    def _chunk(self, chunk_id: int, score: float) -> Dict[str, Any]:
+        start, end = self._chunk_lines[chunk_id]
+        text = self._text[int(self._chunk_offsets[chunk_id]):int(self._chunk_offsets[chunk_id + 1])]
+        return {
+            "filename": self.files[int(self._chunk_files[chunk_id])]["path"],
+            "start": int(start),
+            "end": int(end),
+            "snippet": str(text, "utf-8"),
+            "score": score,
+        }
+
+
+def open_index(path: str = REPO_INDEX_DIR) -> Optional[RepoIndex]:
+    """Open the index at `path`, or return None when unset or unreadable."""
+    if not path:
+        return None
+    try:
+        return RepoIndex(path)
+    except (OSError, ValueError):
+        logger.warning("repository index %r not loaded", path, exc_info=True)
+        return None
+
+
+def merge_chunks(*results: List[Dict[str, Any]], k: int = 5) -> List[Dict[str, Any]]:
+    """Merge ranked chunk lists into the `k` best by score, stable across lists."""
+    merged = [chunk for result in results for chunk in result]
+    merged.sort(key=lambda chunk: -chunk["score"])
+    return merged[:k]
+
+
+def main_cli(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("root", help="repository to index")
+    parser.add_argument("--output", "-o", default="repo_index", help="index directory to (re)write")
+    parser.add_argument("--max-file-bytes", type=int, default=REPO_INDEX_MAX_FILE_BYTES,
+                        help="skip files larger than this")
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.root):
+        parser.error(f"{args.root} is not a directory")
+    meta = build_index(args.root, args.output, args.max_file_bytes)
+    print(f"indexed {meta['files']} files, {meta['chunks']} chunks, {meta['terms']} terms "
+          f"into {args.output} in {meta['build_seconds']:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
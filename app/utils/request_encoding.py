@@ -0,0 +1,130 @@
+"""
+Request-level ``Content-Encoding: gzip`` for request bodies.
+
+Error logs are sent uncompressed inside the JSON body, and the JSON itself
+is mostly base64 that gzip shrinks well. `DecompressRequestMiddleware` lets
+clients gzip the whole body instead. It inflates the body as it is received,
+in bounded steps, and hands the plain bytes to the application as ordinary
+body messages, so endpoints are unchanged and nothing is buffered beyond
+what the endpoint itself reads.
+
+The decompressed body is capped at `REQUEST_MAX_BODY_BYTES`. Exceeding it,
+or a corrupt stream, raises `HTTPException` (413 or 400) from the body
+read, which FastAPI passes through to the client; an encoding other than
+gzip or identity is answered with 415 before the application runs.
+"""
+
+import json
+import os
+import zlib
+from typing import Any, Awaitable, Callable, List, MutableMapping
+
+from starlette.exceptions import HTTPException
+
+from .decoding import MAX_REQUEST_BYTES
+
+Scope = MutableMapping[str, Any]
+Message = MutableMapping[str, Any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+
+# Largest decompressed request body; base64 makes it about a third larger than the files
+REQUEST_MAX_BODY_BYTES = int(os.environ.get("REQUEST_MAX_BODY_BYTES", str(MAX_REQUEST_BYTES * 3 // 2)))
+
+_OUTPUT_CHUNK = 256 * 1024
+
+
+class _Inflater:
+    """Incremental gzip decompression with a total output limit."""
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.total = 0
+        self._inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def feed(self, data: bytes) -> List[bytes]:
+        """Return the output for `data` in chunks of at most `_OUTPUT_CHUNK` bytes."""
+        out = []
+        try:
+            while data:
+                chunk = self._inflater.decompress(data, _OUTPUT_CHUNK)
+                data = self._inflater.unconsumed_tail
+                if self._inflater.eof and self._inflater.unused_data:
+                    # Concatenated gzip members
+                    data = self._inflater.unused_data
+                    self._inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                if chunk:
+                    self.total += len(chunk)
+                    if self.total > self.max_bytes:
+                        raise HTTPException(413, "Decompressed request body too large")
+                    out.append(chunk)
+        except zlib.error:
+            raise HTTPException(400, "Malformed gzip request body")
+        return out
+
+    def finish(self) -> None:
+        if not self._inflater.eof:
+            raise HTTPException(400, "Truncated gzip request body")
+
+
+class DecompressRequestMiddleware:
+    """ASGI middleware inflating gzip-encoded HTTP request bodies.
+
+    Parameters:
+      app: The wrapped ASGI application.
+      max_body_bytes: Limit on the decompressed body size.
+    """
+
+    def __init__(self, app: Callable, max_body_bytes: int = REQUEST_MAX_BODY_BYTES) -> None:
+        self.app = app
+        self.max_body_bytes = max_body_bytes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = b""
+        headers = []
+        for name, value in scope["headers"]:
+            if name == b"content-encoding":
+                encoding = value.strip().lower()
+            elif name != b"content-length":
+                headers.append((name, value))
+        if encoding in (b"", b"identity"):
+            await self.app(scope, receive, send)
+            return
+        if encoding not in (b"gzip", b"x-gzip"):
+            await _reply(send, 415, "Unsupported Content-Encoding")
+            return
+
+        inflater = _Inflater(self.max_body_bytes)
+        pending: List[bytes] = []
+        finished = False
+
+        async def inflated_receive() -> Message:
+            nonlocal finished
+            if finished and not pending:
+                # Body fully delivered; pass through disconnect notifications
+                return await receive()
+            while not pending and not finished:
+                message = await receive()
+                if message["type"] != "http.request":
+                    return message
+                pending.extend(inflater.feed(message.get("body", b"")))
+                if not message.get("more_body", False):
+                    inflater.finish()
+                    finished = True
+            body = pending.pop(0) if pending else b""
+            return {"type": "http.request", "body": body, "more_body": bool(pending) or not finished}
+
+        await self.app(dict(scope, headers=headers), inflated_receive, send)
+
+
+async def _reply(send: Send, status: int, detail: str) -> None:
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,299 @@
+"""
+Retries, a circuit breaker and hedged requests for upstream model calls.
+
+A single slow or failed completion used to decide the whole diagnosis: one
+attempt, a fixed timeout, then a simulated answer. `ResilientCaller` wraps
+each call in three layers:
+
+* retries of transient failures (transport errors, timeouts, 408/429/5xx)
+  with full-jitter exponential backoff, bounded by an overall deadline;
+* a circuit breaker that, after `CIRCUIT_FAILURE_THRESHOLD` consecutive
+  transient failures, rejects calls immediately for `CIRCUIT_RESET_SECONDS`
+  and then lets a single probe through;
+* hedging: once an attempt has run longer than the recent p95 latency, a
+  second request is sent (to `HEDGE_MODEL` if set, otherwise the same
+  model) and whichever answers first wins; the other is cancelled.
+  `call_with_model` reports which model answered, so a hedged answer is
+  not mistaken for one from the requested model.
+
+Hedging only starts after `HEDGE_MIN_SAMPLES` successful calls have been
+observed, so there is a latency distribution to take the percentile of.
+"""
+
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Deque, Optional, Tuple, TypeVar
+
+import httpx
+
+OPENAI_RETRIES = int(os.environ.get("OPENAI_RETRIES", "2"))
+OPENAI_RETRY_BASE_DELAY = float(os.environ.get("OPENAI_RETRY_BASE_DELAY", "0.25"))
+OPENAI_RETRY_MAX_DELAY = float(os.environ.get("OPENAI_RETRY_MAX_DELAY", "4"))
+# Total seconds spent on one call across attempts and backoff
+OPENAI_DEADLINE = float(os.environ.get("OPENAI_DEADLINE", "60"))
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.environ.get("CIRCUIT_RESET_SECONDS", "30"))
+HEDGE_ENABLED = os.environ.get("HEDGE_ENABLED", "1").lower() not in ("0", "false", "no")
+# Model for hedged requests; empty hedges with the original model
+HEDGE_MODEL = os.environ.get("HEDGE_MODEL", "") or None
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_SAMPLES = int(os.environ.get("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_MIN_DELAY = float(os.environ.get("HEDGE_MIN_DELAY", "0.5"))
+
+# Upstream statuses worth retrying; other 4xx errors would fail again
+RETRY_STATUSES = frozenset({408, 409, 425, 429, 500, 502, 503, 504})
+
+# Events reported to ResilientCaller's on_event callback
+RETRY = "retry"
+HEDGE = "hedge"
+HEDGE_WON = "hedge_won"
+CIRCUIT_OPEN = "circuit_open"
+
+T = TypeVar("T")
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling upstream while the circuit breaker is open."""
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Return True for failures that say the upstream is unhealthy, not the request wrong."""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in RETRY_STATUSES
+    return isinstance(exc, (httpx.TransportError, asyncio.TimeoutError))
+
+
+@dataclass
+class RetryPolicy:
+    """How often and how patiently a failed call is retried.
+
+    Attributes:
+      attempts: Total attempts, including the first.
+      base_delay: Backoff cap in seconds before the first retry; doubles per retry.
+      max_delay: Upper bound on the backoff cap.
+      deadline: Seconds after which no further attempt is started.
+    """
+
+    attempts: int = 1 + OPENAI_RETRIES
+    base_delay: float = OPENAI_RETRY_BASE_DELAY
+    max_delay: float = OPENAI_RETRY_MAX_DELAY
+    deadline: float = OPENAI_DEADLINE
+
+    def delay(self, attempt: int, rng: random.Random) -> float:
+        """Return the full-jitter backoff before retrying after failed `attempt` (0-based)."""
+        return rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker.
+
+    Closed, it allows every call. After `failure_threshold` consecutive
+    failures it opens and rejects calls for `reset_timeout` seconds, then
+    half-opens: one probe call is allowed, and its outcome closes or reopens
+    the circuit. A probe that never reports back is replaced after another
+    `reset_timeout`. Meant to be used from one event loop.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+        reset_timeout: float = CIRCUIT_RESET_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probe_at: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return self.CLOSED
+        if self._clock() - self._opened_at < self.reset_timeout:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def allow(self) -> bool:
+        """Return True if a call may go upstream now."""
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.OPEN:
+            return False
+        now = self._clock()
+        if self._probe_at is not None and now - self._probe_at < self.reset_timeout:
+            return False
+        self._probe_at = now
+        return True
+
+    def record_success(self) -> None:
+        self._failures = 0
+        self._opened_at = None
+        self._probe_at = None
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self._opened_at is not None or self._failures >= self.failure_threshold:
+            # Trip, or reopen after a failed probe
+            self._opened_at = self._clock()
+            self._probe_at = None
+
+
+class LatencyTracker:
+    """Sliding window of recent call latencies."""
+
+    def __init__(self, window: int = 500) -> None:
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def observe(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Return the `q`-th percentile (0-100) of the window, or None if it is empty."""
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+
+class ResilientCaller:
+    """Run upstream calls with retries, a circuit breaker and hedging.
+
+    Parameters:
+      retry: Retry policy; defaults come from the OPENAI_RETRY* variables.
+      breaker: Circuit breaker shared by every call through this caller.
+      hedging: Whether slow attempts are hedged.
+      hedge_model: Model for hedged requests; None reuses the call's model.
+      hedge_percentile: Latency percentile after which an attempt is hedged.
+      hedge_min_samples: Successful calls observed before hedging starts.
+      hedge_min_delay: Lower bound on the hedging delay in seconds.
+      on_event: Called with RETRY, HEDGE, HEDGE_WON or CIRCUIT_OPEN.
+      rng: Random source for backoff jitter.
+    """
+
+    def __init__(
+        self,
+        retry: Optional[RetryPolicy] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        hedging: bool = HEDGE_ENABLED,
+        hedge_model: Optional[str] = HEDGE_MODEL,
+        hedge_percentile: float = HEDGE_PERCENTILE,
+        hedge_min_samples: int = HEDGE_MIN_SAMPLES,
+        hedge_min_delay: float = HEDGE_MIN_DELAY,
+        on_event: Optional[Callable[[str], None]] = None,
+        rng: Optional[random.Random] = None,
+    ) -> None:
+        self.retry = retry or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self.latencies = LatencyTracker()
+        self.hedging = hedging
+        self.hedge_model = hedge_model
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_min_delay = hedge_min_delay
+        self._on_event = on_event
+        self._rng = rng or random.Random()
+
+    def _emit(self, event: str) -> None:
+        if self._on_event is not None:
+            try:
+                self._on_event(event)
+            except Exception:
+                pass  # reporting must not break the call
+
+    def hedge_delay(self) -> Optional[float]:
+        """Return seconds after which an attempt is hedged, or None to not hedge."""
+        if not self.hedging or len(self.latencies) < self.hedge_min_samples:
+            return None
+        return max(self.hedge_min_delay, self.latencies.percentile(self.hedge_percentile) or 0.0)
+
+    async def call(self, fn: Callable[[str], Awaitable[T]], model: str) -> T:
+        """Return ``await fn(model)``, retried, hedged and guarded by the breaker.
+
+        Raises `CircuitOpen` when the breaker rejects the call, otherwise the
+        last failure once retries are exhausted or the failure is not
+        retryable.
+        """
+        result, _ = await self.call_with_model(fn, model)
+        return result
+
+    async def call_with_model(self, fn: Callable[[str], Awaitable[T]], model: str) -> Tuple[T, str]:
+        """Like `call`, but return ``(result, answered_by)``.
+
+        `answered_by` is `hedge_model` when a hedged request to it won, and
+        `model` otherwise.
+        """
+        start = time.monotonic()
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                self._emit(CIRCUIT_OPEN)
+                raise CircuitOpen("upstream circuit breaker is open")
+            try:
+                result, answered_by = await self._attempt(fn, model)
+            except Exception as exc:
+                if not is_retryable(exc):
+                    raise
+                self.breaker.record_failure()
+                delay = self.retry.delay(attempt, self._rng)
+                attempt += 1
+                if attempt >= self.retry.attempts or time.monotonic() - start + delay >= self.retry.deadline:
+                    raise
+                self._emit(RETRY)
+                await asyncio.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return result, answered_by
+
+    async def _timed(self, fn: Callable[[str], Awaitable[T]], model: str) -> T:
+        start = time.perf_counter()
+        result = await fn(model)
+        self.latencies.observe(time.perf_counter() - start)
+        return result
+
+    async def _attempt(self, fn: Callable[[str], Awaitable[T]], model: str) -> Tuple[T, str]:
+        """One attempt, hedged with a second request if it runs past the hedging delay.
+
+        Returns the result and the model that produced it.
+        """
+        primary = asyncio.ensure_future(self._timed(fn, model))
+        tasks = {primary}
+        try:
+            delay = self.hedge_delay()
+            if delay is None:
+                return await primary, model
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                return primary.result(), model
+            self._emit(HEDGE)
+            hedge_model = self.hedge_model or model
+            hedge = asyncio.ensure_future(self._timed(fn, hedge_model))
+            tasks.add(hedge)
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self._emit(HEDGE_WON)
+                            return task.result(), hedge_model
+                        return task.result(), model
+            # Both failed; report the original request's failure
+            return primary.result(), model
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
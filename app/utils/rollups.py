@@ -0,0 +1,352 @@
+"""
+Per-minute and per-hour rollups of the metrics table.
+
+Raw `metrics` rows are aggregated into `metrics_minute` and `metrics_hour`:
+per bucket, the row count, sums, minimums and maximums of duration, tokens
+and confidence, plus mergeable quantile sketches of duration and total
+tokens. Summaries over a time window then read at most a few hundred
+aggregate rows regardless of traffic, instead of scanning every call.
+
+`roll_up` is incremental: it remembers the last raw row id it folded in
+(table `metrics_rollup_state`) and merges newer rows into existing buckets.
+It also applies retention: raw rows that are already rolled up are deleted
+after `METRICS_RAW_RETENTION_DAYS`, minute buckets after
+`METRICS_MINUTE_RETENTION_DAYS` and hour buckets after
+`METRICS_HOUR_RETENTION_DAYS`. The `MetricsWriter` thread runs it every
+`METRICS_ROLLUP_SECONDS`.
+"""
+
+import json
+import math
+import os
+import sqlite3
+import time
+from typing import Any, Dict, Iterable, Optional, Sequence, Tuple
+
+METRICS_RAW_RETENTION_DAYS = float(os.environ.get("METRICS_RAW_RETENTION_DAYS", "14"))
+METRICS_MINUTE_RETENTION_DAYS = float(os.environ.get("METRICS_MINUTE_RETENTION_DAYS", "7"))
+METRICS_HOUR_RETENTION_DAYS = float(os.environ.get("METRICS_HOUR_RETENTION_DAYS", "400"))
+
+MINUTE = 60
+HOUR = 3600
+# Windows up to this long are summarised from minute buckets, longer ones from hours
+MINUTE_WINDOW_LIMIT = 6 * HOUR
+# Relative error of the quantile sketches
+SKETCH_ACCURACY = 0.01
+# Raw rows folded in per transaction
+ROLLUP_BATCH = 50000
+
+_TABLES = {MINUTE: "metrics_minute", HOUR: "metrics_hour"}
+_AGGREGATE_COLUMNS = (
+    "count",
+    "duration_sum",
+    "duration_min",
+    "duration_max",
+    "duration_sketch",
+    "prompt_tokens_sum",
+    "completion_tokens_sum",
+    "total_tokens_sum",
+    "total_tokens_min",
+    "total_tokens_max",
+    "total_tokens_sketch",
+    "confidence_sum",
+    "confidence_min",
+    "confidence_max",
+)
+
+
+class QuantileSketch:
+    """Log-bucketed histogram with bounded relative error (DDSketch-style).
+
+    Every positive value falls in bucket ``ceil(log_gamma(value))``; a
+    quantile is answered with the bucket's midpoint, which is within
+    `accuracy` of the true value relative to it. Sketches with the same
+    accuracy merge by adding bucket counts.
+    """
+
+    def __init__(self, accuracy: float = SKETCH_ACCURACY) -> None:
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets: Dict[int, int] = {}
+        self.zeros = 0
+        self.count = 0
+
+    def add(self, value: float, n: int = 1) -> None:
+        if value <= 0:
+            self.zeros += n
+        else:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.buckets[index] = self.buckets.get(index, 0) + n
+        self.count += n
+
+    def merge(self, other: "QuantileSketch") -> None:
+        for index, n in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + n
+        self.zeros += other.zeros
+        self.count += other.count
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Return the approximate `q`-quantile (0-1), or None if empty."""
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    def to_json(self) -> str:
+        return json.dumps({"z": self.zeros, "b": {str(k): v for k, v in self.buckets.items()}}, separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, text: Optional[str]) -> "QuantileSketch":
+        sketch = cls()
+        if text:
+            data = json.loads(text)
+            sketch.zeros = int(data.get("z", 0))
+            sketch.buckets = {int(k): int(v) for k, v in data.get("b", {}).items()}
+            sketch.count = sketch.zeros + sum(sketch.buckets.values())
+        return sketch
+
+
+def _min(a: Optional[float], b: Optional[float]) -> Optional[float]:
+    return b if a is None else a if b is None else min(a, b)
+
+
+def _max(a: Optional[float], b: Optional[float]) -> Optional[float]:
+    return b if a is None else a if b is None else max(a, b)
+
+
+class Aggregate:
+    """Mergeable summary of a set of metrics rows."""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.duration_sum = 0.0
+        self.duration_min: Optional[float] = None
+        self.duration_max: Optional[float] = None
+        self.duration_sketch = QuantileSketch()
+        self.prompt_tokens_sum = 0
+        self.completion_tokens_sum = 0
+        self.total_tokens_sum = 0
+        self.total_tokens_min: Optional[float] = None
+        self.total_tokens_max: Optional[float] = None
+        self.total_tokens_sketch = QuantileSketch()
+        self.confidence_sum = 0.0
+        self.confidence_min: Optional[float] = None
+        self.confidence_max: Optional[float] = None
+
+    def add(self, duration_ms: Any, prompt_tokens: Any, completion_tokens: Any, total_tokens: Any, confidence: Any) -> None:
+        """Fold in one raw row; missing values count as zero."""
+        duration = float(duration_ms or 0)
+        total = int(total_tokens or 0)
+        conf = float(confidence or 0.0)
+        self.count += 1
+        self.duration_sum += duration
+        self.duration_min = _min(self.duration_min, duration)
+        self.duration_max = _max(self.duration_max, duration)
+        self.duration_sketch.add(duration)
+        self.prompt_tokens_sum += int(prompt_tokens or 0)
+        self.completion_tokens_sum += int(completion_tokens or 0)
+        self.total_tokens_sum += total
+        self.total_tokens_min = _min(self.total_tokens_min, total)
+        self.total_tokens_max = _max(self.total_tokens_max, total)
+        self.total_tokens_sketch.add(total)
+        self.confidence_sum += conf
+        self.confidence_min = _min(self.confidence_min, conf)
+        self.confidence_max = _max(self.confidence_max, conf)
+
+    def merge(self, other: "Aggregate") -> None:
+        self.count += other.count
+        self.duration_sum += other.duration_sum
+        self.duration_min = _min(self.duration_min, other.duration_min)
+        self.duration_max = _max(self.duration_max, other.duration_max)
+        self.duration_sketch.merge(other.duration_sketch)
+        self.prompt_tokens_sum += other.prompt_tokens_sum
+        self.completion_tokens_sum += other.completion_tokens_sum
+        self.total_tokens_sum += other.total_tokens_sum
+        self.total_tokens_min = _min(self.total_tokens_min, other.total_tokens_min)
+        self.total_tokens_max = _max(self.total_tokens_max, other.total_tokens_max)
+        self.total_tokens_sketch.merge(other.total_tokens_sketch)
+        self.confidence_sum += other.confidence_sum
+        self.confidence_min = _min(self.confidence_min, other.confidence_min)
+        self.confidence_max = _max(self.confidence_max, other.confidence_max)
+
+    def to_row(self) -> Tuple[Any, ...]:
+        return tuple(
+            getattr(self, name).to_json() if name.endswith("_sketch") else getattr(self, name)
+            for name in _AGGREGATE_COLUMNS
+        )
+
+    @classmethod
+    def from_row(cls, row: Sequence[Any]) -> "Aggregate":
+        aggregate = cls()
+        for name, value in zip(_AGGREGATE_COLUMNS, row):
+            if name.endswith("_sketch"):
+                value = QuantileSketch.from_json(value)
+            setattr(aggregate, name, value)
+        return aggregate
+
+
+def create_tables(conn: sqlite3.Connection) -> None:
+    """Create the rollup tables and their bookkeeping table if absent."""
+    for table in _TABLES.values():
+        conn.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                bucket INTEGER PRIMARY KEY,
+                count INTEGER NOT NULL,
+                duration_sum REAL,
+                duration_min REAL,
+                duration_max REAL,
+                duration_sketch TEXT,
+                prompt_tokens_sum INTEGER,
+                completion_tokens_sum INTEGER,
+                total_tokens_sum INTEGER,
+                total_tokens_min INTEGER,
+                total_tokens_max INTEGER,
+                total_tokens_sketch TEXT,
+                confidence_sum REAL,
+                confidence_min REAL,
+                confidence_max REAL
+            )
+            """
+        )
+    conn.execute("CREATE TABLE IF NOT EXISTS metrics_rollup_state (name TEXT PRIMARY KEY, value INTEGER)")
+
+
+def _merge_into(conn: sqlite3.Connection, table: str, buckets: Dict[int, Aggregate]) -> None:
+    columns = ", ".join(_AGGREGATE_COLUMNS)
+    for bucket, aggregate in buckets.items():
+        existing = conn.execute(f"SELECT {columns} FROM {table} WHERE bucket = ?", (bucket,)).fetchone()
+        if existing is not None:
+            merged = Aggregate.from_row(existing)
+            merged.merge(aggregate)
+            aggregate = merged
+        placeholders = ", ".join("?" for _ in range(len(_AGGREGATE_COLUMNS) + 1))
+        conn.execute(
+            f"INSERT OR REPLACE INTO {table} (bucket, {columns}) VALUES ({placeholders})",
+            (bucket, *aggregate.to_row()),
+        )
+
+
+def roll_up(conn: sqlite3.Connection, now: Optional[float] = None) -> int:
+    """Fold new raw rows into the rollup tables and apply retention.
+
+    Returns the number of raw rows rolled up. Each batch reads and advances
+    the watermark in one write transaction, so several processes may roll
+    up the same database at once. `conn` must not be inside a transaction.
+
+    Parameters:
+      conn: Connection to the metrics database.
+      now: Current Unix time, for retention; defaults to the clock.
+    """
+    now = time.time() if now is None else now
+    total = 0
+    with conn:
+        create_tables(conn)
+    while True:
+        with conn:
+            # Take the write lock before reading the watermark, so concurrent
+            # rollups (one per worker) cannot fold the same rows twice
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT value FROM metrics_rollup_state WHERE name = 'last_id'").fetchone()
+            last_id = row[0] if row else 0
+            rows = conn.execute(
+                "SELECT id, CAST(strftime('%s', timestamp) AS INTEGER), duration_ms, prompt_tokens, "
+                "completion_tokens, total_tokens, confidence FROM metrics WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, ROLLUP_BATCH),
+            ).fetchall()
+            if not rows:
+                break
+            for granularity, table in _TABLES.items():
+                buckets: Dict[int, Aggregate] = {}
+                for _, ts, *values in rows:
+                    bucket = int(ts or now) // granularity * granularity
+                    buckets.setdefault(bucket, Aggregate()).add(*values)
+                _merge_into(conn, table, buckets)
+            conn.execute(
+                "INSERT OR REPLACE INTO metrics_rollup_state (name, value) VALUES ('last_id', ?)", (rows[-1][0],)
+            )
+            total += len(rows)
+        if len(rows) < ROLLUP_BATCH:
+            break
+    with conn:
+        apply_retention(conn, now)
+    return total
+
+
+def apply_retention(conn: sqlite3.Connection, now: float) -> None:
+    """Delete raw rows and rollup buckets older than their retention periods.
+
+    Raw rows are only deleted once they have been rolled up.
+    """
+    row = conn.execute("SELECT value FROM metrics_rollup_state WHERE name = 'last_id'").fetchone()
+    last_id = row[0] if row else 0
+    cutoff = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(now - METRICS_RAW_RETENTION_DAYS * 86400))
+    conn.execute("DELETE FROM metrics WHERE timestamp < ? AND id <= ?", (cutoff, last_id))
+    conn.execute("DELETE FROM metrics_minute WHERE bucket < ?", (now - METRICS_MINUTE_RETENTION_DAYS * 86400,))
+    conn.execute("DELETE FROM metrics_hour WHERE bucket < ?", (now - METRICS_HOUR_RETENTION_DAYS * 86400,))
+
+
+def _quantiles(sketch: QuantileSketch) -> Dict[str, Optional[float]]:
+    return {name: sketch.quantile(q) for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))}
+
+
+def summarise(conn: sqlite3.Connection, window_seconds: float, now: Optional[float] = None) -> Dict[str, Any]:
+    """Summarise the calls of the last `window_seconds` from the rollup tables.
+
+    Windows up to `MINUTE_WINDOW_LIMIT` are read from minute buckets, longer
+    ones from hour buckets, so at most a few hundred (minute) or one row per
+    hour of retention (hour) are merged. Bucket boundaries are honoured, so
+    the window is widened to the start of its first bucket.
+
+    Parameters:
+      conn: Connection to the metrics database.
+      window_seconds: Length of the window ending now.
+      now: Current Unix time; defaults to the clock.
+    """
+    now = time.time() if now is None else now
+    granularity = MINUTE if window_seconds <= MINUTE_WINDOW_LIMIT else HOUR
+    start = int(now - window_seconds) // granularity * granularity
+    create_tables(conn)
+    total = Aggregate()
+    rows: Iterable[Sequence[Any]] = conn.execute(
+        f"SELECT {', '.join(_AGGREGATE_COLUMNS)} FROM {_TABLES[granularity]} WHERE bucket >= ?", (start,)
+    )
+    for row in rows:
+        total.merge(Aggregate.from_row(row))
+    count = total.count
+    return {
+        "window_seconds": window_seconds,
+        "granularity_seconds": granularity,
+        "from": start,
+        "to": int(now),
+        "count": count,
+        "latency_ms": {
+            **_quantiles(total.duration_sketch),
+            "mean": total.duration_sum / count if count else None,
+            "min": total.duration_min,
+            "max": total.duration_max,
+        },
+        "tokens": {
+            "prompt": total.prompt_tokens_sum,
+            "completion": total.completion_tokens_sum,
+            "total": total.total_tokens_sum,
+            "per_call": {
+                **_quantiles(total.total_tokens_sketch),
+                "mean": total.total_tokens_sum / count if count else None,
+                "min": total.total_tokens_min,
+                "max": total.total_tokens_max,
+            },
+        },
+        "confidence": {
+            "mean": total.confidence_sum / count if count else None,
+            "min": total.confidence_min,
+            "max": total.confidence_max,
+        },
+    }
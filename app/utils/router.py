@@ -0,0 +1,233 @@
+"""
+Data-driven model routing from the metrics history.
+
+`choose_model` used a fixed rule (short log and few files go to
+`gpt-4o-mini`). `ModelRouter` instead learns, from the rows the API already
+writes to the metrics database, which model reaches a confidence target at
+the lowest latency for requests like the current one.
+
+Requests are described by `RouteFeatures` (error log length, file count,
+exception type, estimated input tokens) and bucketed coarsely. Statistics
+are kept at several levels of detail, from the full bucket down to all
+requests; a decision is taken at the most detailed level where at least two
+candidate models each have `ROUTER_MIN_SAMPLES` calls. There, the fastest
+model (by median latency) whose mean confidence meets
+`ROUTER_CONFIDENCE_TARGET` wins, or else the most confident one. Without
+enough history the caller's default applies.
+
+Only real upstream calls (cache status 'miss') are learned from; cache hits
+and simulated fallbacks say nothing about a model. A small share of routed
+requests (`ROUTER_EXPLORE`) goes to the least-sampled model so every model
+keeps accumulating history.
+
+`choose` is a handful of dictionary lookups over an in-memory table. The
+table is rebuilt from the database every `ROUTER_REFRESH_SECONDS` by a
+background thread and swapped in atomically.
+"""
+
+import bisect
+import logging
+import os
+import random
+import sqlite3
+import statistics
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .fingerprint import exception_type
+from .metrics import DB_PATH
+
+ROUTER_ENABLED = os.environ.get("MODEL_ROUTER", "1").lower() not in ("0", "false", "no")
+ROUTER_MODELS = tuple(m.strip() for m in os.environ.get("ROUTER_MODELS", "gpt-4o-mini,gpt-4o").split(",") if m.strip())
+ROUTER_CONFIDENCE_TARGET = float(os.environ.get("ROUTER_CONFIDENCE_TARGET", "0.8"))
+ROUTER_MIN_SAMPLES = int(os.environ.get("ROUTER_MIN_SAMPLES", "20"))
+ROUTER_REFRESH_SECONDS = float(os.environ.get("ROUTER_REFRESH_SECONDS", "60"))
+ROUTER_EXPLORE = float(os.environ.get("ROUTER_EXPLORE", "0.02"))
+# Most recent calls the table is built from
+ROUTER_HISTORY_ROWS = int(os.environ.get("ROUTER_HISTORY_ROWS", "50000"))
+
+# Upper bounds of the feature buckets
+LOG_CHARS_BUCKETS = (500, 2000, 8000, 32000)
+FILE_COUNT_BUCKETS = (3, 10, 50)
+INPUT_TOKENS_BUCKETS = (2000, 8000, 24000, 100000)
+
+# Rough characters per token, for estimating inputs before any prompt exists
+CHARS_PER_TOKEN = 4
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class RouteFeatures:
+    """What the router knows about a request before choosing a model."""
+
+    log_chars: int
+    file_count: int
+    exception: str
+    input_tokens: int
+
+
+@dataclass(frozen=True)
+class ModelStats:
+    """History of one model within one bucket."""
+
+    count: int
+    confidence: float  # mean
+    latency_ms: float  # median
+
+
+# Level -> bucket key -> model -> stats
+Table = List[Dict[Tuple, Dict[str, ModelStats]]]
+
+
+def route_features(error_log: str, file_count: int, decoded_chars: int) -> RouteFeatures:
+    """Return the routing features of a request.
+
+    Parameters:
+      error_log: The raw error log.
+      file_count: Number of uploaded files.
+      decoded_chars: Total characters of the decoded files.
+    """
+    name = exception_type(error_log) or ""
+    return RouteFeatures(
+        log_chars=len(error_log),
+        file_count=file_count,
+        exception=name.rsplit(".", 1)[-1],
+        input_tokens=(len(error_log) + decoded_chars) // CHARS_PER_TOKEN,
+    )
+
+
+def _bucket(value: Optional[int], bounds: Sequence[int]) -> int:
+    return bisect.bisect_right(bounds, value or 0)
+
+
+def bucket_keys(features: RouteFeatures) -> Tuple[Tuple, ...]:
+    """Return the bucket key of `features` at each level, most detailed first."""
+    log_b = _bucket(features.log_chars, LOG_CHARS_BUCKETS)
+    files_b = _bucket(features.file_count, FILE_COUNT_BUCKETS)
+    tokens_b = _bucket(features.input_tokens, INPUT_TOKENS_BUCKETS)
+    exception = features.exception
+    return (
+        (exception, log_b, files_b, tokens_b),
+        (exception, tokens_b),
+        (exception,),
+        (),
+    )
+
+
+def build_table(rows: Sequence[Tuple], models: Sequence[str] = ROUTER_MODELS) -> Table:
+    """Aggregate metrics rows into per-level statistics.
+
+    Parameters:
+      rows: ``(model, log_chars, file_count, exception, input_tokens,
+        duration_ms, confidence)`` tuples.
+      models: Candidate models; rows for other models are ignored.
+    """
+    samples: List[Dict[Tuple, Dict[str, Tuple[List[float], List[float]]]]] = [{} for _ in range(4)]
+    for model, log_chars, file_count, exception, input_tokens, duration_ms, confidence in rows:
+        if model not in models or duration_ms is None or confidence is None:
+            continue
+        features = RouteFeatures(log_chars or 0, file_count or 0, exception or "", input_tokens or 0)
+        for level, key in enumerate(bucket_keys(features)):
+            durations, confidences = samples[level].setdefault(key, {}).setdefault(model, ([], []))
+            durations.append(float(duration_ms))
+            confidences.append(float(confidence))
+    return [
+        {
+            key: {
+                model: ModelStats(len(durations), statistics.fmean(confidences), statistics.median(durations))
+                for model, (durations, confidences) in per_model.items()
+            }
+            for key, per_model in level.items()
+        }
+        for level in samples
+    ]
+
+
+class ModelRouter:
+    """Choose models from an in-memory table refreshed from the metrics database.
+
+    Parameters:
+      db_path: Metrics database; defaults to `METRICS_DB`.
+      models: Candidate models.
+      confidence_target: Mean confidence a model must reach to be preferred for speed.
+      min_samples: Calls per model needed before a bucket is trusted.
+      refresh_seconds: Age after which `choose` triggers a background refresh.
+      explore: Share of decisions sent to the least-sampled model.
+      rng: Random source for exploration.
+    """
+
+    def __init__(
+        self,
+        db_path: Optional[str] = None,
+        models: Sequence[str] = ROUTER_MODELS,
+        confidence_target: float = ROUTER_CONFIDENCE_TARGET,
+        min_samples: int = ROUTER_MIN_SAMPLES,
+        refresh_seconds: float = ROUTER_REFRESH_SECONDS,
+        explore: float = ROUTER_EXPLORE,
+        rng: Optional[random.Random] = None,
+    ) -> None:
+        self.db_path = db_path
+        self.models = tuple(models)
+        self.confidence_target = confidence_target
+        self.min_samples = max(1, min_samples)
+        self.refresh_seconds = refresh_seconds
+        self.explore = explore
+        self._rng = rng or random.Random()
+        self._table: Table = [{} for _ in range(4)]
+        self._next_refresh = 0.0
+        self._refreshing = threading.Lock()
+
+    def refresh(self) -> None:
+        """Rebuild the table from the database now."""
+        self._next_refresh = time.monotonic() + self.refresh_seconds
+        try:
+            conn = sqlite3.connect(self.db_path or DB_PATH, timeout=5)
+            try:
+                rows = conn.execute(
+                    "SELECT model, log_chars, file_count, exception, input_tokens, duration_ms, confidence "
+                    "FROM metrics WHERE model IS NOT NULL AND cache_status = 'miss' ORDER BY id DESC LIMIT ?",
+                    (ROUTER_HISTORY_ROWS,),
+                ).fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            logger.warning("model router could not read metrics history", exc_info=True)
+            return
+        self._table = build_table(rows, self.models)
+
+    def _refresh_in_background(self) -> None:
+        if not self._refreshing.acquire(blocking=False):
+            return
+
+        def run() -> None:
+            try:
+                self.refresh()
+            finally:
+                self._refreshing.release()
+
+        threading.Thread(target=run, name="model-router-refresh", daemon=True).start()
+
+    def choose(self, features: RouteFeatures, default: str) -> str:
+        """Return the model for a request with `features`, or `default` without enough history."""
+        if time.monotonic() >= self._next_refresh:
+            self._refresh_in_background()
+        table = self._table
+        keys = bucket_keys(features)
+        if self.explore > 0 and table[-1].get(()) and self._rng.random() < self.explore:
+            seen = table[0].get(keys[0], {})
+            return min(self.models, key=lambda model: seen[model].count if model in seen else 0)
+        for level, key in enumerate(keys):
+            stats = table[level].get(key)
+            if not stats:
+                continue
+            eligible = {model: s for model, s in stats.items() if s.count >= self.min_samples}
+            if len(eligible) < 2:
+                continue
+            meeting = [model for model, s in eligible.items() if s.confidence >= self.confidence_target]
+            if meeting:
+                return min(meeting, key=lambda model: eligible[model].latency_ms)
+            return max(eligible, key=lambda model: eligible[model].confidence)
+        return default
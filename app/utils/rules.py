@@ -0,0 +1,502 @@
+"""
+Deterministic rules that answer common failures without a model call.
+
+Some failures have one obvious fix: a circular import between two uploaded
+modules, or a third-party module missing from ``requirements.txt``. A model
+call spends seconds producing what a few lines of analysis can produce in
+milliseconds. `RuleEngine` runs before the model. Each rule inspects a
+`RuleContext` (the error log, its frame references, the decoded files and
+their import graph) and either declines with None or returns a complete,
+schema-valid response carrying its own confidence. The most confident
+answer wins; when it reaches `RULES_MIN_CONFIDENCE` the API returns it and
+skips the model entirely.
+
+Built-in rules:
+
+* ``circular_import``: an import cycle among the uploaded files, matched
+  with a "partially initialized module" or "circular import" error. When
+  the names the innermost frame imports are only used inside functions, the
+  patch moves that import into them.
+* ``missing_module``: ``No module named 'x'`` for a third-party module that
+  the uploaded ``requirements.txt`` does not list; the patch adds it. Only
+  modules of known distributions are answered confidently, since a module
+  missing from the upload may just be first-party code that was not sent.
+* ``assertion_diff``: explains how the two sides of a failed equality
+  assertion differ. Which side is wrong cannot be told from the log, so it
+  answers below the threshold and is only counted unless the threshold is
+  lowered.
+
+Further rules are plugged in with `RuleEngine.add`, or by listing
+``module:function`` paths in `RULES_PLUGINS`.
+"""
+
+import ast
+import difflib
+import importlib
+import logging
+import os
+import re
+import sys
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from .context import ContextIndex
+from .fingerprint import exception_type
+from .import_graph import Import, ImportGraph
+
+RULES_ENABLED = os.environ.get("RULES", "1").lower() not in ("0", "false", "no")
+RULES_MIN_CONFIDENCE = float(os.environ.get("RULES_MIN_CONFIDENCE", "0.85"))
+# Comma-separated `module:function` rules loaded in addition to the built-in ones
+RULES_PLUGINS = os.environ.get("RULES_PLUGINS", "")
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RuleContext:
+    """What a rule may look at for one failure."""
+
+    error_log: str
+    references: List[Tuple[str, int]]
+    decoded_files: Sequence[Dict[str, Any]]
+    index: ContextIndex
+    graph: ImportGraph
+
+    @property
+    def exception(self) -> Optional[str]:
+        name = exception_type(self.error_log)
+        return name.rsplit(".", 1)[-1] if name else None
+
+
+Rule = Callable[[RuleContext], Optional[Dict[str, Any]]]
+
+
+@dataclass(frozen=True)
+class RuleHit:
+    """A rule's answer for one failure."""
+
+    rule: str
+    body: Dict[str, Any]
+
+    @property
+    def confidence(self) -> float:
+        return float(self.body.get("confidence", 0.0))
+
+
+def make_response(
+    root_cause: str,
+    confidence: float,
+    patches: Sequence[str] = (),
+    follow_up: Optional[str] = None,
+    rule: str = "",
+) -> Dict[str, Any]:
+    """Build a response body in the schema the model is asked for."""
+    return {
+        "root_cause": root_cause,
+        "confidence": confidence,
+        "patches": list(patches),
+        "follow_up": follow_up,
+        "agent_block": f"Answered by the `{rule}` rule without a model call.",
+    }
+
+
+def unified_diff(filename: str, old: str, new: str) -> str:
+    """Return a unified diff turning `old` into `new` for `filename`."""
+    path = filename.replace("\\", "/").lstrip("/")
+    lines = difflib.unified_diff(
+        old.splitlines(keepends=True), new.splitlines(keepends=True), f"a/{path}", f"b/{path}",
+    )
+    return "".join(line if line.endswith("\n") else line + "\n" for line in lines)
+
+
+class RuleEngine:
+    """Ordered collection of rules.
+
+    Parameters:
+      rules: ``(name, rule)`` pairs; the built-in rules by default.
+      min_confidence: Confidence at which an answer replaces the model call.
+    """
+
+    def __init__(
+        self,
+        rules: Optional[Sequence[Tuple[str, Rule]]] = None,
+        min_confidence: float = RULES_MIN_CONFIDENCE,
+    ) -> None:
+        self.rules: List[Tuple[str, Rule]] = list(BUILTIN_RULES if rules is None else rules)
+        self.min_confidence = min_confidence
+
+    def add(self, name: str, rule: Rule) -> None:
+        self.rules.append((name, rule))
+
+    def load_plugins(self, spec: str) -> None:
+        """Add the rules named in a comma-separated list of ``module:function`` paths."""
+        for path in filter(None, (p.strip() for p in spec.split(","))):
+            module, _, attr = path.partition(":")
+            try:
+                self.add(attr, getattr(importlib.import_module(module), attr))
+            except (ImportError, AttributeError, ValueError):
+                logger.warning("rule plugin %r not loaded", path, exc_info=True)
+
+    def evaluate(self, context: RuleContext) -> Optional[RuleHit]:
+        """Return the most confident answer of any rule, or None if none applies.
+
+        A rule that raises is logged and skipped. Ties go to the earlier rule.
+        """
+        best: Optional[RuleHit] = None
+        for name, rule in self.rules:
+            try:
+                body = rule(context)
+            except Exception:
+                logger.warning("rule %s failed", name, exc_info=True)
+                continue
+            if body is not None and (best is None or float(body.get("confidence", 0.0)) > best.confidence):
+                best = RuleHit(name, body)
+        return best
+
+
+# ----------------------------------------------------------------------
+# Circular imports
+# ----------------------------------------------------------------------
+_CIRCULAR = re.compile(r"partially initiali[sz]ed module|circular import", re.IGNORECASE)
+
+
+_FUNCTION = (ast.FunctionDef, ast.AsyncFunctionDef)
+
+
+def _node_start(node: ast.AST) -> int:
+    decorators = getattr(node, "decorator_list", [])
+    return min([node.lineno] + [d.lineno for d in decorators])  # type: ignore[attr-defined]
+
+
+def _loads(nodes: Sequence[ast.AST]) -> List[ast.Name]:
+    return [n for node in nodes for n in ast.walk(node) if isinstance(n, ast.Name) and isinstance(n.ctx, ast.Load)]
+
+
+def _evaluated_at_import(tree: ast.Module) -> List[ast.AST]:
+    """Nodes of `tree` that run when the module is imported, outside function bodies."""
+    nodes: List[ast.AST] = []
+    pending: List[ast.stmt] = list(tree.body)
+    while pending:
+        node = pending.pop()
+        if isinstance(node, _FUNCTION):
+            args = node.args
+            nodes.extend(node.decorator_list)
+            nodes.extend(args.defaults)
+            nodes.extend(d for d in args.kw_defaults if d is not None)
+            nodes.extend(a.annotation for a in args.posonlyargs + args.args + args.kwonlyargs if a.annotation)
+            nodes.extend(a.annotation for a in (args.vararg, args.kwarg) if a is not None and a.annotation)
+            if node.returns is not None:
+                nodes.append(node.returns)
+        elif isinstance(node, ast.ClassDef):
+            nodes.extend(node.decorator_list)
+            nodes.extend(node.bases)
+            nodes.extend(k.value for k in node.keywords)
+            pending.extend(node.body)
+        elif not isinstance(node, (ast.Import, ast.ImportFrom)):
+            nodes.append(node)
+    return nodes
+
+
+def lazy_import_patch(filename: str, text: str, imp: Import) -> Optional[str]:
+    """Return a diff moving the module-level import at `imp` into the functions using it.
+
+    Only top-level functions and methods of top-level classes receive the
+    import. Returns None when a bound name is needed at import time, is used
+    anywhere else, or is not used at all.
+    """
+    tree = ast.parse(text)
+    statement = next(
+        (n for n in tree.body if isinstance(n, (ast.Import, ast.ImportFrom)) and n.lineno == imp.start), None,
+    )
+    if statement is None or any(alias.name == "*" for alias in statement.names):
+        return None
+    names = {
+        alias.asname or (alias.name if isinstance(statement, ast.ImportFrom) else alias.name.split(".")[0])
+        for alias in statement.names
+    }
+    if any(n.id in names for n in _loads(_evaluated_at_import(tree))):
+        return None
+    functions = [n for n in tree.body if isinstance(n, _FUNCTION)]
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef):
+            functions.extend(n for n in node.body if isinstance(n, _FUNCTION))
+    users = [f for f in functions if any(n.id in names for n in _loads(f.body))]
+    covered = [(f.body[0].lineno, f.end_lineno or f.lineno) for f in users]
+    uses = [n.lineno for n in _loads([tree]) if n.id in names]
+    if not users or any(not any(a <= line <= b for a, b in covered) for line in uses):
+        return None
+
+    lines = text.splitlines(keepends=True)
+    source = "".join(lines[statement.lineno - 1:statement.end_lineno or statement.lineno]).strip()
+    # Line number -> statement inserted before it
+    inserts: Dict[int, str] = {}
+    for func in users:
+        body = func.body
+        if body[0].lineno == func.lineno:
+            # One-line function; leave the file alone
+            return None
+        first = body[0]
+        docstring = isinstance(first, ast.Expr) and isinstance(first.value, ast.Constant) and isinstance(
+            first.value.value, str)
+        indent = re.match(r"[ \t]*", lines[first.lineno - 1]).group(0)  # type: ignore[union-attr]
+        if docstring:
+            line = _node_start(body[1]) if len(body) > 1 else (first.end_lineno or first.lineno) + 1
+        else:
+            line = _node_start(first)
+        inserts[line] = f"{indent}{source}\n"
+    first_line, last_line = statement.lineno, statement.end_lineno or statement.lineno
+    if 1 < first_line and last_line < len(lines) and not lines[first_line - 2].strip() and not lines[last_line].strip():
+        # Do not leave a doubled blank line where the import was
+        last_line += 1
+    new_lines: List[str] = []
+    for number, line in enumerate(lines, start=1):
+        if number in inserts:
+            new_lines.append(inserts[number])
+        if first_line <= number <= last_line:
+            continue
+        new_lines.append(line)
+    if len(lines) + 1 in inserts:
+        if new_lines and not new_lines[-1].endswith("\n"):
+            new_lines[-1] += "\n"
+        new_lines.append(inserts[len(lines) + 1])
+    return unified_diff(filename, text, "".join(new_lines))
+
+
+def _statement(text: str, imp: Import) -> str:
+    return " ".join(line.strip() for line in text.splitlines()[imp.start - 1:imp.end])
+
+
+def circular_import(context: RuleContext) -> Optional[Dict[str, Any]]:
+    if not _CIRCULAR.search(context.error_log[-8192:]):
+        return None
+    cycles = context.graph.cycles()
+    if not cycles:
+        return None
+    frames = [(context.index.lookup(name), line) for name, line in context.references]
+    frames = [(f, line) for f, line in frames if f is not None]
+    cycle = max(cycles, key=lambda group: sum(f in group for f, _ in frames))
+    members = set(cycle)
+    files = context.decoded_files
+    edges = [
+        (source, imp, target)
+        for source in cycle
+        for imp, target in context.graph.edges.get(source, [])
+        if target in members and context.graph.summaries[source].enclosing(imp.start) is None
+    ]
+    if not edges:
+        return None
+    # Break the cycle at the innermost frame that is one of its imports
+    chosen = None
+    for f, line in reversed(frames):
+        chosen = next((e for e in edges if e[0] == f and e[1].start <= line <= e[1].end), None)
+        if chosen is not None:
+            break
+    if chosen is None:
+        candidates = edges
+    else:
+        # Any edge of a two-file cycle breaks it; in larger groups only the failing one is sure to
+        candidates = [chosen] + [e for e in edges if e is not chosen and len(cycle) == 2]
+    description = "; ".join(
+        f"{files[s]['filename']} imports {files[t]['filename']} at module level (line {imp.start})"
+        for s, imp, t in edges
+    )
+    root_cause = f"Circular import between {', '.join(files[i]['filename'] for i in cycle)}: {description}."
+    for source, imp, target in candidates:
+        patch = lazy_import_patch(files[source]["filename"], files[source]["content"], imp)
+        if patch is not None:
+            return make_response(
+                f"{root_cause} Moving `{_statement(files[source]['content'], imp)}` into the functions of "
+                f"{files[source]['filename']} that use it breaks the cycle.",
+                0.92, [patch], rule="circular_import",
+            )
+    return make_response(
+        root_cause + " The imported names are needed at import time, so the fix needs restructuring.",
+        0.6,
+        follow_up="Which module should own the shared definitions?",
+        rule="circular_import",
+    )
+
+
+# ----------------------------------------------------------------------
+# Missing third-party modules
+# ----------------------------------------------------------------------
+_MISSING = re.compile(r"No module named '([\w.]+)'")
+_REQUIREMENT_NAME = re.compile(r"^\s*([A-Za-z0-9][A-Za-z0-9._-]*)")
+
+# Import names whose distribution is named differently
+PACKAGE_NAMES = {
+    "yaml": "PyYAML",
+    "cv2": "opencv-python",
+    "PIL": "Pillow",
+    "sklearn": "scikit-learn",
+    "bs4": "beautifulsoup4",
+    "dateutil": "python-dateutil",
+    "dotenv": "python-dotenv",
+    "jwt": "PyJWT",
+    "magic": "python-magic",
+    "serial": "pyserial",
+    "Crypto": "pycryptodome",
+    "attr": "attrs",
+    "google.protobuf": "protobuf",
+    "multipart": "python-multipart",
+}
+
+# Widely used distributions imported under their own name. Any other missing
+# module may be first-party code the client did not upload (it only sends
+# changed files), so it is left to the model.
+KNOWN_PACKAGES = frozenset({
+    "aiohttp", "anyio", "boto3", "botocore", "celery", "click", "django", "fastapi", "flask", "httpx",
+    "jinja2", "jsonschema", "lxml", "matplotlib", "numpy", "openai", "pandas", "psycopg2", "pydantic",
+    "pymongo", "pytest", "redis", "requests", "rich", "scipy", "sqlalchemy", "starlette", "tensorflow",
+    "toml", "torch", "tqdm", "typer", "urllib3", "uvicorn", "yarl",
+})
+
+# Confidence for a module not known to come from a distribution
+_UNKNOWN_MODULE_CONFIDENCE = 0.5
+
+
+def _canonical(name: str) -> str:
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def _is_local(context: RuleContext, top: str) -> bool:
+    for file in context.decoded_files:
+        parts = file.get("filename", "").replace("\\", "/").split("/")
+        if top in parts[:-1] or parts[-1] in (f"{top}.py", top):
+            return True
+    return False
+
+
+def missing_module(context: RuleContext) -> Optional[Dict[str, Any]]:
+    match = None
+    for match in _MISSING.finditer(context.error_log[-8192:]):
+        pass
+    if match is None:
+        return None
+    module = match.group(1)
+    top = module.split(".")[0]
+    if top in sys.stdlib_module_names or _is_local(context, top):
+        return None
+    package = PACKAGE_NAMES.get(module) or PACKAGE_NAMES.get(top)
+    known = package is not None or top in KNOWN_PACKAGES
+    package = package or top
+    max_confidence = 1.0 if known else _UNKNOWN_MODULE_CONFIDENCE
+    requirements = next(
+        (f for f in context.decoded_files if os.path.basename(f.get("filename", "")) == "requirements.txt"), None,
+    )
+    if requirements is None:
+        patch = unified_diff("requirements.txt", "", f"{package}\n").replace("--- a/requirements.txt", "--- /dev/null")
+        return make_response(
+            f"The third-party module '{module}' is imported but not installed; it is provided by the "
+            f"'{package}' distribution.",
+            min(0.7, max_confidence),
+            [patch],
+            follow_up="Where are this project's dependencies declared?",
+            rule="missing_module",
+        )
+    listed = set()
+    for line in requirements["content"].splitlines():
+        name = _REQUIREMENT_NAME.match(line.split("#", 1)[0])
+        if name:
+            listed.add(_canonical(name.group(1)))
+    if _canonical(package) in listed:
+        return make_response(
+            f"The module '{module}' comes from '{package}', which {requirements['filename']} already lists, "
+            "but it is not installed in the environment that ran the tests.",
+            min(0.8, max_confidence),
+            follow_up=f"Run `pip install -r {requirements['filename']}` and re-run the tests.",
+            rule="missing_module",
+        )
+    old = requirements["content"]
+    new = old + ("" if not old or old.endswith("\n") else "\n") + f"{package}\n"
+    if not known:
+        return make_response(
+            f"The module '{module}' cannot be imported. It is neither an uploaded file nor a known "
+            f"distribution; if it is a third-party package, add it to {requirements['filename']}.",
+            max_confidence,
+            [unified_diff(requirements["filename"], old, new)],
+            follow_up=f"Is '{module}' part of this project, or a package to install?",
+            rule="missing_module",
+        )
+    return make_response(
+        f"The third-party module '{module}' is imported but '{package}' is missing from "
+        f"{requirements['filename']}, so it is not installed.",
+        0.9, [unified_diff(requirements["filename"], old, new)], rule="missing_module",
+    )
+
+
+# ----------------------------------------------------------------------
+# Assertion diffs
+# ----------------------------------------------------------------------
+# pytest's rewritten assertions and unittest's assertEqual messages
+_ASSERT_EQ = re.compile(r"^(?:E\s+)?(?:AssertionError: )?assert (.+?) == (.+)$", re.MULTILINE)
+_ASSERT_NE = re.compile(r"^(?:E\s+)?AssertionError: (.+?) != (.+)$", re.MULTILINE)
+
+
+def _literal(text: str) -> Any:
+    try:
+        return ast.literal_eval(text.strip())
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return None
+
+
+def describe_difference(left: Any, right: Any) -> Optional[str]:
+    """Describe how two literal values differ, or None if they cannot be compared."""
+    if isinstance(left, str) and isinstance(right, str):
+        if left.strip() == right.strip():
+            return "the strings differ only in leading or trailing whitespace"
+        if left.lower() == right.lower():
+            return "the strings differ only in letter case"
+        position = next((i for i, (a, b) in enumerate(zip(left, right)) if a != b), min(len(left), len(right)))
+        return f"the strings first differ at index {position}"
+    if isinstance(left, (int, float)) and isinstance(right, (int, float)):
+        return f"the values differ by {right - left!r}"
+    if isinstance(left, (list, tuple)) and isinstance(right, (list, tuple)):
+        if sorted(map(repr, left)) == sorted(map(repr, right)):
+            return "the sequences hold the same items in a different order"
+        if len(left) != len(right):
+            return f"the sequences have {len(left)} and {len(right)} items"
+        position = next(i for i, (a, b) in enumerate(zip(left, right)) if a != b)
+        return f"the sequences first differ at index {position}: {left[position]!r} != {right[position]!r}"
+    if isinstance(left, dict) and isinstance(right, dict):
+        parts = []
+        if left.keys() - right.keys():
+            parts.append(f"only the left has keys {sorted(map(repr, left.keys() - right.keys()))}")
+        if right.keys() - left.keys():
+            parts.append(f"only the right has keys {sorted(map(repr, right.keys() - left.keys()))}")
+        changed = sorted(repr(k) for k in left.keys() & right.keys() if left[k] != right[k])
+        if changed:
+            parts.append(f"keys {changed} have different values")
+        return "; ".join(parts) or None
+    return None
+
+
+def assertion_diff(context: RuleContext) -> Optional[Dict[str, Any]]:
+    tail = context.error_log[-8192:]
+    matches = list(_ASSERT_EQ.finditer(tail)) or list(_ASSERT_NE.finditer(tail))
+    if not matches:
+        return None
+    left_text, right_text = matches[-1].group(1), matches[-1].group(2)
+    left, right = _literal(left_text), _literal(right_text)
+    if left is None or right is None or left == right:
+        return None
+    difference = describe_difference(left, right)
+    if difference is None:
+        return None
+    where = ""
+    if context.references:
+        name, line = context.references[-1]
+        where = f" at {name}:{line}"
+    return make_response(
+        f"Equality assertion failed{where}: {left_text.strip()} != {right_text.strip()}; {difference}.",
+        0.55,
+        follow_up="Is the code under test or the expected value out of date?",
+        rule="assertion_diff",
+    )
+
+
+BUILTIN_RULES: List[Tuple[str, Rule]] = [
+    ("circular_import", circular_import),
+    ("missing_module", missing_module),
+    ("assertion_diff", assertion_diff),
+]
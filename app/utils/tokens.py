@@ -0,0 +1,112 @@
+"""
+Token estimation and per-model prompt budgets.
+
+Prompts used to be sized by ``len(prompt.split())``, which undercounts code
+badly: ``foo(bar[0])`` is one whitespace-separated word but about six model
+tokens. `estimate_tokens` approximates a BPE tokenizer with a single
+compiled regex, splitting letters into runs of at most six characters,
+digits into groups of three, punctuation into pairs, and counting each
+newline plus its indentation once. It runs at C speed and tends to err
+slightly high, which is the safe side for budgeting.
+
+When `PROMPT_TOKENIZER=tiktoken` is set and the `tiktoken` package (with its
+encoding files) is available, exact counts are used instead. That is opt-in
+because loading an encoding may download it on first use.
+"""
+
+import os
+import re
+from typing import Callable, Dict, Optional
+
+# Default prompt budgets in tokens; the models accept far more, but larger
+# prompts cost more and answer slower without improving diagnoses
+DEFAULT_MODEL_BUDGETS: Dict[str, int] = {
+    "gpt-4o": 24000,
+    "gpt-4o-mini": 12000,
+}
+DEFAULT_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", "12000"))
+
+_PIECE = re.compile(r"[A-Za-z]{1,6}|\d{1,3}|[^\x00-\x7f]|[^\w\s]{1,2}|_|\n[ \t]*")
+
+_tokenizer: Optional[Callable[[str], int]] = None
+_tokenizer_loaded = False
+
+
+def _parse_budgets(spec: str) -> Dict[str, int]:
+    """Parse ``model=tokens`` pairs separated by commas."""
+    budgets: Dict[str, int] = {}
+    for item in spec.split(","):
+        if "=" in item:
+            model, _, value = item.partition("=")
+            budgets[model.strip()] = int(value)
+    return budgets
+
+
+MODEL_BUDGETS: Dict[str, int] = {
+    **DEFAULT_MODEL_BUDGETS,
+    **_parse_budgets(os.environ.get("PROMPT_TOKEN_BUDGETS", "")),
+}
+
+
+def _load_tokenizer() -> Optional[Callable[[str], int]]:
+    global _tokenizer, _tokenizer_loaded
+    if not _tokenizer_loaded:
+        _tokenizer_loaded = True
+        if os.environ.get("PROMPT_TOKENIZER", "").lower() == "tiktoken":
+            try:
+                import tiktoken  # type: ignore
+
+                encoding = tiktoken.get_encoding("o200k_base")
+                _tokenizer = lambda text: len(encoding.encode(text, disallowed_special=()))
+            except Exception:
+                _tokenizer = None  # fall back to the estimate
+    return _tokenizer
+
+
+def estimate_tokens(text: str) -> int:
+    """Return the (estimated) number of model tokens in `text`."""
+    if not text:
+        return 0
+    tokenizer = _load_tokenizer()
+    if tokenizer is not None:
+        return tokenizer(text)
+    return len(_PIECE.findall(text))
+
+
+def prompt_budget(model: str) -> int:
+    """Return the prompt token budget for `model`.
+
+    Budgets come from `DEFAULT_MODEL_BUDGETS`, overridden per model by the
+    `PROMPT_TOKEN_BUDGETS` environment variable (``gpt-4o=32000,...``);
+    unknown models get `PROMPT_TOKEN_BUDGET`.
+    """
+    return MODEL_BUDGETS.get(model, DEFAULT_BUDGET)
+
+
+def truncate_to_tokens(text: str, max_tokens: int, keep: str = "head") -> str:
+    """Return the longest prefix (or suffix, with ``keep='tail'``) of `text` within `max_tokens`.
+
+    Cuts fall on line boundaries where possible so code stays readable.
+    """
+    if max_tokens <= 0:
+        return ""
+    total = estimate_tokens(text)
+    if total <= max_tokens:
+        return text
+    # Start from a proportional cut and shrink until it fits
+    length = int(len(text) * max_tokens / total)
+    while length > 0:
+        if keep == "tail":
+            piece = text[len(text) - length:]
+            newline = piece.find("\n")
+            if 0 <= newline < len(piece) - 1:
+                piece = piece[newline + 1:]
+        else:
+            piece = text[:length]
+            newline = piece.rfind("\n")
+            if newline > 0:
+                piece = piece[:newline]
+        if estimate_tokens(piece) <= max_tokens:
+            return piece
+        length = int(length * 0.9)
+    return ""
@@ -2,85 +2,525 @@
 In‑memory vector store for embedding and retrieving relevant code snippets.
 
 This module provides a simple alternative to a full‑featured vector database like
-Chroma. It uses scikit‑learn's TF-IDF implementation to embed file contents
+Chroma. It uses scikit‑learn's TF-IDF tokenisation to embed file contents
 into a vector space and cosine similarity to retrieve the most relevant
-snippets given a textual query. The store lives entirely in process and is
-rebuilt on each call to `embed_files`.
+snippets given a textual query.
+
+Documents are indexed at chunk granularity. Python sources are split at
+top-level `def`/`class` boundaries (large classes at their methods), other
+files into fixed line windows, and queries rank those chunks so the prompt
+receives the relevant function rather than the first lines of a file.
+
+Each `VectorStore` is an independent index scoped to a request or a client
+session, so concurrent requests never see each other's documents. Session
+stores are kept in a `StoreCache`, an LRU bounded by an estimated memory
+budget in bytes.
+
+Indexing is incremental and content addressed. Term counts for each file are
+cached under the SHA-256 of its content in a `TermVectorCache` shared by all
+stores, so a file that was embedded by any earlier request is never
+re-tokenised. A store updates its document frequencies by adding the counts
+of new documents and subtracting those of documents that left its set, which
+keeps the cost of `VectorStore.embed` proportional to the bytes that changed
+rather than to the whole payload. The TF-IDF matrix itself is assembled
+lazily from the cached counts on the next query.
 
 If `chromadb` is available in the environment, you could substitute this
 implementation with an actual Chroma client. For the purposes of this proof‑
 of‑concept, TF-IDF embeddings suffice.
 """
 
-from typing import List, Dict, Any
+import ast
+import hashlib
+import os
+import re
+import sys
+import threading
+from collections import Counter, OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
 
 import numpy as np  # type: ignore
+from scipy import sparse  # type: ignore
 from sklearn.feature_extraction.text import TfidfVectorizer  # type: ignore
-from sklearn.metrics.pairwise import cosine_similarity  # type: ignore
 
-# Global variables for the vector store
-_vectorizer: TfidfVectorizer | None = None
-_matrix: Any = None  # Will hold the TF-IDF matrix
-_docs: List[Dict[str, Any]] = []  # Each entry holds {'filename': str, 'content': str}
+# Memory budget for the shared, content-addressed term vector cache.
+TERM_CACHE_BYTES = int(os.environ.get("VECTOR_TERM_CACHE_BYTES", str(64 * 1024 * 1024)))
+# The shared vocabulary is reset once it holds this many distinct terms.
+MAX_VOCAB_TERMS = int(os.environ.get("VECTOR_MAX_VOCAB_TERMS", "1000000"))
+# Memory budget for all session stores held by a StoreCache.
+STORE_CACHE_BYTES = int(os.environ.get("VECTOR_STORE_CACHE_BYTES", str(256 * 1024 * 1024)))
+# Chunks longer than this are split into windows; non-Python files use
+# windows of CHUNK_WINDOW_LINES throughout.
+CHUNK_MAX_LINES = int(os.environ.get("VECTOR_CHUNK_MAX_LINES", "80"))
+CHUNK_WINDOW_LINES = int(os.environ.get("VECTOR_CHUNK_WINDOW_LINES", "40"))
+# Number of files whose chunk boundaries are remembered by content hash.
+SPAN_CACHE_SIZE = 16384
 
+_NEWLINE = re.compile(r'\r\n?|\n')
 
-def embed_files(decoded_files: List[Dict[str, Any]]) -> None:
-    """Embed a list of decoded file contents into the vector store.
+# Reuse scikit-learn's analyzer so tokens match what TfidfVectorizer produces
+_analyze = TfidfVectorizer(stop_words='english').build_analyzer()
 
-    Each call replaces any previously stored vectors. The decoded_files list
-    should contain dictionaries with keys 'filename' and 'content'. Only
-    non‑empty content entries are embedded. The embeddings are stored
-    globally for subsequent queries.
-    """
-    global _vectorizer, _matrix, _docs
-    texts: List[str] = []
-    docs: List[Dict[str, Any]] = []
-    for item in decoded_files:
-        text = item.get('content', '')
-        if text:
-            texts.append(text)
-            docs.append(item)
-    if not texts:
-        # Nothing to embed
-        _vectorizer = None
-        _matrix = None
-        _docs = []
-        return
-    # Create a new vectorizer and fit to texts
-    _vectorizer = TfidfVectorizer(stop_words='english')
-    _matrix = _vectorizer.fit_transform(texts)
-    _docs = docs
+# Term counts of one document: sorted vocabulary ids and their frequencies
+TermVector = Tuple[np.ndarray, np.ndarray]
 
 
-def query_snippets(query: str, k: int = 5) -> List[str]:
-    """Return up to `k` snippets whose content is most similar to the query.
+def content_hash(text: str) -> str:
+    """Return the hex SHA-256 digest used to address a document's content."""
+    return hashlib.sha256(text.encode('utf-8', errors='ignore')).hexdigest()
+
+
+def _vector_nbytes(vector: TermVector) -> int:
+    return vector[0].nbytes + vector[1].nbytes
+
+
+# ----------------------------------------------------------------------
+# Chunking
+# ----------------------------------------------------------------------
+Span = Tuple[int, int]  # 1-indexed, inclusive line range
+
 
-    The returned snippets are simple string excerpts taken from the start of
-    each document to maintain brevity (up to 1000 characters). If no
-    embeddings have been created, an empty list is returned.
+def _windows(start: int, end: int, size: int) -> List[Span]:
+    return [(s, min(s + size - 1, end)) for s in range(start, end + 1, size)]
+
+
+def _node_start(node: ast.AST) -> int:
+    decorators = getattr(node, 'decorator_list', [])
+    return min([node.lineno] + [d.lineno for d in decorators])  # type: ignore[attr-defined]
+
+
+def _python_spans(text: str, n_lines: int) -> Optional[List[Span]]:
+    """Split Python source at top-level def/class boundaries.
+
+    Module-level code between definitions forms its own chunks. Returns None
+    when the source cannot be parsed so the caller can fall back to windows.
     """
-    global _vectorizer, _matrix, _docs
-    if _vectorizer is None or _matrix is None or not _docs:
-        return []
-    # Transform the query into the same vector space
-    try:
-        query_vec = _vectorizer.transform([query])
-    except Exception:
-        return []
-    # Compute cosine similarity between query and all docs
     try:
-        similarities = cosine_similarity(query_vec, _matrix)[0]
-    except Exception:
-        return []
-    # Get indices of top k similar documents
-    top_indices = np.argsort(similarities)[::-1][:k]
-    snippets: List[str] = []
-    for idx in top_indices:
-        if idx >= len(_docs):
+        tree = ast.parse(text)
+    except (SyntaxError, ValueError):
+        return None
+    defs = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+    spans: List[Span] = []
+    covered = 0
+    for node in tree.body:
+        if not isinstance(node, defs):
             continue
-        doc = _docs[int(idx)]
-        text = doc.get('content', '')
-        # Take up to first 1000 characters of the document to avoid large prompts
-        snippet = text[:1000]
-        snippets.append(snippet)
-    return snippets
\ No newline at end of file
+        start, end = _node_start(node), node.end_lineno or node.lineno
+        if start > covered + 1:
+            spans.append((covered + 1, start - 1))
+        methods = [n for n in node.body if isinstance(n, defs)] if isinstance(node, ast.ClassDef) else []
+        if end - start + 1 > CHUNK_MAX_LINES and methods:
+            # Split a large class into its header and one chunk per method
+            cursor = start
+            for method in methods:
+                method_start = _node_start(method)
+                if method_start > cursor:
+                    spans.append((cursor, method_start - 1))
+                cursor = (method.end_lineno or method.lineno) + 1
+                spans.append((method_start, cursor - 1))
+            if cursor <= end:
+                spans.append((cursor, end))
+        else:
+            spans.append((start, end))
+        covered = end
+    if covered < n_lines:
+        spans.append((covered + 1, n_lines))
+    return spans
+
+
+def chunk_spans(filename: str, text: str) -> List[Span]:
+    """Return the line spans `text` is indexed as.
+
+    Python files are split at definition boundaries, everything else (and
+    Python that does not parse) into windows of CHUNK_WINDOW_LINES lines.
+    Spans longer than CHUNK_MAX_LINES are always windowed.
+    """
+    n_lines = len(_NEWLINE.split(text))
+    spans = _python_spans(text, n_lines) if filename.endswith('.py') else None
+    if spans is None:
+        return _windows(1, n_lines, CHUNK_WINDOW_LINES)
+    result: List[Span] = []
+    for start, end in spans:
+        if end - start + 1 > CHUNK_MAX_LINES:
+            result.extend(_windows(start, end, CHUNK_WINDOW_LINES))
+        else:
+            result.append((start, end))
+    return result
+
+
+def split_chunks(filename: str, text: str, spans: Optional[List[Span]] = None) -> List[Dict[str, Any]]:
+    """Split a file into chunk dicts with 'filename', 'start', 'end' and 'content'.
+
+    Chunks that contain only whitespace are dropped.
+    """
+    lines = _NEWLINE.split(text)
+    chunks: List[Dict[str, Any]] = []
+    for start, end in spans if spans is not None else chunk_spans(filename, text):
+        chunk_text = "\n".join(lines[start - 1:end])
+        if chunk_text.strip():
+            chunks.append({'filename': filename, 'start': start, 'end': end, 'content': chunk_text})
+    return chunks
+
+
+class TermVectorCache:
+    """Thread-safe, content-addressed cache of term vectors and chunk spans.
+
+    The vocabulary is shared by every store using the cache, which lets
+    stores reuse each other's vectors directly. When the vocabulary grows past
+    `max_terms` it is discarded together with the cached vectors and the
+    `generation` counter is bumped; stores built against an older generation
+    re-vectorise their documents on their next update.
+    """
+
+    def __init__(self, max_bytes: int = TERM_CACHE_BYTES, max_terms: int = MAX_VOCAB_TERMS) -> None:
+        self.max_bytes = max_bytes
+        self.max_terms = max_terms
+        self.generation = 0
+        self.tokenized_bytes = 0  # running total, useful for monitoring reuse
+        self._lock = threading.Lock()
+        self._vocab: Dict[str, int] = {}
+        self._vectors: "OrderedDict[str, TermVector]" = OrderedDict()
+        self._nbytes = 0
+        self._spans: "OrderedDict[Tuple[str, str], List[Span]]" = OrderedDict()
+
+    @property
+    def n_terms(self) -> int:
+        return len(self._vocab)
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def vectorise(self, digest: str, text: str) -> Tuple[int, TermVector]:
+        """Return ``(generation, vector)`` for `text`, tokenising only on a miss."""
+        with self._lock:
+            cached = self._vectors.get(digest)
+            if cached is not None:
+                self._vectors.move_to_end(digest)
+                return self.generation, cached
+        # Tokenise outside the lock so concurrent requests do not serialise
+        counts = Counter(_analyze(text))
+        with self._lock:
+            if len(self._vocab) + len(counts) > self.max_terms:
+                self._reset()
+            vocab = self._vocab
+            ids = np.empty(len(counts), dtype=np.int64)
+            for i, term in enumerate(counts):
+                term_id = vocab.get(term)
+                if term_id is None:
+                    term_id = vocab[term] = len(vocab)
+                ids[i] = term_id
+            freqs = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+            order = np.argsort(ids)
+            vector = (ids[order], freqs[order])
+            self.tokenized_bytes += len(text)
+            if digest not in self._vectors:
+                self._vectors[digest] = vector
+                self._nbytes += _vector_nbytes(vector)
+                self._evict()
+            return self.generation, vector
+
+    def spans(self, digest: str, filename: str, text: str) -> List[Span]:
+        """Return the chunk spans of a file, computing them once per content."""
+        key = (digest, os.path.splitext(filename)[1])
+        with self._lock:
+            cached = self._spans.get(key)
+            if cached is not None:
+                self._spans.move_to_end(key)
+                return cached
+        spans = chunk_spans(filename, text)
+        with self._lock:
+            self._spans[key] = spans
+            while len(self._spans) > SPAN_CACHE_SIZE:
+                self._spans.popitem(last=False)
+        return spans
+
+    def term_ids(self, terms: List[str]) -> Tuple[int, List[Tuple[int, str]]]:
+        """Look up known `terms`, returning ``(generation, [(id, term), ...])``."""
+        with self._lock:
+            vocab = self._vocab
+            return self.generation, [(vocab[t], t) for t in terms if t in vocab]
+
+    def _evict(self) -> None:
+        while self._nbytes > self.max_bytes and len(self._vectors) > 1:
+            _, vector = self._vectors.popitem(last=False)
+            self._nbytes -= _vector_nbytes(vector)
+
+    def _reset(self) -> None:
+        self._vocab = {}
+        self._vectors.clear()
+        self._nbytes = 0
+        self.generation += 1
+
+
+# Term vectors shared by every store in the process
+_shared_terms = TermVectorCache()
+
+
+class VectorStore:
+    """TF-IDF index over the chunks of one request's or session's files.
+
+    Document frequencies are maintained incrementally as documents enter and
+    leave the indexed set. IDF weights use the same smoothed formula as
+    scikit-learn (``ln((1 + n) / (1 + df)) + 1``) and rows are L2-normalised,
+    so rankings match a freshly fitted ``TfidfVectorizer``.
+
+    Every method is thread-safe. A caller that needs to query the documents
+    of its own `embed` call, while other threads share the store, should hold
+    the store as a context manager around `embed` and `snapshot` and query
+    the snapshot.
+    """
+
+    def __init__(self, term_cache: Optional[TermVectorCache] = None) -> None:
+        self._terms = term_cache or _shared_terms
+        self._lock = threading.RLock()
+        self._generation = self._terms.generation
+        self._df = np.zeros(0, dtype=np.int64)
+        self._docs: List[Dict[str, Any]] = []  # chunks, in index order
+        self._doc_hashes: List[str] = []
+        self._vectors: Dict[str, TermVector] = {}
+        # (filename, file digest) -> [(chunk digest, chunk)] for the current files
+        self._files: Dict[Tuple[str, str], List[Tuple[str, Dict[str, Any]]]] = {}
+        self._matrix: Any = None
+        self._idf: Any = None
+
+    def __enter__(self) -> "VectorStore":
+        self._lock.acquire()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self._lock.release()
+
+    @property
+    def nbytes(self) -> int:
+        """Estimated memory held by this store, including document text."""
+        total = self._df.nbytes
+        total += sum(_vector_nbytes(v) for v in self._vectors.values())
+        total += sum(sys.getsizeof(d.get('content', '')) for d in self._docs)
+        if self._matrix is not None:
+            total += self._matrix.data.nbytes + self._matrix.indices.nbytes + self._matrix.indptr.nbytes
+        return total
+
+    def _add_df(self, vector: TermVector, count: int) -> None:
+        ids = vector[0]
+        if len(ids) and ids[-1] >= len(self._df):
+            grown = np.zeros(max(int(ids[-1]) + 1, 2 * len(self._df)), dtype=np.int64)
+            grown[:len(self._df)] = self._df
+            self._df = grown
+        self._df[ids] += count
+
+    def embed(self, decoded_files: List[Dict[str, Any]]) -> None:
+        """Replace the indexed document set, reusing cached term vectors.
+
+        The decoded_files list should contain dictionaries with keys
+        'filename' and 'content'. Only non‑empty content entries are embedded.
+        Files whose content is unchanged since the previous call are not
+        re-chunked, and chunks seen before by any store are not re-tokenised.
+        """
+        with self._lock:
+            if self._generation != self._terms.generation:
+                # The shared vocabulary was reset; start again from scratch
+                self._df = np.zeros(0, dtype=np.int64)
+                self._doc_hashes = []
+                self._vectors = {}
+                self._generation = self._terms.generation
+            files: Dict[Tuple[str, str], List[Tuple[str, Dict[str, Any]]]] = {}
+            for item in decoded_files:
+                text = item.get('content', '')
+                if not text:
+                    continue
+                filename = item.get('filename', '')
+                digest = content_hash(text)
+                key = (filename, digest)
+                chunks = self._files.get(key) or files.get(key)
+                if chunks is None:
+                    spans = self._terms.spans(digest, filename, text)
+                    chunks = [(content_hash(c['content']), c) for c in split_chunks(filename, text, spans)]
+                files[key] = chunks
+            docs = [chunk for chunks in files.values() for _, chunk in chunks]
+            hashes = [h for chunks in files.values() for h, _ in chunks]
+            old = Counter(self._doc_hashes)
+            new = Counter(hashes)
+            vectors = dict(self._vectors)
+            for digest, doc in zip(hashes, docs):
+                if digest not in vectors:
+                    generation, vectors[digest] = self._terms.vectorise(digest, doc['content'])
+                    if generation != self._generation:
+                        # Reset raced with this update; rebuild against the new vocabulary
+                        self._doc_hashes = []
+                        self._vectors = {}
+                        return self.embed(decoded_files)
+            for digest, count in (new - old).items():
+                self._add_df(vectors[digest], count)
+            for digest, count in (old - new).items():
+                self._add_df(vectors[digest], -count)
+                if not new[digest]:
+                    # Keep vectors of chunks still indexed by another file
+                    del vectors[digest]
+            self._files = files
+            self._docs = docs
+            self._doc_hashes = hashes
+            self._vectors = vectors
+            self._matrix = None
+
+    def _ensure_matrix(self) -> None:
+        """Assemble the L2-normalised TF-IDF matrix from cached term vectors."""
+        if self._matrix is not None or not self._docs:
+            return
+        n_docs = len(self._docs)
+        df = self._df
+        idf = np.log((1 + n_docs) / (1 + df)) + 1.0
+        idf[df == 0] = 0.0  # terms absent from the current set carry no weight
+        doc_vectors = [self._vectors[h] for h in self._doc_hashes]
+        indptr = np.zeros(n_docs + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(ids) for ids, _ in doc_vectors])
+        indices = np.concatenate([ids for ids, _ in doc_vectors])
+        data = np.concatenate([freqs for _, freqs in doc_vectors]) * idf[indices]
+        matrix = sparse.csr_matrix((data, indices, indptr), shape=(n_docs, len(df)))
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1.0
+        self._matrix = sparse.diags(1.0 / norms) @ matrix
+        self._idf = idf
+
+    def snapshot(self) -> "StoreSnapshot":
+        """Return a read-only view of the current documents.
+
+        Later `embed` calls do not affect the snapshot, so a request can embed
+        its files and take a snapshot under the store lock, then query it
+        without holding the lock while other requests update the store.
+        """
+        with self._lock:
+            self._ensure_matrix()
+            return StoreSnapshot(self._terms, self._generation, self._docs, self._matrix, self._idf)
+
+    def query_chunks(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
+        """Return up to `k` chunks most similar to the query, best first.
+
+        See `StoreSnapshot.query_chunks`.
+        """
+        return self.snapshot().query_chunks(query, k)
+
+    def query_snippets(self, query: str, k: int = 5) -> List[str]:
+        """Return the text of up to `k` chunks most similar to the query."""
+        return self.snapshot().query_snippets(query, k)
+
+
+class StoreSnapshot:
+    """The documents of a `VectorStore` at one point in time, for querying.
+
+    Queries against a snapshot return nothing once the shared vocabulary it
+    was built against has been reset.
+
+    Parameters:
+      terms: The term vector cache the store's vocabulary comes from.
+      generation: Vocabulary generation the matrix was built against.
+      docs: Chunks, in matrix row order.
+      matrix: L2-normalised TF-IDF matrix, or None when there are no chunks.
+      idf: IDF weight of each term id.
+    """
+
+    def __init__(self, terms: TermVectorCache, generation: int, docs: List[Dict[str, Any]], matrix: Any, idf: Any) -> None:
+        self._terms = terms
+        self._generation = generation
+        self._docs = docs
+        self._matrix = matrix
+        self._idf = idf
+
+    def query_chunks(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
+        """Return up to `k` chunks most similar to the query, best first.
+
+        Each result is a dictionary with 'filename', 'start' and 'end'
+        (1-indexed, inclusive line numbers), 'snippet' and the cosine 'score'.
+        Chunks sharing no terms with the query are never returned.
+        """
+        if not self._docs or self._matrix is None:
+            return []
+        counts = Counter(_analyze(query))
+        generation, known = self._terms.term_ids(list(counts))
+        known = [(i, t) for i, t in known if i < len(self._idf)]
+        if not known or generation != self._generation:
+            return []
+        ids = np.array([i for i, _ in known], dtype=np.int64)
+        weights = np.array([counts[t] for _, t in known], dtype=np.float64) * self._idf[ids]
+        norm = np.linalg.norm(weights)
+        if norm == 0:
+            return []
+        scores = self._matrix[:, ids] @ (weights / norm)
+        top_indices = np.argsort(scores, kind='stable')[::-1][:k]
+        results: List[Dict[str, Any]] = []
+        for idx in top_indices:
+            if scores[idx] <= 0:
+                break
+            chunk = self._docs[int(idx)]
+            results.append({
+                'filename': chunk['filename'],
+                'start': chunk['start'],
+                'end': chunk['end'],
+                'snippet': chunk['content'],
+                'score': float(scores[idx]),
+            })
+        return results
+
+    def query_snippets(self, query: str, k: int = 5) -> List[str]:
+        """Return the text of up to `k` chunks most similar to the query."""
+        return [chunk['snippet'] for chunk in self.query_chunks(query, k)]
+
+
+class StoreCache:
+    """LRU cache of session-scoped `VectorStore` objects with a byte budget.
+
+    Sizes are re-estimated on every `trim`, which callers should invoke after
+    embedding into a store they obtained from `get`. The most recently used
+    store is never evicted, even if it alone exceeds the budget.
+    """
+
+    def __init__(self, max_bytes: int = STORE_CACHE_BYTES, term_cache: Optional[TermVectorCache] = None) -> None:
+        self.max_bytes = max_bytes
+        self._terms = term_cache or _shared_terms
+        self._lock = threading.Lock()
+        self._stores: "OrderedDict[str, VectorStore]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._stores)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._stores
+
+    def get(self, key: str) -> VectorStore:
+        """Return the store for `key`, creating it if needed."""
+        with self._lock:
+            store = self._stores.get(key)
+            if store is None:
+                store = self._stores[key] = VectorStore(self._terms)
+            else:
+                self._stores.move_to_end(key)
+            return store
+
+    def trim(self) -> None:
+        """Evict least recently used stores until the budget is respected."""
+        with self._lock:
+            sizes = {key: store.nbytes for key, store in self._stores.items()}
+            total = sum(sizes.values())
+            while total > self.max_bytes and len(self._stores) > 1:
+                key, _ = self._stores.popitem(last=False)
+                total -= sizes[key]
+
+
+# Store behind the module-level helpers below. Callers that may run
+# concurrently should create their own VectorStore instead.
+_default_store = VectorStore()
+
+
+def embed_files(decoded_files: List[Dict[str, Any]]) -> None:
+    """Embed a list of decoded file contents into the default vector store.
+
+    Each call replaces the set of documents that queries search over, but term
+    vectors of previously seen contents are reused from the content-addressed
+    cache.
+    """
+    _default_store.embed(decoded_files)
+
+
+def query_snippets(query: str, k: int = 5) -> List[str]:
+    """Return up to `k` snippets from the default store most similar to the query."""
+    return _default_store.query_snippets(query, k)
@@ -0,0 +1,96 @@
+"""
+Concurrency benchmark for the /diagnose upstream path.
+
+Fires N simultaneous diagnoses at the backend while a local stub upstream
+(see `benchmarks.stub_upstream`) holds every completion for a fixed latency,
+and compares two ways of serving them:
+
+* ``blocking``: the previous design, where each request occupies one of
+  Starlette's 40 threadpool threads for the whole upstream call and opens a
+  fresh connection with ``requests.post``.
+* ``async``: the current endpoint, which awaits the call on the shared pooled
+  ``httpx.AsyncClient`` so in-flight diagnoses no longer hold a thread.
+
+Metrics writes are disabled for both runs so the comparison isolates the
+upstream call.
+
+Usage::
+
+    python -m benchmarks.bench_concurrency --requests 100 --latency 1.0
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import requests
+
+os.environ.setdefault('METRICS_DB', os.path.join(tempfile.mkdtemp(), 'metrics.db'))
+os.environ['OPENAI_API_KEY'] = 'sk-benchmark'
+
+from app import main  # noqa: E402
+from benchmarks.stub_upstream import StubServer  # noqa: E402
+
+# Starlette's default threadpool size (anyio's default capacity limiter)
+THREADPOOL_SIZE = 40
+
+PAYLOAD = {
+    'files': [],
+    'error_log': 'Traceback (most recent call last):\n  File "app.py", line 3\nValueError: boom',
+    'summary': 'benchmark',
+}
+
+
+def run_blocking(n: int) -> float:
+    """Previous design: sync handler with a blocking request per call."""
+    req = main.DiagnoseRequest(**PAYLOAD)
+    url = f'{main.OPENAI_API_BASE}/chat/completions'
+
+    def handle(_: int) -> dict:
+        model, prompt = main.prepare_prompt(req)
+        body = {'model': model, 'messages': [{'role': 'user', 'content': prompt}], 'temperature': 0}
+        response = requests.post(url, json=body, headers={'Authorization': 'Bearer sk-benchmark'}, timeout=30)
+        response.raise_for_status()
+        return json.loads(response.json()['choices'][0]['message']['content'])
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=THREADPOOL_SIZE) as pool:
+        list(pool.map(handle, range(n)))
+    return time.perf_counter() - start
+
+
+async def run_async(n: int) -> float:
+    """Current design: async endpoint sharing one pooled upstream client."""
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://backend', timeout=60) as client:
+            start = time.perf_counter()
+            responses = await asyncio.gather(*(client.post('/diagnose', json=PAYLOAD) for _ in range(n)))
+            elapsed = time.perf_counter() - start
+    assert all(r.status_code == 200 for r in responses)
+    return elapsed
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=100, help='concurrent diagnoses to issue')
+    parser.add_argument('--latency', type=float, default=1.0, help='stub upstream latency in seconds')
+    args = parser.parse_args()
+    main.metrics_writer.log = lambda *args, **kwargs: None
+    with StubServer(latency=args.latency) as stub:
+        main.OPENAI_API_BASE = stub.base_url
+        blocking = run_blocking(args.requests)
+        pooled = asyncio.run(run_async(args.requests))
+    print(f'{args.requests} concurrent diagnoses, upstream latency {args.latency * 1000:.0f} ms')
+    for name, elapsed in (('blocking', blocking), ('async', pooled)):
+        print(f'  {name:<9} {elapsed:7.2f} s  {args.requests / elapsed:8.1f} req/s')
+    print(f'  speed-up  {blocking / pooled:7.1f}x')
+
+
+if __name__ == '__main__':
+    main_cli()
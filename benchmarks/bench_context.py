@@ -0,0 +1,92 @@
+"""
+Microbenchmark for context extraction.
+
+Builds a synthetic request of 200 decoded files and 1,000 error log
+references, many of them close together in the same few files as in a deep
+traceback, and times `extract_context` against the previous implementation,
+which scanned every file and re-split its content for each reference.
+
+Usage::
+
+    python -m benchmarks.bench_context --files 200 --refs 1000
+"""
+
+import argparse
+import os
+import random
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from app.utils.context import extract_context
+
+
+def legacy_extract_context(decoded_files: List[Dict[str, Any]], references: List[Tuple[str, int]], context_lines: int = 30) -> List[Dict[str, Any]]:
+    """The previous per-reference linear scan, kept for comparison."""
+    snippets: List[Dict[str, Any]] = []
+    for ref_filename, line_no in references:
+        for file in decoded_files:
+            file_basename = os.path.basename(file.get('filename', ''))
+            if file_basename == ref_filename or file.get('filename') == ref_filename:
+                content = file.get('content', '')
+                if not content:
+                    break
+                lines = content.splitlines()
+                start_idx = max(0, line_no - context_lines - 1)
+                end_idx = min(len(lines), line_no + context_lines)
+                snippets.append({
+                    'filename': file['filename'],
+                    'start': start_idx + 1,
+                    'end': end_idx,
+                    'snippet': "\n".join(lines[start_idx:end_idx]),
+                })
+                break
+    return snippets
+
+
+def make_request(n_files: int, n_refs: int, lines_per_file: int = 400, seed: int = 0) -> Tuple[List[Dict[str, Any]], List[Tuple[str, int]]]:
+    """Return synthetic ``(decoded_files, references)``."""
+    rng = random.Random(seed)
+    files = [
+        {
+            'filename': f'pkg/mod{i}.py',
+            'content': "\n".join(f'    value_{i}_{j} = compute({j})' for j in range(lines_per_file)),
+        }
+        for i in range(n_files)
+    ]
+    # Frames cluster in a handful of files, like a recursive call chain
+    hot = [f'mod{i}.py' for i in rng.sample(range(n_files), min(10, n_files))]
+    refs = [(rng.choice(hot), rng.randint(1, lines_per_file)) for _ in range(n_refs)]
+    return files, refs
+
+
+def timed(fn: Callable[[], List[Dict[str, Any]]], repeat: int) -> Tuple[float, List[Dict[str, Any]]]:
+    best = float('inf')
+    result: List[Dict[str, Any]] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=200, help='decoded files in the request')
+    parser.add_argument('--refs', type=int, default=1000, help='error log references')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per implementation; best is reported')
+    args = parser.parse_args()
+
+    files, refs = make_request(args.files, args.refs)
+    legacy_s, legacy = timed(lambda: legacy_extract_context(files, refs), args.repeat)
+    indexed_s, indexed = timed(lambda: extract_context(files, refs), args.repeat)
+
+    def chars(snippets: List[Dict[str, Any]]) -> int:
+        return sum(len(s['snippet']) for s in snippets)
+
+    print(f'legacy : {legacy_s * 1000:8.1f} ms  {len(legacy):5d} snippets  {chars(legacy):9d} chars')
+    print(f'indexed: {indexed_s * 1000:8.1f} ms  {len(indexed):5d} snippets  {chars(indexed):9d} chars')
+    print(f'speedup: {legacy_s / indexed_s:.1f}x')
+
+
+if __name__ == '__main__':
+    main_cli()
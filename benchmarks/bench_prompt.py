@@ -0,0 +1,65 @@
+"""
+Throughput benchmark for `prompt_builder.build_prompt`.
+
+Compares the current builder, which renders the system instructions and
+few-shot exemplars once per exemplar-file version, with the previous one,
+which re-read and re-parsed ``prompt_builder.examples.json`` and rebuilt the
+same prefix on every call.
+
+Usage::
+
+    python -m benchmarks.bench_prompt --calls 20000
+"""
+
+import argparse
+import json
+import time
+from typing import Callable, Iterable
+
+from app import prompt_builder
+
+SNIPPETS = [f"From mod{i}.py (lines 1-40):\n" + "\n".join(f"x{j} = {j}" for j in range(40)) for i in range(5)]
+CONTEXT = ["Context from app.py (lines 1-61):\n" + "\n".join(f"y{j} = {j}" for j in range(61))]
+ERROR_LOG = 'Traceback (most recent call last):\n  File "app.py", line 31, in <module>\nValueError: boom'
+
+
+def legacy_build_prompt(error_log: str, summary: str, retrieved_snippets: Iterable[str] = (), context_snippets: Iterable[str] = ()) -> str:
+    """The previous builder, which loaded the exemplar file on every call."""
+    parts = [prompt_builder.SYSTEM_INSTR]
+    path = prompt_builder._EXEMPLAR_PATH
+    examples = json.loads(path.read_text(encoding="utf-8")) if path.exists() else []
+    if examples:
+        parts.append("Few-shot examples:\n" + "\n\n".join(ex["example"] for ex in examples))
+    if retrieved_snippets:
+        parts.append("Relevant retrieved snippets:\n" + "\n\n".join(retrieved_snippets))
+    if context_snippets:
+        parts.append("Relevant code context:\n" + "\n\n".join(context_snippets))
+    parts.append(f"Error log:\n{error_log}")
+    parts.append(f"Summary of changes:\n{summary}")
+    return "\n\n".join(parts)
+
+
+def throughput(build: Callable[..., str], calls: int) -> float:
+    start = time.perf_counter()
+    for _ in range(calls):
+        build(ERROR_LOG, "benchmark", SNIPPETS, CONTEXT)
+    return calls / (time.perf_counter() - start)
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=20000, help='prompts to build per implementation')
+    args = parser.parse_args()
+
+    assert legacy_build_prompt(ERROR_LOG, "benchmark", SNIPPETS, CONTEXT) == prompt_builder.build_prompt(
+        ERROR_LOG, "benchmark", SNIPPETS, CONTEXT
+    )
+    legacy = throughput(legacy_build_prompt, args.calls)
+    cached = throughput(prompt_builder.build_prompt, args.calls)
+    print(f'legacy: {legacy:10.0f} prompts/s')
+    print(f'cached: {cached:10.0f} prompts/s')
+    print(f'speedup: {cached / legacy:.1f}x')
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,96 @@
+"""
+Deterministic synthetic payloads for the benchmark suite.
+
+Everything is generated from a seed, so runs on different machines (and
+before and after a change) measure identical inputs without shipping
+fixtures. Repositories are Python modules of classes and functions with
+realistic identifiers; logs are Python tracebacks whose frames point into
+those modules, optionally padded with unrelated test output up to a target
+size.
+"""
+
+import base64
+import gzip
+import random
+from types import SimpleNamespace
+from typing import Dict, List, Tuple
+
+# (files, functions per file, statements per function) for each repo size
+REPO_SIZES: Dict[str, Tuple[int, int, int]] = {
+    'small': (5, 8, 6),
+    'typical': (60, 20, 8),
+    'huge': (400, 30, 10),
+}
+
+# Frames per traceback for each frame profile
+FRAME_COUNTS: Dict[str, int] = {
+    'few': 4,
+    'many': 1000,
+}
+
+# Approximate log size in bytes for each log profile
+LOG_SIZES: Dict[str, int] = {
+    'short': 2_000,
+    '10mb': 10 * 1024 * 1024,
+}
+
+_WORDS = (
+    'user account order invoice payment session token cache config request response handler '
+    'client server record batch queue worker parser schema model field value index item'
+).split()
+
+
+def _name(rng: random.Random, parts: int = 2) -> str:
+    return '_'.join(rng.choice(_WORDS) for _ in range(parts))
+
+
+def make_repo(size: str, seed: int = 0) -> List[Dict[str, str]]:
+    """Return decoded files (``{'filename', 'content'}``) for a repo of `size`."""
+    n_files, n_funcs, n_stmts = REPO_SIZES[size]
+    rng = random.Random(seed)
+    files = []
+    for i in range(n_files):
+        lines = [f'"""Module {i} of the synthetic {size} repository."""', 'import os', '']
+        lines.append(f'class {_name(rng).title().replace("_", "")}Service:')
+        for j in range(n_funcs):
+            lines.append(f'    def {_name(rng)}_{j}(self, {_name(rng, 1)}, {_name(rng, 1)}=None):')
+            for _ in range(n_stmts):
+                lines.append(f'        {_name(rng)} = self.{_name(rng)}({_name(rng, 1)}) + {rng.randint(0, 999)}')
+            lines.append(f'        return {_name(rng)}')
+            lines.append('')
+        files.append({'filename': f'src/pkg{i % 10}/module_{i}.py', 'content': '\n'.join(lines) + '\n'})
+    return files
+
+
+def encode_files(files: List[Dict[str, str]]) -> List[SimpleNamespace]:
+    """Return `files` as upload payloads (``filename`` and base64-gzip ``content`` attributes)."""
+    return [
+        SimpleNamespace(
+            filename=f['filename'],
+            content=base64.b64encode(gzip.compress(f['content'].encode('utf-8'))).decode('ascii'),
+        )
+        for f in files
+    ]
+
+
+def make_log(files: List[Dict[str, str]], frames: str = 'few', size: str = 'short', seed: int = 0) -> str:
+    """Return a traceback with `frames` frames into `files`, padded to about `size` bytes."""
+    rng = random.Random(seed)
+    n_frames = FRAME_COUNTS[frames]
+    target = LOG_SIZES[size]
+    trace = ['Traceback (most recent call last):']
+    for _ in range(n_frames):
+        f = rng.choice(files)
+        n_lines = f['content'].count('\n')
+        trace.append(f'  File "/home/ci/work/{f["filename"]}", line {rng.randint(1, n_lines)}, in {_name(rng)}')
+        trace.append(f'    {_name(rng)} = self.{_name(rng)}({_name(rng, 1)})')
+    trace.append(f"KeyError: '{_name(rng)}' at 0x{rng.getrandbits(48):x}")
+    tail = '\n'.join(trace) + '\n'
+    # Unrelated test output before the traceback, as in a long CI log
+    padding: List[str] = []
+    remaining = target - len(tail)
+    while remaining > 0:
+        line = f'tests/test_{_name(rng)}.py::test_{_name(rng)}[{rng.randint(0, 99)}] PASSED {rng.random():.4f}s'
+        padding.append(line)
+        remaining -= len(line) + 1
+    return '\n'.join(padding) + ('\n' if padding else '') + tail
@@ -0,0 +1,344 @@
+"""
+End-to-end load generator for the diagnosis API.
+
+Replays diagnosis payloads against a running backend at a target request
+rate and reports throughput, a latency histogram with percentiles, and a
+breakdown of errors. Arrivals are open-loop: each request is scheduled in
+advance and its latency is measured from its scheduled start, so a backend
+that falls behind shows up as growing latency instead of a quietly reduced
+rate (no coordinated omission).
+
+Payloads come from a JSONL corpus (one ``/diagnose`` request body per line,
+for example captured traffic) or, by default, from the synthetic generators
+in `benchmarks.generators`. Each request's summary gets a unique suffix so
+the response cache does not short-circuit the upstream call; pass
+``--no-unique`` to measure cache hits instead.
+
+Without ``--url`` the tool starts a local stub upstream (see
+`benchmarks.stub_upstream`, whose latency distribution, token rate and error
+rate are configurable here) and a backend process pointed at it, with
+fingerprint reuse disabled and metrics written to a temporary database.
+Upstream failures do not surface as HTTP errors (the backend answers with a
+simulated diagnosis instead), so when the backend exposes ``/metrics`` the
+report also counts those fallbacks by reason.
+
+Usage::
+
+    python -m benchmarks.loadgen --rate 50 --duration 30
+    python -m benchmarks.loadgen --rate 20 --requests 500 --latency 0.8 --latency-sigma 0.6 \\
+        --tokens-per-second 60 --completion-tokens 400 --error-rate 0.02 --json load.json
+    python -m benchmarks.loadgen --url http://127.0.0.1:8000 --corpus captured.jsonl --rate 10 --stream
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Any, Dict, Iterator, List, Optional
+
+import httpx
+
+from app.utils.telemetry import LATENCY_BUCKETS
+from benchmarks.generators import encode_files, make_log, make_repo
+from benchmarks.stub_upstream import StubServer, free_port
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_corpus(path: str) -> List[Dict[str, Any]]:
+    """Return the request bodies in a JSONL file, skipping lines without an error log."""
+    payloads = []
+    with open(path, encoding='utf-8') as fh:
+        for line in fh:
+            line = line.strip()
+            if not line:
+                continue
+            body = json.loads(line)
+            if isinstance(body, dict) and body.get('error_log'):
+                payloads.append(body)
+    if not payloads:
+        raise SystemExit(f'{path}: no request bodies with an error_log')
+    return payloads
+
+
+def synthetic_corpus(n: int = 20, size: str = 'small', seed: int = 0) -> List[Dict[str, Any]]:
+    """Return `n` distinct synthetic request bodies over one generated repository."""
+    files = make_repo(size, seed=seed)
+    uploads = [{'filename': f.filename, 'content': f.content} for f in encode_files(files)]
+    return [
+        {
+            'files': uploads,
+            'error_log': make_log(files, frames='few', seed=seed + i),
+            'summary': 'Synthetic load-generation request.',
+        }
+        for i in range(n)
+    ]
+
+
+def schedule(rate: float, count: int, arrival: str, seed: int = 0) -> Iterator[float]:
+    """Yield `count` start offsets in seconds for a mean of `rate` requests per second."""
+    rng = random.Random(seed)
+    offset = 0.0
+    for _ in range(count):
+        yield offset
+        offset += rng.expovariate(rate) if arrival == 'poisson' else 1.0 / rate
+
+
+class Backend:
+    """Run the API in a child process, pointed at `upstream`, for the duration of a block."""
+
+    def __init__(self, upstream: str) -> None:
+        self.upstream = upstream
+        self.port = free_port()
+        self._process: Optional[subprocess.Popen] = None
+        self._tmpdir = tempfile.TemporaryDirectory()
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.port}'
+
+    def __enter__(self) -> 'Backend':
+        env = dict(
+            os.environ,
+            OPENAI_API_BASE=self.upstream,
+            OPENAI_API_KEY='sk-loadgen',
+            FINGERPRINT_CACHE='0',
+            ENABLE_METRICS='1',
+            METRICS_DB=os.path.join(self._tmpdir.name, 'metrics.db'),
+        )
+        self._process = subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', 'app.main:app', '--port', str(self.port),
+             '--log-level', 'warning', '--backlog', '4096'],
+            cwd=ROOT,
+            env=env,
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(('127.0.0.1', self.port), timeout=0.5).close()
+                return self
+            except OSError:
+                if self._process.poll() is not None:
+                    raise RuntimeError('backend exited during startup')
+                time.sleep(0.05)
+        self.__exit__()
+        raise RuntimeError('backend did not start within 30 s')
+
+    def __exit__(self, *exc_info: Any) -> None:
+        if self._process is not None:
+            self._process.terminate()
+            self._process.wait()
+            self._process = None
+        self._tmpdir.cleanup()
+
+
+def fallback_counts(url: str) -> Dict[str, float]:
+    """Return the backend's simulated-fallback counters by reason, or {} without `/metrics`."""
+    try:
+        response = httpx.get(f'{url}/metrics', timeout=10)
+    except httpx.HTTPError:
+        return {}
+    if response.status_code != 200:
+        return {}
+    counts = {}
+    prefix = 'diagnose_fallbacks_total{reason="'
+    for line in response.text.splitlines():
+        if line.startswith(prefix):
+            labels, _, value = line.rpartition(' ')
+            counts[labels[len(prefix):-2]] = float(value)
+    return counts
+
+
+async def run_load(
+    url: str,
+    payloads: List[Dict[str, Any]],
+    rate: float,
+    count: int,
+    arrival: str = 'poisson',
+    concurrency: int = 256,
+    stream: bool = False,
+    unique: bool = True,
+    timeout: float = 120.0,
+) -> Dict[str, Any]:
+    """Send `count` requests at `rate` per second and return the raw samples.
+
+    Parameters:
+      url: Backend base URL.
+      payloads: Request bodies, used round-robin.
+      rate: Target mean arrival rate in requests per second.
+      count: Number of requests to send.
+      arrival: 'poisson' for exponential gaps or 'uniform' for fixed gaps.
+      concurrency: Maximum requests in flight; later arrivals queue and the
+        wait counts towards their latency.
+      stream: Use ``/diagnose/stream`` and also record time to first byte.
+      unique: Make every prompt distinct so the response cache misses.
+      timeout: Per-request timeout in seconds.
+    """
+    path = '/diagnose/stream' if stream else '/diagnose'
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    first_bytes: List[float] = []
+    errors: Counter = Counter()
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits) as client:
+        async def one(i: int, scheduled: float) -> None:
+            body = dict(payloads[i % len(payloads)])
+            if unique:
+                body['summary'] = f"{body.get('summary', '')} [load {i}]"
+            async with semaphore:
+                try:
+                    async with client.stream('POST', path, json=body) as response:
+                        first = None
+                        async for _ in response.aiter_bytes():
+                            if first is None:
+                                first = time.perf_counter() - scheduled
+                        if response.status_code != 200:
+                            errors[f'HTTP {response.status_code}'] += 1
+                            return
+                except httpx.HTTPError as exc:
+                    errors[type(exc).__name__] += 1
+                    return
+            latencies.append(time.perf_counter() - scheduled)
+            if stream and first is not None:
+                first_bytes.append(first)
+
+        start = time.perf_counter()
+        tasks = []
+        for i, offset in enumerate(schedule(rate, count, arrival)):
+            delay = start + offset - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(one(i, start + offset)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+
+    return {'elapsed': elapsed, 'latencies': latencies, 'first_bytes': first_bytes, 'errors': errors}
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Return the `q`-th percentile (0-100) of `values` by nearest rank."""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarise(samples: Dict[str, Any], rate: float, count: int) -> Dict[str, Any]:
+    """Turn raw samples from `run_load` into the report."""
+    latencies = samples['latencies']
+    report: Dict[str, Any] = {
+        'target_rate': rate,
+        'requests': count,
+        'ok': len(latencies),
+        'errors': dict(samples['errors']),
+        'elapsed_s': round(samples['elapsed'], 3),
+        'throughput_rps': round(len(latencies) / samples['elapsed'], 2) if samples['elapsed'] else 0.0,
+    }
+    if latencies:
+        report['latency_ms'] = {
+            'mean': round(statistics.mean(latencies) * 1000, 2),
+            **{f'p{q}': round(percentile(latencies, q) * 1000, 2) for q in (50, 90, 95, 99)},
+            'max': round(max(latencies) * 1000, 2),
+        }
+        bounds = list(LATENCY_BUCKETS) + [float('inf')]
+        counts = [0] * len(bounds)
+        for value in latencies:
+            counts[next(i for i, bound in enumerate(bounds) if value <= bound)] += 1
+        report['histogram'] = [
+            {'le': 'inf' if bound == float('inf') else bound, 'count': n} for bound, n in zip(bounds, counts)
+        ]
+    fallbacks = {
+        reason: int(n - samples.get('fallbacks_before', {}).get(reason, 0))
+        for reason, n in samples.get('fallbacks_after', {}).items()
+    }
+    if any(fallbacks.values()):
+        report['fallbacks'] = {reason: n for reason, n in fallbacks.items() if n}
+    if samples['first_bytes']:
+        report['first_byte_ms'] = {
+            f'p{q}': round(percentile(samples['first_bytes'], q) * 1000, 2) for q in (50, 90, 99)
+        }
+    return report
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"{report['requests']} requests at {report['target_rate']:g}/s target: "
+          f"{report['ok']} ok in {report['elapsed_s']:.1f} s, {report['throughput_rps']:.1f} req/s")
+    if 'latency_ms' in report:
+        print('latency ms  ' + '  '.join(f'{k} {v:.1f}' for k, v in report['latency_ms'].items()))
+    if 'first_byte_ms' in report:
+        print('first byte  ' + '  '.join(f'{k} {v:.1f}' for k, v in report['first_byte_ms'].items()))
+    if report.get('histogram'):
+        peak = max(bucket['count'] for bucket in report['histogram'])
+        for bucket in report['histogram']:
+            if bucket['count']:
+                label = '+Inf' if bucket['le'] == 'inf' else f"{bucket['le'] * 1000:g} ms"
+                bar = '#' * max(1, round(40 * bucket['count'] / peak))
+                print(f'  <= {label:>9}  {bucket["count"]:6d}  {bar}')
+    if report.get('fallbacks'):
+        print('fallbacks   ' + '  '.join(f'{k}: {v}' for k, v in sorted(report['fallbacks'].items())))
+    if report['errors']:
+        print('errors      ' + '  '.join(f'{k}: {v}' for k, v in sorted(report['errors'].items())))
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='backend base URL; omitted, a backend and stub upstream are started')
+    parser.add_argument('--corpus', help='JSONL file of /diagnose request bodies; default is synthetic')
+    parser.add_argument('--repo-size', default='small', choices=('small', 'typical', 'huge'),
+                        help='synthetic repository size')
+    parser.add_argument('--rate', type=float, default=10.0, help='target requests per second')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds of arrivals (ignored with --requests)')
+    parser.add_argument('--requests', type=int, help='total requests to send')
+    parser.add_argument('--arrival', default='poisson', choices=('poisson', 'uniform'), help='arrival process')
+    parser.add_argument('--concurrency', type=int, default=256, help='maximum requests in flight')
+    parser.add_argument('--stream', action='store_true', help='use /diagnose/stream')
+    parser.add_argument('--no-unique', dest='unique', action='store_false', help='allow response cache hits')
+    parser.add_argument('--json', help='also write the report as JSON to this file')
+    stub = parser.add_argument_group('stub upstream (without --url)')
+    stub.add_argument('--latency', type=float, default=0.5, help='median upstream latency in seconds')
+    stub.add_argument('--latency-sigma', type=float, default=0.0, help='log-normal shape of the latency')
+    stub.add_argument('--tokens-per-second', type=float, default=0.0, help='upstream generation rate')
+    stub.add_argument('--completion-tokens', type=int, default=0, help='pad upstream answers to this many tokens')
+    stub.add_argument('--error-rate', type=float, default=0.0, help='fraction of upstream calls that fail')
+    args = parser.parse_args()
+
+    payloads = load_corpus(args.corpus) if args.corpus else synthetic_corpus(size=args.repo_size)
+    count = args.requests or max(1, int(args.rate * args.duration))
+
+    def load(url: str) -> Dict[str, Any]:
+        before = fallback_counts(url)
+        samples = asyncio.run(run_load(
+            url, payloads, args.rate, count, args.arrival, args.concurrency, args.stream, args.unique))
+        samples['fallbacks_before'], samples['fallbacks_after'] = before, fallback_counts(url)
+        return samples
+
+    if args.url:
+        samples = load(args.url)
+    else:
+        options = dict(
+            latency_sigma=args.latency_sigma,
+            tokens_per_second=args.tokens_per_second,
+            completion_tokens=args.completion_tokens,
+            error_rate=args.error_rate,
+        )
+        with StubServer(latency=args.latency, **options) as upstream, Backend(upstream.base_url) as backend:
+            samples = load(backend.url)
+
+    report = summarise(samples, args.rate, count)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as fh:
+            json.dump(report, fh, indent=2)
+
+
+if __name__ == '__main__':
+    main_cli()
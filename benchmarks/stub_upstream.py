@@ -0,0 +1,271 @@
+"""
+Local stand-in for the OpenAI chat completions API.
+
+The stub answers ``POST /v1/chat/completions`` with a fixed, schema-valid
+diagnosis after an artificial delay, which lets benchmarks exercise the real
+HTTP path of the backend without network access or an API key. Requests with
+``"stream": true`` get the same diagnosis as server-sent ``chat.completion.chunk``
+events. Point the backend at it with
+``OPENAI_API_BASE=http://127.0.0.1:<port>/v1``.
+
+The behaviour is configurable (see `StubConfig`):
+
+* latency: fixed, or log-normally distributed around a median
+  (``--latency-sigma``), which gives the long tail real APIs have;
+* token rate: with ``--tokens-per-second`` the latency is the time to the
+  first token and the rest of the answer is generated at that rate
+  (``--completion-tokens`` pads the answer to a realistic length); without
+  it, streamed chunks are spread evenly over the latency;
+* errors: ``--error-rate`` of requests fail with one of ``--error-status``.
+
+Run standalone with::
+
+    python -m benchmarks.stub_upstream --port 9100 --latency 0.5
+    python -m benchmarks.stub_upstream --latency 0.8 --latency-sigma 0.5 \\
+        --tokens-per-second 60 --completion-tokens 400 --error-rate 0.02
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field, fields
+from typing import List, Optional, Tuple
+
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, StreamingResponse
+
+STUB_DIAGNOSIS = {
+    'root_cause': 'Stub upstream diagnosis.',
+    'confidence': 0.9,
+    'patches': [
+        '--- a/app.py\n+++ b/app.py\n@@\n-value = compute()\n+value = compute() or 0\n',
+    ],
+    'follow_up': None,
+    'agent_block': 'Returned by the local stub upstream.',
+}
+
+
+# Characters of content per streamed chunk, roughly two tokens
+STREAM_CHUNK_CHARS = 8
+# Rough characters per token, for pacing and padding
+CHARS_PER_TOKEN = 4
+
+
+@dataclass
+class StubConfig:
+    """Behaviour of the stub upstream.
+
+    Attributes:
+      latency: Median seconds before the response (or its first token).
+      latency_sigma: Shape of the log-normal latency distribution; 0 makes
+        every response take exactly `latency`.
+      tokens_per_second: Generation rate after the first token; 0 folds
+        generation into `latency`.
+      completion_tokens: Pad the answer to about this many tokens; 0 keeps
+        the bare diagnosis.
+      error_rate: Fraction of requests answered with an error.
+      error_status: Status codes errors are drawn from.
+      seed: Seed for latency and error draws; None for a random seed.
+    """
+
+    latency: float = 0.5
+    latency_sigma: float = 0.0
+    tokens_per_second: float = 0.0
+    completion_tokens: int = 0
+    error_rate: float = 0.0
+    error_status: Tuple[int, ...] = (503,)
+    seed: Optional[int] = None
+    _rng: random.Random = field(default_factory=random.Random, init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        self._rng.seed(self.seed)
+
+    def sample_latency(self) -> float:
+        if self.latency_sigma <= 0 or self.latency <= 0:
+            return self.latency
+        return self._rng.lognormvariate(0.0, self.latency_sigma) * self.latency
+
+    def sample_error(self) -> Optional[int]:
+        if self.error_rate > 0 and self._rng.random() < self.error_rate:
+            return self._rng.choice(self.error_status)
+        return None
+
+    def content(self) -> str:
+        diagnosis = dict(STUB_DIAGNOSIS)
+        missing = self.completion_tokens * CHARS_PER_TOKEN - len(json.dumps(diagnosis))
+        if missing > 0:
+            words = ('generated ' * (missing // 10 + 1))[:missing]
+            diagnosis['agent_block'] = f"{diagnosis['agent_block']} {words}".rstrip()
+        return json.dumps(diagnosis)
+
+    def cli_args(self) -> List[str]:
+        """Return the command-line flags that reproduce this configuration."""
+        args = []
+        for item in fields(self):
+            value = getattr(self, item.name)
+            if not item.init or value is None:
+                continue
+            if isinstance(value, tuple):
+                value = ','.join(str(v) for v in value)
+            args += [f'--{item.name.replace("_", "-")}', str(value)]
+        return args
+
+
+def stream_chunks(
+    content: str,
+    model: Optional[str],
+    latency: float,
+    chunk_chars: int = STREAM_CHUNK_CHARS,
+    tokens_per_second: float = 0.0,
+):
+    """Yield `content` as OpenAI-style SSE chunks.
+
+    Without a token rate the chunks are spread evenly over `latency` seconds;
+    with one, the first chunk follows `latency` and the rest are paced at
+    `tokens_per_second`.
+    """
+    pieces = [content[i:i + chunk_chars] for i in range(0, len(content), chunk_chars)]
+    if tokens_per_second > 0:
+        delays = [latency] + [chunk_chars / CHARS_PER_TOKEN / tokens_per_second] * (len(pieces) - 1)
+    else:
+        delays = [latency / max(len(pieces), 1)] * len(pieces)
+
+    async def generate():
+        for piece, delay in zip(pieces, delays):
+            await asyncio.sleep(delay)
+            chunk = {
+                'id': 'stub',
+                'object': 'chat.completion.chunk',
+                'model': model,
+                'choices': [{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}],
+            }
+            yield f'data: {json.dumps(chunk)}\n\n'
+        yield 'data: [DONE]\n\n'
+
+    return generate()
+
+
+def create_app(latency: float = 0.5, **options) -> FastAPI:
+    """Return an ASGI app that answers completions after about `latency` seconds.
+
+    Parameters:
+      latency: Median response latency in seconds.
+      options: Further `StubConfig` fields.
+    """
+    config = StubConfig(latency=latency, **options)
+    content = config.content()
+    stub = FastAPI()
+
+    @stub.post('/v1/chat/completions')
+    async def completions(body: dict):
+        delay = config.sample_latency()
+        status = config.sample_error()
+        if status is not None:
+            await asyncio.sleep(delay)
+            return JSONResponse(
+                {'error': {'message': 'Stub upstream error', 'type': 'server_error', 'code': status}},
+                status_code=status,
+            )
+        if body.get('stream'):
+            return StreamingResponse(
+                stream_chunks(content, body.get('model'), delay, tokens_per_second=config.tokens_per_second),
+                media_type='text/event-stream',
+            )
+        if config.tokens_per_second > 0:
+            delay += len(content) / CHARS_PER_TOKEN / config.tokens_per_second
+        await asyncio.sleep(delay)
+        return {
+            'id': 'stub',
+            'object': 'chat.completion',
+            'model': body.get('model'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': 'stop',
+            }],
+        }
+
+    return stub
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class StubServer:
+    """Run the stub upstream in a child process for the duration of a block.
+
+    A separate process keeps the stub's event loop from competing with the
+    code under test for the GIL.
+    """
+
+    def __init__(self, latency: float = 0.5, port: Optional[int] = None, **options) -> None:
+        self.config = StubConfig(latency=latency, **options)
+        self.port = port or free_port()
+        self._process: Optional[subprocess.Popen] = None
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self.port}/v1'
+
+    def __enter__(self) -> 'StubServer':
+        self._process = subprocess.Popen(
+            [sys.executable, '-m', 'benchmarks.stub_upstream', '--port', str(self.port), *self.config.cli_args()],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(('127.0.0.1', self.port), timeout=0.5).close()
+                return self
+            except OSError:
+                if self._process.poll() is not None:
+                    raise RuntimeError('stub upstream exited during startup')
+                time.sleep(0.05)
+        self.__exit__()
+        raise RuntimeError('stub upstream did not start within 30 s')
+
+    def __exit__(self, *exc_info) -> None:
+        if self._process is not None:
+            self._process.terminate()
+            self._process.wait()
+            self._process = None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--latency', type=float, default=0.5, help='median seconds before each response')
+    parser.add_argument('--latency-sigma', type=float, default=0.0,
+                        help='log-normal shape of the latency; 0 for a fixed latency')
+    parser.add_argument('--tokens-per-second', type=float, default=0.0,
+                        help='generation rate after the first token; 0 to fold it into the latency')
+    parser.add_argument('--completion-tokens', type=int, default=0, help='pad answers to about this many tokens')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests that fail')
+    parser.add_argument('--error-status', default='503', help='comma-separated status codes for failures')
+    parser.add_argument('--seed', type=int, default=None, help='seed for latency and error draws')
+    args = parser.parse_args()
+    app = create_app(
+        args.latency,
+        latency_sigma=args.latency_sigma,
+        tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens,
+        error_rate=args.error_rate,
+        error_status=tuple(int(code) for code in args.error_status.split(',')),
+        seed=args.seed,
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning', backlog=4096, timeout_keep_alive=75)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+"""
+Per-stage microbenchmark suite for the diagnosis pipeline.
+
+Times each backend stage in isolation on deterministic synthetic inputs
+(see `benchmarks.generators`): small, typical and huge repositories, short
+and 10 MB error logs, and tracebacks with few or many frames. Every case
+runs a warm-up and then `--repeat` timed runs; the minimum and median are
+reported.
+
+Results are written as JSON. With `--baseline`, the median of every case is
+compared against the stored run and the command exits with status 1 when
+any case is slower by more than `--threshold` (a ratio, 0.2 = 20%). Cases
+missing from either side are reported but never fail the comparison.
+Baselines are machine-specific, so record one on the machine that compares
+against it. Everything runs offline; no model calls are made.
+
+Usage::
+
+    python -m benchmarks.suite --output bench.json --save-baseline baseline.json
+    python -m benchmarks.suite --baseline baseline.json --threshold 0.2
+    python -m benchmarks.suite --quick --only decode_files --only parse_error_log
+"""
+
+import argparse
+import atexit
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app import prompt_builder
+from app.utils import metrics
+from app.utils.context import ContextIndex, extract_context, parse_error_log
+from app.utils.decoding import decode_files
+from app.utils.import_graph import ImportGraph, SummaryCache, select_context
+from app.utils.tokens import prompt_budget
+from app.utils.vector_store import TermVectorCache, VectorStore
+from benchmarks.generators import encode_files, make_log, make_repo
+
+# A case is (name, setup); setup prepares inputs untimed and returns the
+# callable that is timed
+Case = Tuple[str, Callable[[], Callable[[], Any]]]
+
+DEFAULT_THRESHOLD = 0.2
+
+
+def _decode_case(size: str) -> Callable[[], Callable[[], Any]]:
+    def setup() -> Callable[[], Any]:
+        payload = encode_files(make_repo(size))
+        return lambda: decode_files(payload)
+    return setup
+
+
+def _parse_case(log_size: str, frames: str) -> Callable[[], Callable[[], Any]]:
+    def setup() -> Callable[[], Any]:
+        log = make_log(make_repo('typical'), frames=frames, size=log_size)
+        return lambda: parse_error_log(log)
+    return setup
+
+
+def _extract_case(size: str, frames: str) -> Callable[[], Callable[[], Any]]:
+    def setup() -> Callable[[], Any]:
+        files = make_repo(size)
+        refs = parse_error_log(make_log(files, frames=frames))
+        # Includes building the index, as index_files does once per request
+        return lambda: extract_context(files, refs, index=ContextIndex(files))
+    return setup
+
+
+def _select_case(size: str, frames: str) -> Callable[[], Callable[[], Any]]:
+    def setup() -> Callable[[], Any]:
+        files = make_repo(size)
+        refs = parse_error_log(make_log(files, frames=frames))
+        cache = SummaryCache()
+        ImportGraph(files, cache)  # summaries are cached by content across requests
+        return lambda: select_context(files, refs, index=ContextIndex(files), graph=ImportGraph(files, cache))
+    return setup
+
+
+def _embed_case(size: str) -> Callable[[], Callable[[], Any]]:
+    def setup() -> Callable[[], Any]:
+        files = make_repo(size)
+
+        def run() -> None:
+            # A fresh term cache per run so every run embeds from scratch
+            VectorStore(term_cache=TermVectorCache()).embed(files)
+        return run
+    return setup
+
+
+def _query_case(size: str) -> Callable[[], Callable[[], Any]]:
+    def setup() -> Callable[[], Any]:
+        files = make_repo(size)
+        store = VectorStore(term_cache=TermVectorCache())
+        store.embed(files)
+        query = make_log(files, frames='few')
+        return lambda: store.query_snippets(query, k=5)
+    return setup
+
+
+def _prompt_case(log_size: str, trimmed: bool) -> Callable[[], Callable[[], Any]]:
+    def setup() -> Callable[[], Any]:
+        files = make_repo('typical')
+        log = make_log(files, frames='many', size=log_size)
+        refs = parse_error_log(log)
+        context = [s['snippet'] for s in extract_context(files, refs)]
+        retrieved = [f['content'][:2000] for f in files[:5]]
+        summary = 'Refactored the session handling and renamed the payment client.'
+        prompt_builder._refresh()  # load exemplars outside the timed region
+        if trimmed:
+            budget = prompt_budget('gpt-4o-mini')
+            return lambda: prompt_builder.assemble_prompt(log, summary, retrieved, context, max_tokens=budget)
+        return lambda: prompt_builder.build_prompt(log, summary, retrieved, context)
+    return setup
+
+
+def _metrics_db() -> str:
+    handle, path = tempfile.mkstemp(suffix='.db', prefix='bench-metrics-')
+    os.close(handle)
+    for suffix in ('', '-wal', '-shm'):
+        atexit.register(lambda p=path + suffix: os.path.exists(p) and os.remove(p))
+    metrics.init_db(path)
+    return path
+
+
+def _log_call_case() -> Callable[[], Any]:
+    path = _metrics_db()
+    return lambda: metrics.log_call(1200, 900, 150, 1050, 0.8, db_path=path, cache_status='miss')
+
+
+def _writer_case() -> Callable[[], Any]:
+    path = _metrics_db()
+    writer = metrics.MetricsWriter(db_path=path)
+
+    def run() -> None:
+        # 100 enqueued rows and one flush, amortised per request
+        for _ in range(100):
+            writer.log(1200, 900, 150, 1050, 0.8, cache_status='miss')
+        writer.flush(timeout=10)
+    return run
+
+
+CASES: List[Case] = [
+    ('decode_files/small', _decode_case('small')),
+    ('decode_files/typical', _decode_case('typical')),
+    ('decode_files/huge', _decode_case('huge')),
+    ('parse_error_log/short_few', _parse_case('short', 'few')),
+    ('parse_error_log/short_many', _parse_case('short', 'many')),
+    ('parse_error_log/10mb_many', _parse_case('10mb', 'many')),
+    ('extract_context/typical_few', _extract_case('typical', 'few')),
+    ('extract_context/huge_many', _extract_case('huge', 'many')),
+    ('select_context/typical_few', _select_case('typical', 'few')),
+    ('select_context/huge_many', _select_case('huge', 'many')),
+    ('embed_files/small', _embed_case('small')),
+    ('embed_files/typical', _embed_case('typical')),
+    ('embed_files/huge', _embed_case('huge')),
+    ('query_snippets/typical', _query_case('typical')),
+    ('query_snippets/huge', _query_case('huge')),
+    ('build_prompt/short', _prompt_case('short', trimmed=False)),
+    ('build_prompt/10mb', _prompt_case('10mb', trimmed=False)),
+    ('assemble_prompt/10mb_budgeted', _prompt_case('10mb', trimmed=True)),
+    ('log_call/sync', _log_call_case),
+    ('log_call/writer_x100', _writer_case),
+]
+
+
+def time_case(fn: Callable[[], Any], repeat: int) -> Dict[str, Any]:
+    """Run `fn` once to warm up, then `repeat` timed runs; return timings in ms."""
+    fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        'min_ms': round(min(samples), 4),
+        'median_ms': round(statistics.median(samples), 4),
+        'runs': repeat,
+    }
+
+
+def run_suite(only: Optional[List[str]] = None, repeat: int = 5) -> Dict[str, Any]:
+    """Run the selected cases and return the JSON-serialisable report.
+
+    Parameters:
+      only: Name prefixes to select (``decode_files`` or ``decode_files/huge``);
+        None runs every case.
+      repeat: Timed runs per case.
+    """
+    results: Dict[str, Any] = {}
+    for name, setup in CASES:
+        if only and not any(name == prefix or name.startswith(prefix.rstrip('/') + '/') for prefix in only):
+            continue
+        results[name] = time_case(setup(), repeat)
+        print(f'{name:32s} {results[name]["median_ms"]:10.3f} ms  (min {results[name]["min_ms"]:.3f})', flush=True)
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        },
+        'results': results,
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float = DEFAULT_THRESHOLD) -> List[str]:
+    """Return the names of cases whose median regressed by more than `threshold`.
+
+    Parameters:
+      current: Report from `run_suite`.
+      baseline: A previously saved report.
+      threshold: Allowed slowdown as a ratio of the baseline median.
+    """
+    regressions = []
+    base_results = baseline.get('results', {})
+    for name, result in current['results'].items():
+        base = base_results.get(name)
+        if base is None:
+            print(f'{name:32s} (not in baseline)')
+            continue
+        ratio = result['median_ms'] / base['median_ms'] if base['median_ms'] > 0 else 1.0
+        regressed = ratio > 1 + threshold
+        if regressed:
+            regressions.append(name)
+        print(f'{name:32s} {base["median_ms"]:10.3f} -> {result["median_ms"]:10.3f} ms  {ratio:5.2f}x'
+              f'{"  REGRESSION" if regressed else ""}')
+    return regressions
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', help='compare against this saved results file')
+    parser.add_argument('--save-baseline', help='also write the results to this baseline file')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='allowed median slowdown as a ratio (default 0.2 = 20%%)')
+    parser.add_argument('--only', action='append', help='run only cases with this name or prefix (repeatable)')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per case')
+    parser.add_argument('--quick', action='store_true', help='two timed runs per case, for smoke testing')
+    args = parser.parse_args()
+
+    report = run_suite(args.only, repeat=2 if args.quick else args.repeat)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as fh:
+                json.dump(report, fh, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as fh:
+            baseline = json.load(fh)
+        print()
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f'\n{len(regressions)} case(s) regressed by more than {args.threshold:.0%}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,69 @@
+import gzip
+import io
+import tarfile
+import unittest
+import zipfile
+
+from app.utils.archive import ArchiveReader, MalformedArchive
+from app.utils.decoding import PayloadTooLarge
+
+
+def tar_bytes(files, mode="w:gz"):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode=mode) as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+def zip_bytes(files):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in files.items():
+            archive.writestr(name, data)
+    return buf.getvalue()
+
+
+FILES = {"src/app.py": b"print('app')\n", "./src/util.py": "x = 'é'\n".encode()}
+EXPECTED = [
+    {"filename": "src/app.py", "content": "print('app')\n"},
+    {"filename": "src/util.py", "content": "x = 'é'\n"},
+]
+
+
+class TestArchiveReader(unittest.TestCase):
+    def read(self, name, data, **kwargs):
+        reader = ArchiveReader(**kwargs)
+        reader.add(name, io.BytesIO(data))
+        return reader.files
+
+    def test_archive_formats(self):
+        self.assertEqual(self.read("repo.tgz", tar_bytes(FILES)), EXPECTED)
+        self.assertEqual(self.read("repo.tar", tar_bytes(FILES, "w")), EXPECTED)
+        self.assertEqual(self.read("repo.tar.xz", tar_bytes(FILES, "w:xz")), EXPECTED)
+        self.assertEqual(self.read("repo.zip", zip_bytes(FILES)), EXPECTED)
+
+    def test_plain_and_gzipped_files(self):
+        self.assertEqual(self.read("a.py", b"a = 1\n"), [{"filename": "a.py", "content": "a = 1\n"}])
+        self.assertEqual(self.read("b.py.gz", gzip.compress(b"b = 2\n")), [{"filename": "b.py", "content": "b = 2\n"}])
+
+    def test_limits(self):
+        bomb = zip_bytes({"bomb.txt": b"\0" * (1024 * 1024)})
+        with self.assertRaises(PayloadTooLarge):
+            self.read("bomb.zip", bomb, max_file_bytes=64 * 1024)
+        with self.assertRaises(PayloadTooLarge):
+            self.read("repo.tgz", tar_bytes(FILES), max_request_bytes=16)
+        with self.assertRaises(PayloadTooLarge):
+            self.read("repo.tgz", tar_bytes(FILES), max_files=1)
+        with self.assertRaises(PayloadTooLarge):
+            self.read("big.gz", gzip.compress(b"#" * 4096), max_file_bytes=1024)
+
+    def test_malformed_archive(self):
+        with self.assertRaises(MalformedArchive):
+            self.read("broken.tgz", tar_bytes(FILES)[:40])
+
+
+if __name__ == "__main__":
+    unittest.main()
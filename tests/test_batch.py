@@ -0,0 +1,59 @@
+import asyncio
+import base64
+import gzip
+import json
+
+from fastapi.testclient import TestClient
+
+import app.main as m
+
+client = TestClient(m.app)
+
+FILES = [{"filename": "app.py", "content": base64.b64encode(gzip.compress(b"def f():\n    return 1 / 0\n")).decode()}]
+
+
+def lines(res):
+    return [json.loads(line) for line in res.text.splitlines()]
+
+
+def test_batch_decodes_once_and_returns_every_failure(monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    calls = []
+    real_decode = m.decode_files
+    monkeypatch.setattr(m, "decode_files", lambda files: calls.append(1) or real_decode(files))
+    failures = [{"id": f"test_{i}", "error_log": f"app.py:2: ZeroDivisionError {i}"} for i in range(5)]
+    res = client.post("/diagnose/batch", json={"files": FILES, "failures": failures, "summary": "ci run"})
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("application/x-ndjson")
+    results = lines(res)
+    assert len(calls) == 1
+    assert sorted((r["index"], r["id"]) for r in results) == [(i, f"test_{i}") for i in range(5)]
+    assert all(r["status"] == 200 and "root_cause" in r["result"] for r in results)
+
+
+def test_batch_bounds_concurrent_model_calls(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(m, "BATCH_CONCURRENCY", 2)
+    monkeypatch.setattr(m, "response_cache", m.ResponseCache(db_path=None))
+    in_flight = []
+    peak = []
+
+    async def fake_completion(model, prompt):
+        in_flight.append(1)
+        peak.append(len(in_flight))
+        await asyncio.sleep(0.02)
+        in_flight.pop()
+        return {"root_cause": "x", "confidence": 0.9, "patches": [], "follow_up": None, "agent_block": "ok"}
+
+    monkeypatch.setattr(m, "request_completion", fake_completion)
+    failures = [{"error_log": f"app.py:2: error {i}"} for i in range(6)]
+    results = lines(client.post("/diagnose/batch", json={"files": FILES, "failures": failures}))
+    assert len(results) == 6 and all(r["status"] == 200 for r in results)
+    assert len(peak) == 6 and max(peak) == 2
+
+
+def test_batch_rejects_too_many_failures(monkeypatch):
+    monkeypatch.setattr(m, "BATCH_MAX_FAILURES", 2)
+    failures = [{"error_log": "boom"}] * 3
+    res = client.post("/diagnose/batch", json={"files": [], "failures": failures})
+    assert res.status_code == 413
@@ -1,6 +1,6 @@
 import unittest
 
-from app.utils.context import parse_error_log, extract_context
+from app.utils.context import ContextIndex, parse_error_log, extract_context
 
 
 class TestContextExtraction(unittest.TestCase):
@@ -19,6 +19,16 @@ class TestContextExtraction(unittest.TestCase):
         self.assertIn(('helper.py', 5), refs)
         self.assertIn(('main.py', 25), refs)
 
+    def test_parse_error_log_dedupes_in_order(self):
+        frame = '  File "/srv/app/recurse.py", line 3, in f\n    return f(n - 1)\n'
+        log = 'Traceback (most recent call last):\n' + frame * 10000 + 'RecursionError\nrecurse.py:7: note\n'
+        self.assertEqual(parse_error_log(log), [('recurse.py', 3), ('recurse.py', 7)])
+
+    def test_parse_error_log_accepts_lines_and_caps(self):
+        lines = (f'mod.py:{i}: failed\n' for i in range(1, 1000))
+        refs = parse_error_log(lines, max_refs=10)
+        self.assertEqual(refs, [('mod.py', i) for i in range(1, 11)])
+
     def test_extract_context(self):
         # Create a dummy file with 100 numbered lines
         lines = [f'line {i}' for i in range(1, 101)]
@@ -37,6 +47,31 @@ class TestContextExtraction(unittest.TestCase):
         self.assertEqual(snippet_lines[0], 'line 48')
         self.assertEqual(snippet_lines[-1], 'line 52')
 
+    def test_extract_context_merges_overlapping_windows(self):
+        content = "\n".join(f'line {i}' for i in range(1, 101))
+        decoded_files = [
+            {'filename': 'other.py', 'content': 'x = 1'},
+            {'filename': 'pkg/main.py', 'content': content},
+        ]
+        refs = [('main.py', 50), ('main.py', 20), ('main.py', 53), ('pkg/main.py', 90)]
+        snippets = extract_context(decoded_files, refs, context_lines=2)
+        # 48-52 and 51-55 overlap; 18-22 and 88-92 stay separate
+        self.assertEqual(
+            [(s['filename'], s['start'], s['end']) for s in snippets],
+            [('pkg/main.py', 48, 55), ('pkg/main.py', 18, 22), ('pkg/main.py', 88, 92)],
+        )
+        self.assertEqual(snippets[0]['snippet'].splitlines()[-1], 'line 55')
+
+    def test_context_index_prefers_first_file(self):
+        decoded_files = [
+            {'filename': 'a/util.py', 'content': 'first'},
+            {'filename': 'util.py', 'content': 'second'},
+        ]
+        index = ContextIndex(decoded_files)
+        self.assertEqual(index.lookup('util.py'), 0)
+        self.assertEqual(index.lookup('a/util.py'), 0)
+        self.assertIsNone(index.lookup('missing.py'))
+
     def test_extract_context_unknown_file(self):
         decoded_files = [{'filename': 'main.py', 'content': 'print("hi")'}]
         refs = [('other.py', 1)]
@@ -0,0 +1,69 @@
+import unittest
+
+from app.utils.fingerprint import failure_key, fingerprint_failure, normalise_message
+
+
+def make_log(tmp, addr, line, ts):
+    return (
+        f"{ts} running tests in {tmp}\n"
+        "Traceback (most recent call last):\n"
+        f'  File "/usr/lib/python3.11/site-packages/pluggy/_hooks.py", line 493, in __call__\n'
+        f'  File "{tmp}/src/app/service.py", line {line}, in handle\n'
+        f'  File "{tmp}/src/app/store.py", line {line + 7}, in load\n'
+        f"KeyError: 'user' missing from <Store object at {addr}> after 3 retries\n"
+    )
+
+
+class TestFingerprint(unittest.TestCase):
+    def test_volatile_fields_do_not_change_fingerprint(self):
+        first = fingerprint_failure(make_log("/tmp/pytest-of-ci/pytest-12", "0x7f3a2c", 40, "2024-05-01T10:00:00Z"))
+        second = fingerprint_failure(make_log("/tmp/pytest-of-ci/pytest-99", "0x55d1e0", 52, "2024-06-02T11:30:12Z"))
+        self.assertEqual(first, second)
+        self.assertEqual(first.exception, "KeyError")
+        self.assertEqual(first.frames, ("service.py:handle", "store.py:load"))
+        self.assertEqual(first.template, "'user' missing from <Store object at <addr>> after <n> retries")
+
+    def test_different_failures_differ(self):
+        base = make_log("/tmp/a", "0x1", 40, "10:00:00")
+        other_type = base.replace("KeyError", "IndexError")
+        other_frame = base.replace("in load", "in save")
+        digests = {fingerprint_failure(log).digest for log in (base, other_type, other_frame)}
+        self.assertEqual(len(digests), 3)
+
+    def test_no_exception_means_no_fingerprint(self):
+        self.assertIsNone(fingerprint_failure(""))
+        self.assertIsNone(fingerprint_failure("3 tests failed, see above"))
+
+    def test_key_tracks_relevant_file_contents(self):
+        log = make_log("/tmp/a", "0x1", 40, "10:00:00")
+        files = [{"filename": "src/app/store.py", "content": "v1"}, {"filename": "README.md", "content": "a"}]
+        key = failure_key(log, files, "prompt-v1")
+        unrelated = [files[0], {"filename": "README.md", "content": "b"}]
+        changed = [{"filename": "src/app/store.py", "content": "v2"}, files[1]]
+        self.assertEqual(key, failure_key(log, unrelated, "prompt-v1"))
+        self.assertNotEqual(key, failure_key(log, changed, "prompt-v1"))
+        self.assertNotEqual(key, failure_key(log, files, "prompt-v2"))
+
+    def test_compared_values_are_kept(self):
+        log = 'Traceback (most recent call last):\n  File "/w/tests/test_api.py", line 9, in test_status\n'
+        first = fingerprint_failure(log + "AssertionError: assert 200 == 404\n")
+        second = fingerprint_failure(log + "AssertionError: assert 200 == 500\n")
+        self.assertEqual(first.template, "assert 200 == 404")
+        self.assertNotEqual(first.digest, second.digest)
+        compared = fingerprint_failure(log + "ValueError: got 3 != 4 at 0x7f00\n")
+        self.assertEqual(compared.template, "got 3 != 4 at <addr>")
+
+    def test_no_key_without_relevant_files(self):
+        log = make_log("/tmp/a", "0x1", 40, "10:00:00")
+        self.assertIsNone(failure_key(log, [], "prompt-v1"))
+        self.assertIsNone(failure_key(log, [{"filename": "README.md", "content": "a"}], "prompt-v1"))
+
+    def test_normalise_message(self):
+        self.assertEqual(
+            normalise_message("id 123e4567-e89b-12d3-a456-426614174000 test_x[case-2] at 12:01:02"),
+            "id <uuid> test_x[<param>] at <time>",
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
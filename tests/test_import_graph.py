@@ -0,0 +1,129 @@
+import unittest
+
+from app.utils.context import extract_context, parse_error_log
+from app.utils.import_graph import ImportGraph, SummaryCache, select_context
+
+LOGIN = '''"""Login."""
+
+from .user import User
+
+
+def login(username):
+    return User(username)
+'''
+
+USER = '''"""User."""
+
+import os
+
+from .login import login
+
+
+class User:
+    def __init__(self, username):
+        self.username = username
+
+
+def get_current_user():
+    return login(os.environ["USER"])
+''' + "\n".join(f"# filler {i}" for i in range(60)) + "\n"
+
+APP = '''from auth.user import get_current_user
+from helpers import fmt
+
+
+def main():
+    user = get_current_user()
+    return fmt(user)
+'''
+
+HELPERS = '''def fmt(value):
+    return str(value)
+
+
+def unused():
+    return 1
+'''
+
+FILES = [
+    {"filename": "repo/auth/login.py", "content": LOGIN},
+    {"filename": "repo/auth/user.py", "content": USER},
+    {"filename": "repo/auth/__init__.py", "content": ""},
+    {"filename": "repo/app.py", "content": APP},
+    {"filename": "repo/helpers.py", "content": HELPERS},
+    {"filename": "repo/config.toml", "content": "[user]\nname = 'x'\n"},
+]
+
+CIRCULAR_LOG = '''Traceback (most recent call last):
+  File "repo/auth/login.py", line 3, in <module>
+    from .user import User
+  File "repo/auth/user.py", line 5, in <module>
+    from .login import login
+ImportError: cannot import name 'login' from partially initialized module 'auth.login'
+'''
+
+
+class TestImportGraph(unittest.TestCase):
+    def test_resolves_imports_and_finds_cycles(self):
+        graph = ImportGraph(FILES, SummaryCache())
+        edges = {(FILES[s]["filename"], FILES[t]["filename"]) for s, e in graph.edges.items() for _, t in e}
+        self.assertIn(("repo/auth/login.py", "repo/auth/user.py"), edges)
+        self.assertIn(("repo/auth/user.py", "repo/auth/login.py"), edges)
+        self.assertIn(("repo/app.py", "repo/auth/user.py"), edges)
+        self.assertIn(("repo/app.py", "repo/helpers.py"), edges)
+        self.assertEqual(graph.cycles(), [[0, 1]])
+        self.assertEqual(graph.distances([3], 1), {3: 0, 1: 1, 4: 1})
+
+    def test_cycles_in_long_import_chains(self):
+        n = 1500
+        chain = [{"filename": f"pkg/m{i}.py", "content": f"from pkg import m{i + 1}\n"} for i in range(n - 1)]
+        chain.append({"filename": f"pkg/m{n - 1}.py", "content": "x = 1\n"})
+        self.assertEqual(ImportGraph(chain, SummaryCache()).cycles(), [])
+        # Closing the chain makes every module part of one cycle, plus a separate pair
+        chain[-1] = {"filename": f"pkg/m{n - 1}.py", "content": "from pkg import m0\n"}
+        chain += [
+            {"filename": "pkg/a.py", "content": "from pkg import b\n"},
+            {"filename": "pkg/b.py", "content": "from pkg import a\n"},
+        ]
+        self.assertEqual(ImportGraph(chain, SummaryCache()).cycles(), [list(range(n)), [n, n + 1]])
+
+    def test_circular_import_context_is_only_imports(self):
+        refs = parse_error_log(CIRCULAR_LOG)
+        snippets = select_context(FILES, refs, graph=ImportGraph(FILES, SummaryCache()))
+        self.assertEqual(
+            [(s["filename"], s["start"], s["end"]) for s in snippets],
+            # The frames' imports, then the imports of a module importing them
+            [("repo/auth/login.py", 3, 3), ("repo/auth/user.py", 3, 5), ("repo/app.py", 1, 2)],
+        )
+        windows = extract_context(FILES, refs)
+        self.assertLess(sum(len(s["snippet"]) for s in snippets), sum(len(s["snippet"]) for s in windows) / 3)
+
+    def test_frame_definition_and_used_definitions(self):
+        refs = [("app.py", 6)]
+        snippets = select_context(FILES, refs, graph=ImportGraph(FILES, SummaryCache()), max_distance=1)
+        spans = {(s["filename"], s["start"], s["end"]): s["distance"] for s in snippets}
+        # The frame's imports and enclosing function, then the functions it calls
+        self.assertEqual(spans.pop(("repo/app.py", 1, 7)), 0)
+        self.assertEqual(spans.pop(("repo/helpers.py", 1, 2)), 1)
+        self.assertEqual(spans.pop(("repo/auth/user.py", 13, 14)), 1)
+        self.assertEqual(spans, {})
+        self.assertEqual(snippets[0]["filename"], "repo/app.py")
+
+    def test_long_module_statement_is_cut_to_a_window(self):
+        table = "ROUTES = {\n" + "".join(f"    'r{i}': {i},\n" for i in range(200)) + "}\n"
+        files = [{"filename": "routes.py", "content": table}]
+        snippets = select_context(files, [("routes.py", 100)], graph=ImportGraph(files, SummaryCache()), context_lines=5)
+        self.assertEqual([(s["start"], s["end"]) for s in snippets], [(95, 105)])
+
+    def test_falls_back_to_windows(self):
+        refs = [("config.toml", 2)]
+        self.assertEqual(
+            select_context(FILES, refs, context_lines=1),
+            [dict(s, distance=0) for s in extract_context(FILES, refs, context_lines=1)],
+        )
+        broken = [{"filename": "bad.py", "content": "def broken(:\n    pass\n"}]
+        self.assertEqual(select_context(broken, [("bad.py", 1)], context_lines=1)[0]["snippet"], "def broken(:\n    pass")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import json
+import unittest
+
+from app.utils.json_stream import FIELD, ITEM, JsonObjectStream
+
+
+class TestJsonObjectStream(unittest.TestCase):
+    OBJ = {
+        "root_cause": "quote \" and , } ] inside",
+        "confidence": 0.8,
+        "patches": ["--- a/x\n+++ b/x\n", "second"],
+        "follow_up": None,
+        "meta": {"tags": [1, {"k": "v"}]},
+    }
+
+    def feed_in_chunks(self, text, size):
+        stream = JsonObjectStream()
+        events = []
+        for i in range(0, len(text), size):
+            events.extend(stream.feed(text[i:i + size]))
+        return stream, events
+
+    def test_fields_and_items_in_order_for_any_chunking(self):
+        text = "```json\n" + json.dumps(self.OBJ, indent=2) + "\n```"
+        for size in (1, 3, 7, len(text)):
+            stream, events = self.feed_in_chunks(text, size)
+            self.assertTrue(stream.done)
+            self.assertEqual(stream.result(), self.OBJ)
+            self.assertEqual(events[0], (FIELD, "root_cause", self.OBJ["root_cause"]))
+            self.assertEqual(events[2:4], [(ITEM, "patches", "--- a/x\n+++ b/x\n"), (ITEM, "patches", "second")])
+            self.assertEqual({k: v for kind, k, v in events if kind == FIELD}, self.OBJ)
+
+    def test_root_cause_reported_before_object_completes(self):
+        stream = JsonObjectStream()
+        self.assertEqual(stream.feed('{"root_cause": "boom"'), [])
+        self.assertEqual(stream.feed(', "confidence'), [(FIELD, "root_cause", "boom")])
+        self.assertFalse(stream.done)
+        with self.assertRaises(ValueError):
+            stream.result()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+
+from app.utils.llm_cache import COALESCED, HIT, MISS, ResponseCache, make_key
+
+
+class TestResponseCache(unittest.TestCase):
+    def test_key_depends_on_model_version_and_prompt(self):
+        base = make_key("gpt-4o", "v1", "prompt")
+        self.assertEqual(base, make_key("gpt-4o", "v1", "prompt"))
+        self.assertNotEqual(base, make_key("gpt-4o-mini", "v1", "prompt"))
+        self.assertNotEqual(base, make_key("gpt-4o", "v2", "prompt"))
+        self.assertNotEqual(base, make_key("gpt-4o", "v1", "prompt!"))
+
+    def test_memory_tier_is_lru_bounded(self):
+        cache = ResponseCache(max_entries=2, db_path=None)
+        cache.set("a", {"v": 1})
+        cache.set("b", {"v": 2})
+        cache.get("a")  # refresh a so b becomes least recently used
+        cache.set("c", {"v": 3})
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), {"v": 1})
+
+    def test_entries_expire(self):
+        cache = ResponseCache(ttl=0.01, db_path=None)
+        cache.set("a", {"v": 1})
+        time.sleep(0.02)
+        self.assertIsNone(cache.get("a"))
+
+    def test_sqlite_tier_survives_new_instance(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "cache.db")
+            ResponseCache(db_path=path).set("a", {"v": 1})
+            self.assertEqual(ResponseCache(db_path=path).get("a"), {"v": 1})
+
+    def test_concurrent_misses_share_one_computation(self):
+        cache = ResponseCache(db_path=None)
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {"v": 1}
+
+        async def run():
+            return await asyncio.gather(*(cache.get_or_compute("k", compute) for _ in range(5)))
+
+        results = asyncio.run(run())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(status for _, status in results), [COALESCED] * 4 + [MISS])
+        self.assertEqual(asyncio.run(cache.get_or_compute("k", compute))[1], HIT)
+        self.assertEqual(cache.stats()["hits"], 1)
+
+    def test_failures_are_shared_and_not_cached(self):
+        cache = ResponseCache(db_path=None)
+
+        async def compute():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("upstream down")
+
+        async def run():
+            return await asyncio.gather(*(cache.get_or_compute("k", compute) for _ in range(3)), return_exceptions=True)
+
+        results = asyncio.run(run())
+        self.assertTrue(all(isinstance(r, RuntimeError) for r in results))
+        self.assertIsNone(cache.get("k"))
+
+
+if __name__ == '__main__':
+    unittest.main()
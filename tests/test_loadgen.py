@@ -0,0 +1,63 @@
+import json
+
+from fastapi.testclient import TestClient
+
+from benchmarks.loadgen import percentile, schedule, summarise
+from benchmarks.stub_upstream import STUB_DIAGNOSIS, StubConfig, create_app
+
+
+def test_stub_error_rate_and_status():
+    client = TestClient(create_app(0.0, error_rate=1.0, error_status=(429,), seed=1))
+    res = client.post("/v1/chat/completions", json={"model": "gpt-4o-mini"})
+    assert res.status_code == 429
+    assert res.json()["error"]["code"] == 429
+
+
+def test_stub_pads_completion_tokens():
+    client = TestClient(create_app(0.0, completion_tokens=200))
+    res = client.post("/v1/chat/completions", json={"model": "gpt-4o-mini"})
+    content = res.json()["choices"][0]["message"]["content"]
+    diagnosis = json.loads(content)
+    assert len(content) >= 800
+    assert diagnosis["root_cause"] == STUB_DIAGNOSIS["root_cause"]
+
+
+def test_stub_latency_distribution_is_seeded():
+    a = StubConfig(latency=0.5, latency_sigma=0.8, seed=3)
+    b = StubConfig(latency=0.5, latency_sigma=0.8, seed=3)
+    samples = [a.sample_latency() for _ in range(200)]
+    assert samples == [b.sample_latency() for _ in range(200)]
+    assert min(samples) < 0.5 < max(samples)
+    assert StubConfig(latency=0.5).sample_latency() == 0.5
+
+
+def test_stub_config_round_trips_to_cli_args():
+    args = StubConfig(latency=0.2, error_rate=0.1, error_status=(429, 503)).cli_args()
+    assert args[args.index("--error-status") + 1] == "429,503"
+    assert "--seed" not in args
+
+
+def test_schedule_and_percentiles():
+    assert list(schedule(4.0, 3, "uniform")) == [0.0, 0.25, 0.5]
+    offsets = list(schedule(100.0, 1000, "poisson"))
+    assert 5 < offsets[-1] < 15
+    values = [i / 100 for i in range(1, 101)]
+    assert percentile(values, 50) == 0.5
+    assert percentile(values, 99) == 0.99
+
+
+def test_summarise_reports_errors_and_fallbacks():
+    samples = {
+        "elapsed": 2.0,
+        "latencies": [0.1, 0.2, 0.3, 4.0],
+        "first_bytes": [],
+        "errors": {"HTTP 500": 1},
+        "fallbacks_before": {"upstream_error": 2.0},
+        "fallbacks_after": {"upstream_error": 5.0},
+    }
+    report = summarise(samples, rate=2.5, count=5)
+    assert report["ok"] == 4 and report["throughput_rps"] == 2.0
+    assert report["errors"] == {"HTTP 500": 1}
+    assert report["fallbacks"] == {"upstream_error": 3}
+    assert report["latency_ms"]["max"] == 4000.0
+    assert sum(bucket["count"] for bucket in report["histogram"]) == 4
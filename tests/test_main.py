@@ -1,4 +1,4 @@
-import base64, gzip, json, pathlib
+import base64, gzip, json, pathlib, sqlite3
 from fastapi.testclient import TestClient
 from app.main import app
 
@@ -37,3 +37,248 @@ def test_diagnose_with_file():
     assert resp.status_code == 200
     data = resp.json()
     assert isinstance(data["confidence"], float)
+
+
+def test_diagnose_session_store_is_reused():
+    from app.main import vector_stores
+    encoded = base64.b64encode(gzip.compress(b"def handler():\n    return 1\n")).decode()
+    payload = {
+        "files": [{"filename": "handler.py", "content": encoded}],
+        "error_log": "handler.py:2: ValueError",
+        "summary": "session demo",
+        "session_id": "workspace-1",
+    }
+    assert client.post("/diagnose", json=payload).status_code == 200
+    store = vector_stores.get("workspace-1")
+    assert client.post("/diagnose", json=payload).status_code == 200
+    assert vector_stores.get("workspace-1") is store
+
+
+def test_session_prompt_cites_only_its_own_files():
+    import app.main as m
+
+    def index(filename, source):
+        encoded = base64.b64encode(gzip.compress(source)).decode()
+        return m.index_files([m.FilePayload(filename=filename, content=encoded)], session_id="workspace-2")
+
+    # The second request of the session embeds before the first builds its prompt
+    first = index("a.py", b"def load_orders():\n    raise KeyError('orders')\n")
+    second = index("b.py", b"def load_orders():\n    return fetch_orders()\n")
+    _, prompt = m.build_diagnosis_prompt(first, "KeyError in load_orders", "orders")
+    assert "From a.py" in prompt and "From b.py" not in prompt
+    _, prompt = m.build_diagnosis_prompt(second, "KeyError in load_orders", "orders")
+    assert "From b.py" in prompt and "From a.py" not in prompt
+
+
+def test_diagnose_oversized_upload_returns_413(monkeypatch):
+    from app.utils import decoding
+    monkeypatch.setattr(decoding.decode_files, "__defaults__", (decoding.MAX_FILE_BYTES, 1024))
+    content = base64.b64encode(gzip.compress(b"#" * 4096)).decode()
+    res = client.post("/diagnose", json={
+        "error_log": "boom",
+        "files": [{"filename": "big.py", "content": content}],
+        "summary": "",
+    })
+    assert res.status_code == 413
+
+
+def test_metrics_endpoint_disabled_by_default(monkeypatch):
+    import app.main as m
+    monkeypatch.setattr(m, "METRICS_ENABLED", False)
+    assert client.get("/metrics").status_code == 404
+
+
+def test_metrics_endpoint_reports_stages(monkeypatch):
+    import app.main as m
+    monkeypatch.setattr(m, "METRICS_ENABLED", True)
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    before = m.DIAGNOSE_STAGE_SECONDS.count(stage="decode")
+    client.post("/diagnose", json={"files": [], "error_log": "x.py:1: boom", "summary": ""})
+    assert m.DIAGNOSE_STAGE_SECONDS.count(stage="decode") == before + 1
+    res = client.get("/metrics")
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("text/plain")
+    body = res.text
+    for stage in ("decode", "embed", "query", "extract_context", "build_prompt", "model"):
+        assert f'diagnose_stage_seconds_count{{stage="{stage}"}}' in body
+    assert 'diagnose_fallbacks_total{reason="no_api_key"}' in body
+    assert 'diagnose_model_total{model="gpt-4o-mini"}' in body
+
+
+def test_repeat_failure_reuses_diagnosis_by_fingerprint(monkeypatch):
+    import app.main as m
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(m, "response_cache", m.ResponseCache(db_path=None))
+    monkeypatch.setattr(m, "fingerprint_cache", m.ResponseCache(db_path=None, table="fingerprint_cache"))
+    calls = []
+
+    async def fake_completion(model, prompt):
+        calls.append(prompt)
+        return {"root_cause": f"diagnosis {len(calls)}", "confidence": 0.9, "patches": [], "follow_up": None, "agent_block": ""}
+
+    monkeypatch.setattr(m, "request_completion", fake_completion)
+
+    def payload(tmp, line, source):
+        log = f'Traceback (most recent call last):\n  File "{tmp}/svc.py", line {line}, in run\nValueError: bad value 0x{line}f\n'
+        content = base64.b64encode(gzip.compress(source)).decode()
+        return {"files": [{"filename": "svc.py", "content": content}], "error_log": log, "summary": ""}
+
+    first = client.post("/diagnose", json=payload("/tmp/run-1", 10, b"x = 1\n")).json()
+    again = client.post("/diagnose", json=payload("/tmp/run-2", 12, b"x = 1\n")).json()
+    assert len(calls) == 1 and again == first
+    # Editing the file the frame points into invalidates the reuse
+    changed = client.post("/diagnose", json=payload("/tmp/run-3", 12, b"x = 2\n")).json()
+    assert len(calls) == 2 and changed["root_cause"] == "diagnosis 2"
+
+
+def test_metrics_summary_from_rollups(monkeypatch, tmp_path):
+    import app.main as m
+    from app.utils import rollups
+    from app.utils.metrics import MetricsWriter, init_db, log_call
+    db = str(tmp_path / "metrics.db")
+    init_db(db)
+    for duration in (100, 200, 300, 400):
+        log_call(duration, 10, 5, 15, 0.8, db_path=db)
+    conn = sqlite3.connect(db)
+    try:
+        rollups.roll_up(conn)
+    finally:
+        conn.close()
+    monkeypatch.setattr(m, "metrics_writer", MetricsWriter(db_path=db))
+    monkeypatch.setattr(m, "METRICS_ENABLED", False)
+    assert client.get("/metrics/summary").status_code == 404
+    monkeypatch.setattr(m, "METRICS_ENABLED", True)
+    assert client.get("/metrics/summary?window=1").status_code == 422
+    summary = client.get("/metrics/summary?window=600").json()
+    assert summary["count"] == 4 and summary["granularity_seconds"] == 60
+    assert summary["tokens"]["total"] == 60
+    assert summary["latency_ms"]["max"] == 400
+    assert 190 <= summary["latency_ms"]["p50"] <= 210
+
+
+def test_delta_upload_then_diagnose_by_hash(monkeypatch, tmp_path):
+    import hashlib
+    import app.main as m
+    monkeypatch.setattr(m, "blob_store", m.BlobStore(str(tmp_path / "blobs")))
+    code = "def handler():\n    return 1\n"
+    digest = hashlib.sha256(code.encode()).hexdigest()
+    check = {"files": [{"path": "handler.py", "sha256": digest}]}
+    assert client.post("/files/check", json=check).json() == {"missing": [digest]}
+
+    payload = {
+        "files": [{"filename": "handler.py", "sha256": digest}],
+        "error_log": "handler.py:2: ValueError",
+        "summary": "delta upload",
+    }
+    resp = client.post("/diagnose", json=payload)
+    assert resp.status_code == 409
+    assert resp.json()["detail"]["missing"] == [digest]
+
+    encoded = base64.b64encode(gzip.compress(code.encode())).decode()
+    bad = {"files": [{"filename": "handler.py", "content": encoded, "sha256": "0" * 64}]}
+    assert client.post("/files/upload", json=bad).status_code == 400
+    upload = {"files": [{"filename": "handler.py", "content": encoded, "sha256": digest}]}
+    assert client.post("/files/upload", json=upload).json() == {"stored": [{"path": "handler.py", "sha256": digest}]}
+    assert client.post("/files/check", json=check).json() == {"missing": []}
+
+    assert client.post("/diagnose", json=payload).status_code == 200
+    indexed = m.index_files([m.FilePayload(**f) for f in payload["files"]])
+    assert indexed.decoded_files == [{"filename": "handler.py", "content": code}]
+
+
+def test_files_check_rejects_invalid_hash():
+    resp = client.post("/files/check", json={"files": [{"path": "a.py", "sha256": "not-a-hash"}]})
+    assert resp.status_code == 422
+
+
+def test_diagnose_upload_with_archive_and_log_file():
+    import io, tarfile
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w:gz") as tar:
+        data = b"def handler():\n    raise ValueError('demo')\n"
+        info = tarfile.TarInfo("pkg/handler.py")
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+    resp = client.post(
+        "/diagnose/upload",
+        data={"summary": "archive upload"},
+        files=[
+            ("files", ("repo.tar.gz", buf.getvalue(), "application/gzip")),
+            ("files", ("extra.py", b"x = 1\n", "text/x-python")),
+            ("error_log", ("log.txt", b"pkg/handler.py:2: ValueError: demo", "text/plain")),
+        ],
+    )
+    assert resp.status_code == 200
+    assert isinstance(resp.json()["confidence"], float)
+
+    bad = client.post("/diagnose/upload", data={"error_log": "x"}, files=[("files", ("a.zip", b"PK\x03\x04junk", "application/zip"))])
+    assert bad.status_code == 400
+
+
+def test_gzip_encoded_json_body():
+    encoded = base64.b64encode(gzip.compress(b"print('hello')\n")).decode()
+    payload = {"files": [{"filename": "hello.py", "content": encoded}], "error_log": "ValueError: demo", "summary": "gzip body"}
+    body = gzip.compress(json.dumps(payload).encode())
+    headers = {"Content-Type": "application/json", "Content-Encoding": "gzip"}
+    assert client.post("/diagnose", content=body, headers=headers).status_code == 200
+    assert client.post("/diagnose", content=body[:20], headers=headers).status_code == 400
+    unsupported = {"Content-Type": "application/json", "Content-Encoding": "br"}
+    assert client.post("/diagnose", content=body, headers=unsupported).status_code == 415
+
+
+
+def test_prompt_includes_repo_index_chunks(monkeypatch, tmp_path):
+    import app.main as m
+    from app.utils.repo_index import RepoIndex, build_index
+    root = tmp_path / "repo"
+    (root / "pkg").mkdir(parents=True)
+    (root / "pkg" / "settings.py").write_text("def load_settings():\n    return read_config('settings.toml')\n")
+    build_index(str(root), str(tmp_path / "index"))
+    monkeypatch.setattr(m, "repo_index", RepoIndex(str(tmp_path / "index")))
+    encoded = base64.b64encode(gzip.compress(b"def main():\n    load_settings()\n")).decode()
+    indexed = m.index_files([m.FilePayload(filename="main.py", content=encoded)])
+    _, prompt = m.build_diagnosis_prompt(indexed, "KeyError in load_settings read_config", "settings")
+    assert "From pkg/settings.py (lines 1-2)" in prompt
+
+
+def test_circular_import_is_answered_by_rule_without_model(monkeypatch):
+    import app.main as m
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(m, "fingerprint_cache", m.ResponseCache(db_path=None, table="fingerprint_cache"))
+    logged = []
+    monkeypatch.setattr(m.metrics_writer, "log", lambda *args, **kwargs: logged.append(kwargs))
+
+    async def no_completion(model, prompt):
+        raise AssertionError("the model should not be called")
+
+    monkeypatch.setattr(m, "request_completion", no_completion)
+    files = {
+        "a.py": b"from b import helper\n\n\ndef run():\n    return helper()\n",
+        "b.py": b"from a import run\n\n\ndef helper():\n    return 1\n\n\ndef main():\n    return run()\n",
+    }
+    log = (
+        'Traceback (most recent call last):\n'
+        '  File "/w/a.py", line 1, in <module>\n    from b import helper\n'
+        '  File "/w/b.py", line 1, in <module>\n    from a import run\n'
+        "ImportError: cannot import name 'run' from partially initialized module 'a' "
+        "(most likely due to a circular import) (/w/a.py)\n"
+    )
+    payload = {
+        "files": [{"filename": name, "content": base64.b64encode(gzip.compress(src)).decode()} for name, src in files.items()],
+        "error_log": log,
+        "summary": "",
+    }
+    body = client.post("/diagnose", json=payload).json()
+    assert body["fallback"] is False and body["confidence"] >= 0.85
+    assert "+    from a import run\n" in body["patches"][0]
+    assert logged[-1]["cache_status"] == "rule" and logged[-1]["rule"] == "circular_import"
+    events = client.post("/diagnose/stream", json=payload).text
+    assert "event: result" in events and "circular_import" in events
+    # A diagnosis stored for the same failure takes precedence over the rule
+    indexed = m.index_files([m.FilePayload(**f) for f in payload["files"]])
+    stored = {"root_cause": "stored", "confidence": 0.9, "patches": [], "follow_up": None, "agent_block": "",
+              "fallback": False, "fallback_reason": None}
+    m.fingerprint_cache.set(m.reuse_key(indexed, log), stored)
+    assert client.post("/diagnose", json=payload).json()["root_cause"] == "stored"
+    events = client.post("/diagnose/stream", json=payload).text
+    assert '"root_cause": "stored"' in events and "circular_import" not in events
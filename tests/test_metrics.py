@@ -3,7 +3,7 @@ import sqlite3
 import tempfile
 import unittest
 
-from app.utils.metrics import init_db, log_call
+from app.utils.metrics import MetricsWriter, init_db, log_call
 
 
 class TestMetrics(unittest.TestCase):
@@ -51,6 +51,60 @@ class TestMetrics(unittest.TestCase):
         finally:
             conn.close()
 
+    def test_cache_status_column_added_to_existing_db(self):
+        # A database created with the original schema gains the new column
+        conn = sqlite3.connect(self.db_path)
+        conn.execute(
+            "CREATE TABLE metrics (id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP, "
+            "duration_ms INTEGER, prompt_tokens INTEGER, completion_tokens INTEGER, total_tokens INTEGER, confidence REAL)"
+        )
+        conn.commit()
+        conn.close()
+        init_db(self.db_path)
+        log_call(5, 1, 2, 3, 0.9, db_path=self.db_path, cache_status="hit")
+        conn = sqlite3.connect(self.db_path)
+        try:
+            row = conn.execute("SELECT cache_status FROM metrics").fetchone()
+            self.assertEqual(row, ("hit",))
+        finally:
+            conn.close()
+
+    def _count_rows(self) -> int:
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return conn.execute("SELECT COUNT(*) FROM metrics").fetchone()[0]
+        finally:
+            conn.close()
+
+    def test_writer_batches_rows_and_flushes_on_close(self):
+        init_db(self.db_path)
+        writer = MetricsWriter(db_path=self.db_path, batch_size=10, flush_interval_ms=50)
+        for i in range(25):
+            writer.log(i, 1, 2, 3, 0.5, cache_status="miss")
+        self.assertTrue(writer.flush(timeout=5))
+        self.assertEqual(self._count_rows(), 25)
+        writer.log(99, 1, 2, 3, 0.5)
+        writer.close(timeout=5)
+        self.assertEqual(self._count_rows(), 26)
+        self.assertEqual(writer.written, 26)
+        conn = sqlite3.connect(self.db_path)
+        try:
+            self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+        finally:
+            conn.close()
+
+    def test_writer_retries_failed_batches(self):
+        # No table yet, so the first attempt fails; the rows must survive it
+        writer = MetricsWriter(db_path=self.db_path, flush_interval_ms=20)
+        with self.assertLogs("app.utils.metrics", level="ERROR"):
+            writer.log(1, 1, 1, 2, 0.5)
+            self.assertFalse(writer.flush(timeout=0.2))
+        init_db(self.db_path)
+        self.assertTrue(writer.flush(timeout=5))
+        writer.close(timeout=5)
+        self.assertEqual(self._count_rows(), 1)
+        self.assertGreaterEqual(writer.failed_batches, 1)
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
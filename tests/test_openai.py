@@ -1,25 +1,84 @@
-import importlib, os
-from unittest import mock
+import asyncio
+import json
+
+import httpx
 
 import app.main as m
+from app.utils.resilience import ResilientCaller, RetryPolicy
 
 
 def test_call_openai_fallback_env(monkeypatch):
     # Ensure OPENAI_API_KEY not set
     monkeypatch.delenv("OPENAI_API_KEY", raising=False)
-    resp = m.call_openai("gpt-4o-mini", "dummy prompt")
+    resp = asyncio.run(m.call_openai("gpt-4o-mini", "dummy prompt"))
     assert resp["agent_block"].startswith("Simulated")
+    assert resp["fallback"] is True and resp["fallback_reason"] == "no_api_key"
 
 
 def test_call_openai_fallback_request(monkeypatch):
-    # Provide fake key so path uses requests, but mock requests.post to raise
+    # Provide fake key so the upstream path is used, but make the transport fail
     monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
-    with mock.patch("app.main.requests.post", side_effect=Exception("network")):
-        resp = m.call_openai("gpt-4o-mini", "dummy prompt that triggers fallback")
+    monkeypatch.setattr(m, "upstream", ResilientCaller(retry=RetryPolicy(attempts=2, base_delay=0.001), hedging=False))
+    attempts = []
+
+    def fail(request):
+        attempts.append(request)
+        raise httpx.ConnectError("network", request=request)
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(fail)) as client:
+            monkeypatch.setattr(m, "_http_client", client)
+            return await m.call_openai("gpt-4o-mini", "dummy prompt that triggers fallback")
+
+    resp = asyncio.run(run())
     assert resp["agent_block"].startswith("Simulated")
+    assert resp["fallback_reason"] == "upstream_error"
+    assert len(attempts) == 2
+
+
+def test_call_openai_uses_shared_client(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    answer = {"root_cause": "stub", "confidence": 0.9, "patches": [], "follow_up": None, "agent_block": "ok"}
+    seen = []
+
+    def handler(request):
+        seen.append(json.loads(request.content)["model"])
+        return httpx.Response(200, json={"choices": [{"message": {"content": json.dumps(answer)}}]})
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            monkeypatch.setattr(m, "_http_client", client)
+            return await m.call_openai("gpt-4o", "prompt")
+
+    assert asyncio.run(run()) == answer
+    assert seen == ["gpt-4o"]
 
 
 def test_choose_model_many_files_long_log():
     files = [m.FilePayload(filename=f"f{i}.py", content="") for i in range(4)]
     long_log = "error" * 200  # >500 chars
     assert m.choose_model(long_log, files) == "gpt-4o"
+
+
+def test_cached_call_openai_coalesces_identical_prompts(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(m, "response_cache", m.ResponseCache(db_path=None))
+    answer = {"root_cause": "stub", "confidence": 0.9, "patches": [], "follow_up": None, "agent_block": "ok"}
+    calls = []
+
+    async def handler(request):
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return httpx.Response(200, json={"choices": [{"message": {"content": json.dumps(answer)}}]})
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            monkeypatch.setattr(m, "_http_client", client)
+            first = await asyncio.gather(*(m.cached_call_openai("gpt-4o", "same prompt") for _ in range(3)))
+            again = await m.cached_call_openai("gpt-4o", "same prompt")
+            return first, again
+
+    first, again = asyncio.run(run())
+    assert len(calls) == 1
+    assert sorted(status for _, status, _ in first) == ["coalesced", "coalesced", "miss"]
+    assert again == (answer, "hit", "gpt-4o")
@@ -1,3 +1,5 @@
+import json, os
+from app import prompt_builder
 from app.prompt_builder import build_prompt
 
 def test_prompt_contains_sections():
@@ -7,3 +9,45 @@ def test_prompt_contains_sections():
     assert "Relevant code context" in prompt
     assert "Error log" in prompt
     assert "Summary of changes" in prompt
+
+
+def test_examples_reload_only_when_file_changes(tmp_path, monkeypatch):
+    path = tmp_path / "examples.json"
+    path.write_text(json.dumps([{"example": "first exemplar"}]), encoding="utf-8")
+    monkeypatch.setattr(prompt_builder, "_EXEMPLAR_PATH", path)
+    monkeypatch.setattr(prompt_builder, "_cache_loaded", False)
+    assert "first exemplar" in build_prompt("err", "sum")
+    loaded = prompt_builder._cached_examples
+    assert "first exemplar" in build_prompt("err", "sum")
+    # An unchanged file keeps the parsed examples instead of reading them again
+    assert prompt_builder._cached_examples is loaded
+    path.write_text(json.dumps([{"example": "second exemplar!"}]), encoding="utf-8")
+    os.utime(path, ns=(0, 10**9))
+    prompt = build_prompt("err", "sum")
+    assert "second exemplar!" in prompt and "first exemplar" not in prompt
+    assert prompt_builder._cached_examples is not loaded
+
+
+def test_assemble_prompt_unbounded_matches_build_prompt():
+    from app.prompt_builder import assemble_prompt
+    assembly = assemble_prompt("Traceback...", "summary", ["snippet a"], ["ctx b"])
+    assert assembly.prompt == build_prompt("Traceback...", "summary", ["snippet a"], ["ctx b"])
+    assert assembly.trimmed == []
+
+
+def test_assemble_prompt_fits_budget_by_priority():
+    from app.prompt_builder import assemble_prompt
+    from app.utils.tokens import estimate_tokens
+    log = "\n".join(f"frame {i}" for i in range(2000)) + "\nValueError: the real failure"
+    context = [f"Context from a.py (lines {i}-{i + 60}):\n" + "x = 1\n" * 60 for i in range(20)]
+    retrieved = ["From b.py (lines 1-40):\n" + "y = 2\n" * 40 for _ in range(5)]
+    assembly = assemble_prompt(log, "changed parser", retrieved, context, max_tokens=2000)
+    assert assembly.tokens == estimate_tokens(assembly.prompt) <= 2000
+    # The end of the log, the summary and the first context window survive
+    assert "ValueError: the real failure" in assembly.prompt
+    assert "changed parser" in assembly.prompt
+    assert context[0] in assembly.prompt
+    # Lower priority sections are what gets cut
+    assert assembly.trimmed[:2] == ["error_log", "context"]
+    assert "retrieved" in assembly.trimmed
+    assert "Relevant retrieved snippets" not in assembly.prompt
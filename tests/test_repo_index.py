@@ -0,0 +1,72 @@
+import json
+import os
+
+import pytest
+
+from app.utils.repo_index import RepoIndex, build_index, merge_chunks
+from app.utils.vector_store import TermVectorCache, VectorStore
+
+FILES = {
+    "src/auth/login.py": "def login(user, password):\n    return check_password(user, password)\n\n\n"
+                         "def logout(session):\n    session.clear()\n",
+    "src/db.py": "def connect(url):\n    return Connection(url)\n",
+    "README.md": "Login and session handling for the demo service.\n",
+    "node_modules/pkg/index.js": "function login() {}\n",
+    "logo.png": "\0PNG binary",
+}
+
+
+@pytest.fixture
+def repo(tmp_path):
+    root = tmp_path / "repo"
+    for path, text in FILES.items():
+        target = root / path
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_text(text)
+    return root
+
+
+def test_matches_vector_store_ranking(repo, tmp_path):
+    meta = build_index(str(repo), str(tmp_path / "index"))
+    assert meta["files"] == 3  # node_modules and binary files are skipped
+    index = RepoIndex(str(tmp_path / "index"))
+    store = VectorStore(TermVectorCache())
+    store.embed([{"filename": p, "content": t} for p, t in FILES.items() if p.startswith(("src", "README"))])
+    query = "login password session"
+    expected = store.query_chunks(query, k=3)
+    results = index.query_chunks(query, k=3)
+    assert [(r["filename"], r["start"], r["end"]) for r in results] == \
+        [(r["filename"], r["start"], r["end"]) for r in expected]
+    for got, want in zip(results, expected):
+        assert got["score"] == pytest.approx(want["score"], rel=1e-5)
+        assert got["snippet"] == want["snippet"]
+    assert index.query_chunks("nonexistentterm") == []
+
+
+def test_uploaded_files_shadow_indexed_versions(repo, tmp_path):
+    build_index(str(repo), str(tmp_path / "index"))
+    index = RepoIndex(str(tmp_path / "index"))
+    shadowed = index.file_ids(["/work/repo/src/auth/login.py", "other.py"])
+    assert [index.files[i]["path"] for i in shadowed] == ["src/auth/login.py"]
+    results = index.query_chunks("login password", k=5, exclude_files=shadowed)
+    assert all(r["filename"] != "src/auth/login.py" for r in results)
+
+    upload = [{"filename": "src/auth/login.py", "start": 1, "end": 2, "snippet": "new", "score": 0.9}]
+    assert merge_chunks(upload, results, k=2)[0]["snippet"] == "new"
+
+
+def test_rebuild_replaces_index_and_checks_format(repo, tmp_path):
+    out = str(tmp_path / "index")
+    build_index(str(repo), out)
+    (repo / "src" / "extra.py").write_text("def extra():\n    pass\n")
+    assert build_index(str(repo), out)["files"] == 4
+    assert [name for name in os.listdir(tmp_path) if name.startswith(".repo-index")] == []
+
+    meta_path = os.path.join(out, "meta.json")
+    with open(meta_path) as fh:
+        meta = json.load(fh)
+    meta["format"] = 999
+    with open(meta_path, "w") as fh:
+        json.dump(meta, fh)
+    with pytest.raises(ValueError):
+        RepoIndex(out)
@@ -0,0 +1,35 @@
+import gzip
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from app.utils.request_encoding import DecompressRequestMiddleware
+
+
+def make_client(max_body_bytes):
+    app = FastAPI()
+    app.add_middleware(DecompressRequestMiddleware, max_body_bytes=max_body_bytes)
+
+    @app.post("/echo")
+    async def echo(request: Request):
+        body = await request.body()
+        return {"length": len(body), "encoding": request.headers.get("content-encoding")}
+
+    return TestClient(app)
+
+
+def test_inflates_body_in_chunks():
+    client = make_client(4 * 1024 * 1024)
+    data = b"line of log output\n" * 100000
+    resp = client.post("/echo", content=gzip.compress(data), headers={"Content-Encoding": "gzip"})
+    assert resp.json() == {"length": len(data), "encoding": None}
+    # Concatenated gzip members are one body
+    resp = client.post("/echo", content=gzip.compress(b"ab") + gzip.compress(b"cd"), headers={"Content-Encoding": "gzip"})
+    assert resp.json()["length"] == 4
+    assert client.post("/echo", content=b"plain").json()["length"] == 5
+
+
+def test_decompressed_size_is_capped():
+    client = make_client(1024)
+    resp = client.post("/echo", content=gzip.compress(b"#" * 4096), headers={"Content-Encoding": "gzip"})
+    assert resp.status_code == 413
@@ -0,0 +1,173 @@
+import asyncio
+import random
+
+import httpx
+import pytest
+
+import app.main as m
+from app.utils.resilience import (
+    CIRCUIT_OPEN,
+    HEDGE,
+    HEDGE_WON,
+    RETRY,
+    CircuitBreaker,
+    CircuitOpen,
+    ResilientCaller,
+    RetryPolicy,
+    is_retryable,
+)
+
+
+def status_error(code):
+    request = httpx.Request("POST", "http://upstream/v1/chat/completions")
+    return httpx.HTTPStatusError("error", request=request, response=httpx.Response(code, request=request))
+
+
+def caller(events=None, **kwargs):
+    kwargs.setdefault("retry", RetryPolicy(attempts=3, base_delay=0.001, max_delay=0.001))
+    kwargs.setdefault("hedging", False)
+    return ResilientCaller(on_event=(events.append if events is not None else None), rng=random.Random(0), **kwargs)
+
+
+def test_retryable_failures():
+    assert is_retryable(status_error(503)) and is_retryable(status_error(429))
+    assert is_retryable(httpx.ConnectError("down"))
+    assert not is_retryable(status_error(400))
+    assert not is_retryable(ValueError("bad json"))
+
+
+def test_backoff_is_jittered_and_capped():
+    policy = RetryPolicy(base_delay=0.5, max_delay=2.0)
+    rng = random.Random(1)
+    delays = [policy.delay(attempt, rng) for attempt in range(8)]
+    assert all(0 <= d <= 2.0 for d in delays)
+    assert len(set(delays)) == len(delays)
+
+
+def test_transient_failures_are_retried():
+    events = []
+    calls = []
+
+    async def flaky(model):
+        calls.append(model)
+        if len(calls) < 3:
+            raise status_error(503)
+        return {"ok": True}
+
+    assert asyncio.run(caller(events).call(flaky, "gpt-4o")) == {"ok": True}
+    assert calls == ["gpt-4o"] * 3
+    assert events == [RETRY, RETRY]
+
+
+def test_client_errors_are_not_retried():
+    calls = []
+
+    async def bad_request(model):
+        calls.append(model)
+        raise status_error(400)
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(caller().call(bad_request, "gpt-4o"))
+    assert len(calls) == 1
+
+
+def test_breaker_opens_then_probes():
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=lambda: now[0])
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+    now[0] = 10.0
+    assert breaker.allow()  # the probe
+    assert not breaker.allow()  # only one probe at a time
+    breaker.record_failure()
+    assert breaker.state == "open"
+    now[0] = 20.0
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_open_breaker_fails_fast():
+    events = []
+    calls = []
+
+    async def down(model):
+        calls.append(model)
+        raise httpx.ConnectError("down")
+
+    resilient = caller(events, breaker=CircuitBreaker(failure_threshold=3, reset_timeout=60))
+    with pytest.raises(httpx.ConnectError):
+        asyncio.run(resilient.call(down, "gpt-4o"))
+    with pytest.raises(CircuitOpen):
+        asyncio.run(resilient.call(down, "gpt-4o"))
+    assert len(calls) == 3
+    assert events[-1] == CIRCUIT_OPEN
+
+
+def test_slow_attempt_is_hedged_to_other_model():
+    events = []
+    cancelled = []
+
+    async def upstream(model):
+        if model == "gpt-4o":
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(model)
+                raise
+        return model
+
+    resilient = caller(events, hedging=True, hedge_model="gpt-4o-mini", hedge_min_samples=3, hedge_min_delay=0.01)
+    for latency in (0.01, 0.01, 0.02):
+        resilient.latencies.observe(latency)
+    assert resilient.hedge_delay() == pytest.approx(0.02)
+
+    async def run():
+        result = await resilient.call(upstream, "gpt-4o")
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(run()) == "gpt-4o-mini"
+    assert events == [HEDGE, HEDGE_WON]
+    assert cancelled == ["gpt-4o"]
+
+
+def test_no_hedging_before_enough_samples():
+    resilient = caller(hedging=True, hedge_min_samples=5)
+    resilient.latencies.observe(0.1)
+    assert resilient.hedge_delay() is None
+
+
+def test_response_flags_circuit_open_fallback(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(m, "response_cache", m.ResponseCache(db_path=None))
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    breaker.record_failure()
+    monkeypatch.setattr(m, "upstream", caller(breaker=breaker))
+    result, status, _ = asyncio.run(m.cached_call_openai("gpt-4o", "prompt"))
+    assert status is None
+    body = m.normalise_result(result)
+    assert body["fallback"] is True and body["fallback_reason"] == "circuit_open"
+    assert m.normalise_result({"root_cause": "real", "confidence": 0.5})["fallback"] is False
+
+
+def test_hedged_answer_is_attributed_and_cached_under_its_model(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(m, "response_cache", m.ResponseCache(db_path=None))
+    resilient = caller(hedging=True, hedge_model="gpt-4o-mini", hedge_min_samples=1, hedge_min_delay=0.01)
+    resilient.latencies.observe(0.01)
+    monkeypatch.setattr(m, "upstream", resilient)
+
+    async def completion(model, prompt):
+        if model == "gpt-4o":
+            await asyncio.sleep(5)
+        return {"root_cause": f"from {model}", "confidence": 0.5}
+
+    monkeypatch.setattr(m, "request_completion", completion)
+    result, status, answered_by = asyncio.run(m.cached_call_openai("gpt-4o", "prompt"))
+    assert (result["root_cause"], status, answered_by) == ("from gpt-4o-mini", "miss", "gpt-4o-mini")
+    # The primary model's key stays empty; the hedge model's key holds the answer
+    assert m.response_cache.get(m.make_cache_key("gpt-4o", m.SYSTEM_PROMPT_VERSION, "prompt")) is None
+    assert m.response_cache.get(m.make_cache_key("gpt-4o-mini", m.SYSTEM_PROMPT_VERSION, "prompt")) == result
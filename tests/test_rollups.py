@@ -0,0 +1,185 @@
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from app.utils import rollups
+from app.utils.metrics import MetricsWriter, init_db, log_call
+from app.utils.rollups import QuantileSketch
+
+
+class TestQuantileSketch(unittest.TestCase):
+    def test_quantiles_within_relative_accuracy(self):
+        rng = random.Random(0)
+        values = [rng.lognormvariate(6, 1) for _ in range(5000)]
+        sketch = QuantileSketch()
+        for v in values:
+            sketch.add(v)
+        ordered = sorted(values)
+        for q in (0.5, 0.95, 0.99):
+            exact = ordered[int(q * (len(ordered) - 1))]
+            self.assertAlmostEqual(sketch.quantile(q) / exact, 1.0, delta=0.021)
+
+    def test_merge_and_round_trip(self):
+        a, b = QuantileSketch(), QuantileSketch()
+        for v in range(1, 101):
+            (a if v % 2 else b).add(v)
+        a.add(0)
+        a.merge(QuantileSketch.from_json(b.to_json()))
+        self.assertEqual(a.count, 101)
+        self.assertEqual(a.quantile(0.0), 0.0)
+        self.assertAlmostEqual(a.quantile(0.5), 50, delta=1)
+        self.assertIsNone(QuantileSketch().quantile(0.5))
+
+
+class TestRollups(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmpdir.name, "metrics.db")
+        init_db(self.db_path)
+
+    def tearDown(self) -> None:
+        self.tmpdir.cleanup()
+
+    def insert(self, conn, timestamp, duration_ms, total_tokens=10, confidence=0.5):
+        conn.execute(
+            "INSERT INTO metrics (timestamp, duration_ms, prompt_tokens, completion_tokens, total_tokens, confidence) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(timestamp)), duration_ms, total_tokens - 2, 2,
+             total_tokens, confidence),
+        )
+
+    def test_timestamp_index_exists(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            plan = conn.execute("EXPLAIN QUERY PLAN SELECT * FROM metrics WHERE timestamp > '2024'").fetchall()
+        finally:
+            conn.close()
+        self.assertIn("idx_metrics_timestamp", str(plan))
+
+    def test_incremental_rollup_and_summary(self):
+        now = 1_700_000_000
+        conn = sqlite3.connect(self.db_path)
+        try:
+            with conn:
+                self.insert(conn, now - 30, 100, confidence=0.9)
+                self.insert(conn, now - 90, 300, confidence=0.7)
+            self.assertEqual(rollups.roll_up(conn, now), 2)
+            with conn:
+                self.insert(conn, now - 29, 500, confidence=0.8)
+            # Only the new row is folded in, merged into its existing minute
+            self.assertEqual(rollups.roll_up(conn, now), 1)
+            self.assertEqual(rollups.roll_up(conn, now), 0)
+            minutes = conn.execute("SELECT count FROM metrics_minute ORDER BY bucket").fetchall()
+            hours = conn.execute("SELECT SUM(count) FROM metrics_hour").fetchone()
+            summary = rollups.summarise(conn, 600, now)
+            long_summary = rollups.summarise(conn, 86400, now)
+        finally:
+            conn.close()
+        self.assertEqual(sum(c for (c,) in minutes), 3)
+        self.assertEqual(hours[0], 3)
+        self.assertEqual(summary["count"], 3)
+        self.assertEqual(summary["latency_ms"]["min"], 100)
+        self.assertEqual(summary["latency_ms"]["max"], 500)
+        self.assertAlmostEqual(summary["latency_ms"]["p50"], 300, delta=6)
+        self.assertAlmostEqual(summary["confidence"]["mean"], 0.8)
+        self.assertEqual(summary["tokens"]["total"], 30)
+        self.assertEqual(long_summary["granularity_seconds"], rollups.HOUR)
+        self.assertEqual(long_summary["count"], 3)
+
+    def test_retention_keeps_unrolled_rows(self):
+        now = time.time()
+        old = now - (rollups.METRICS_RAW_RETENTION_DAYS + 1) * 86400
+        conn = sqlite3.connect(self.db_path)
+        try:
+            with conn:
+                self.insert(conn, old, 100)
+            with conn:
+                rollups.apply_retention(conn, now)
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM metrics").fetchone()[0], 1)
+            rollups.roll_up(conn, now)
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM metrics").fetchone()[0], 0)
+            # The aggregate survives the raw row
+            self.assertEqual(conn.execute("SELECT SUM(count) FROM metrics_hour").fetchone()[0], 1)
+        finally:
+            conn.close()
+
+    def test_writer_rolls_up_periodically(self):
+        writer = MetricsWriter(db_path=self.db_path, flush_interval_ms=10, rollup_interval=0.05)
+        try:
+            for i in range(5):
+                writer.log(i * 10, 1, 1, 2, 0.5)
+            self.assertTrue(writer.flush(timeout=5))
+            deadline = time.monotonic() + 5
+            count = 0
+            while time.monotonic() < deadline and count < 5:
+                time.sleep(0.05)
+                conn = sqlite3.connect(self.db_path)
+                try:
+                    count = conn.execute("SELECT COALESCE(SUM(count), 0) FROM metrics_minute").fetchone()[0]
+                finally:
+                    conn.close()
+            self.assertEqual(count, 5)
+        finally:
+            writer.close(timeout=5)
+
+    def test_concurrent_rollups_fold_each_row_once(self):
+        now = 1_700_000_000
+        conn = sqlite3.connect(self.db_path)
+        with conn:
+            for i in range(5):
+                self.insert(conn, now - 30, 100 + i)
+        conn.close()
+        first_merging, second_read, first_done = threading.Event(), threading.Event(), threading.Event()
+        merge_into = rollups._merge_into
+
+        def merge(conn, table, buckets):
+            # Interleave the two rollups: the second reads the raw rows while the
+            # first is mid-batch, and merges them only after the first committed
+            if threading.current_thread().name == "first":
+                first_merging.set()
+                second_read.wait(0.5)
+            else:
+                second_read.set()
+                first_done.wait(1)
+            merge_into(conn, table, buckets)
+
+        def run():
+            if threading.current_thread().name == "second":
+                first_merging.wait(5)
+            worker = sqlite3.connect(self.db_path, timeout=5)
+            try:
+                rollups.roll_up(worker, now)
+            finally:
+                worker.close()
+                if threading.current_thread().name == "first":
+                    first_done.set()
+
+        with mock.patch.object(rollups, "_merge_into", merge):
+            threads = [threading.Thread(target=run, name=name) for name in ("first", "second")]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(10)
+        conn = sqlite3.connect(self.db_path)
+        try:
+            self.assertEqual(conn.execute("SELECT SUM(count) FROM metrics_minute").fetchone()[0], 5)
+        finally:
+            conn.close()
+
+    def test_log_call_rows_roll_up(self):
+        log_call(250, 5, 5, 10, 0.6, db_path=self.db_path)
+        conn = sqlite3.connect(self.db_path)
+        try:
+            self.assertEqual(rollups.roll_up(conn), 1)
+            self.assertEqual(rollups.summarise(conn, 3600)["count"], 1)
+        finally:
+            conn.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
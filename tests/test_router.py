@@ -0,0 +1,77 @@
+import os
+import random
+import tempfile
+
+from app.utils.metrics import init_db, log_call
+from app.utils.router import ModelRouter, RouteFeatures, build_table, route_features
+
+
+def rows(model, n, duration_ms, confidence, log_chars=100, files=1, exception="ValueError", tokens=500):
+    return [(model, log_chars, files, exception, tokens, duration_ms, confidence)] * n
+
+
+def router_with(history, **kwargs):
+    router = ModelRouter(min_samples=5, explore=0.0, refresh_seconds=3600, **kwargs)
+    router._table = build_table(history, router.models)
+    router._next_refresh = float("inf")
+    return router
+
+
+SMALL_VALUE_ERROR = RouteFeatures(log_chars=100, file_count=1, exception="ValueError", input_tokens=500)
+
+
+def test_route_features():
+    log = "noise\n" * 10 + 'File "a.py", line 3, in f\npkg.errors.ConfigError: missing key\n'
+    features = route_features(log, file_count=4, decoded_chars=4000)
+    assert features.exception == "ConfigError"
+    assert features.file_count == 4
+    assert features.input_tokens == (len(log) + 4000) // 4
+
+
+def test_default_without_enough_history():
+    router = router_with(rows("gpt-4o", 50, 900, 0.9))
+    assert router.choose(SMALL_VALUE_ERROR, "gpt-4o-mini") == "gpt-4o-mini"
+
+
+def test_fastest_model_meeting_confidence_target():
+    history = rows("gpt-4o", 10, 4000, 0.92) + rows("gpt-4o-mini", 10, 900, 0.85)
+    assert router_with(history).choose(SMALL_VALUE_ERROR, "gpt-4o") == "gpt-4o-mini"
+    # Below the target the more confident model wins despite being slower
+    history = rows("gpt-4o", 10, 4000, 0.92) + rows("gpt-4o-mini", 10, 900, 0.6)
+    assert router_with(history).choose(SMALL_VALUE_ERROR, "gpt-4o-mini") == "gpt-4o"
+
+
+def test_backs_off_to_coarser_buckets():
+    # Only one model has history for large logs; decide on the exception type instead
+    history = (
+        rows("gpt-4o", 10, 4000, 0.95, log_chars=50000)
+        + rows("gpt-4o", 10, 4000, 0.95)
+        + rows("gpt-4o-mini", 10, 900, 0.5)
+    )
+    large = RouteFeatures(log_chars=50000, file_count=1, exception="ValueError", input_tokens=500)
+    assert router_with(history).choose(large, "gpt-4o-mini") == "gpt-4o"
+
+
+def test_exploration_picks_least_sampled_model():
+    history = rows("gpt-4o", 10, 4000, 0.9) + rows("gpt-4o-mini", 3, 900, 0.9)
+    router = router_with(history)
+    router.explore = 1.0
+    router._rng = random.Random(0)
+    assert router.choose(SMALL_VALUE_ERROR, "gpt-4o") == "gpt-4o-mini"
+
+
+def test_refresh_learns_from_metrics_db():
+    with tempfile.TemporaryDirectory() as tmp:
+        db = os.path.join(tmp, "metrics.db")
+        init_db(db)
+        for _ in range(6):
+            log_call(3000, 1, 1, 2, 0.9, db_path=db, cache_status="miss", model="gpt-4o",
+                     log_chars=100, file_count=1, exception="ValueError", input_tokens=500)
+            log_call(800, 1, 1, 2, 0.88, db_path=db, cache_status="miss", model="gpt-4o-mini",
+                     log_chars=100, file_count=1, exception="ValueError", input_tokens=500)
+            # Cache hits and simulated answers are not evidence about a model
+            log_call(1, 1, 1, 2, 0.1, db_path=db, cache_status="hit", model="gpt-4o-mini",
+                     log_chars=100, file_count=1, exception="ValueError", input_tokens=500)
+        router = ModelRouter(db_path=db, min_samples=5, explore=0.0)
+        router.refresh()
+        assert router.choose(SMALL_VALUE_ERROR, "gpt-4o") == "gpt-4o-mini"
@@ -0,0 +1,163 @@
+import unittest
+
+from app.utils.context import ContextIndex, parse_error_log
+from app.utils.import_graph import ImportGraph
+from app.utils.rules import RuleContext, RuleEngine, lazy_import_patch, make_response
+
+ORDERS = '''"""Orders."""
+
+from .billing import charge
+
+
+class Order:
+    def __init__(self, total):
+        self.total = total
+
+
+def place(order):
+    return charge(order)
+'''
+
+BILLING = '''"""Billing."""
+
+from .orders import Order
+
+
+def charge(order):
+    """Charge an order."""
+    if not isinstance(order, Order):
+        raise TypeError(order)
+    return order.total
+
+
+def refund(order: "Order"):
+    return -charge(order)
+'''
+
+CIRCULAR_LOG = '''Traceback (most recent call last):
+  File "/srv/shop/orders.py", line 3, in <module>
+    from .billing import charge
+  File "/srv/shop/billing.py", line 3, in <module>
+    from .orders import Order
+ImportError: cannot import name 'Order' from partially initialized module 'shop.orders' (most likely due to a circular import) (/srv/shop/orders.py)
+'''
+
+MISSING_LOG = '''Traceback (most recent call last):
+  File "/srv/app/config.py", line 1, in <module>
+    import yaml
+ModuleNotFoundError: No module named 'yaml'
+'''
+
+
+def context(files, log):
+    return RuleContext(log, parse_error_log(log), files, ContextIndex(files), ImportGraph(files))
+
+
+class CircularImportTest(unittest.TestCase):
+    def setUp(self):
+        self.files = [
+            {"filename": "shop/orders.py", "content": ORDERS},
+            {"filename": "shop/billing.py", "content": BILLING},
+        ]
+
+    def test_moves_import_into_functions_at_innermost_frame(self):
+        hit = RuleEngine().evaluate(context(self.files, CIRCULAR_LOG))
+        self.assertEqual(hit.rule, "circular_import")
+        self.assertGreaterEqual(hit.confidence, 0.85)
+        patch = hit.body["patches"][0]
+        self.assertTrue(patch.startswith("--- a/shop/billing.py\n+++ b/shop/billing.py\n"))
+        self.assertIn("-from .orders import Order\n", patch)
+        # Inserted after the docstring of `charge`; the string annotation of `refund` needs no import
+        self.assertEqual(patch.count("+    from .orders import Order\n"), 1)
+        self.assertIn('     """Charge an order."""\n+    from .orders import Order\n', patch)
+
+    def test_names_needed_at_import_time_give_low_confidence(self):
+        files = [
+            {"filename": "shop/orders.py", "content": "from .billing import charge\n\nDEFAULT = charge\n"},
+            {"filename": "shop/billing.py", "content": "from .orders import Order\n\n\nclass Invoice(Order):\n    pass\n"},
+        ]
+        hit = RuleEngine().evaluate(context(files, CIRCULAR_LOG))
+        self.assertEqual(hit.rule, "circular_import")
+        self.assertLess(hit.confidence, 0.85)
+        self.assertEqual(hit.body["patches"], [])
+
+    def test_requires_circular_import_error(self):
+        log = CIRCULAR_LOG.replace("partially initialized module", "module").replace("circular import", "typo")
+        self.assertIsNone(RuleEngine().evaluate(context(self.files, log)))
+
+    def test_lazy_import_patch_refuses_annotation_use(self):
+        source = "from .orders import Order\n\n\ndef refund(order: Order):\n    return Order\n"
+        imp = ImportGraph([{"filename": "billing.py", "content": source}]).summaries[0].imports[0]
+        self.assertIsNone(lazy_import_patch("billing.py", source, imp))
+
+
+class MissingModuleTest(unittest.TestCase):
+    def test_adds_distribution_to_requirements(self):
+        files = [
+            {"filename": "app/config.py", "content": "import yaml\n"},
+            {"filename": "requirements.txt", "content": "fastapi==0.110\nrequests"},
+        ]
+        hit = RuleEngine().evaluate(context(files, MISSING_LOG))
+        self.assertEqual(hit.rule, "missing_module")
+        self.assertGreaterEqual(hit.confidence, 0.85)
+        self.assertIn("-requests\n+requests\n+PyYAML\n", hit.body["patches"][0])
+
+    def test_unknown_module_is_left_to_the_model(self):
+        files = [{"filename": "requirements.txt", "content": "requests\n"}]
+        hit = RuleEngine().evaluate(context(files, MISSING_LOG.replace("'yaml'", "'myservice'")))
+        self.assertEqual(hit.rule, "missing_module")
+        self.assertLess(hit.confidence, 0.85)
+
+    def test_listed_requirement_is_an_install_hint(self):
+        files = [{"filename": "requirements.txt", "content": "pyyaml>=6  # config\n"}]
+        hit = RuleEngine().evaluate(context(files, MISSING_LOG))
+        self.assertEqual(hit.body["patches"], [])
+        self.assertIn("pip install -r requirements.txt", hit.body["follow_up"])
+        self.assertLess(hit.confidence, 0.85)
+
+    def test_ignores_local_and_stdlib_modules(self):
+        local = MISSING_LOG.replace("'yaml'", "'app.settings'")
+        files = [{"filename": "app/config.py", "content": ""}]
+        self.assertIsNone(RuleEngine().evaluate(context(files, local)))
+        self.assertIsNone(RuleEngine().evaluate(context([], MISSING_LOG.replace("'yaml'", "'tomllib'"))))
+
+
+class AssertionDiffTest(unittest.TestCase):
+    def test_describes_pytest_assertion_below_threshold(self):
+        log = (
+            'tests/test_fmt.py:4: in test_fmt\n'
+            "E       AssertionError: assert 'Hello' == 'hello'\n"
+        )
+        hit = RuleEngine().evaluate(context([], log))
+        self.assertEqual(hit.rule, "assertion_diff")
+        self.assertIn("differ only in letter case", hit.body["root_cause"])
+        self.assertLess(hit.confidence, 0.85)
+
+    def test_unittest_dict_assertion(self):
+        log = "AssertionError: {'a': 1, 'b': 2} != {'a': 1, 'c': 2}\n"
+        hit = RuleEngine().evaluate(context([], log))
+        self.assertIn("only the left has keys [\"'b'\"]", hit.body["root_cause"])
+
+
+class RuleEngineTest(unittest.TestCase):
+    def test_most_confident_rule_wins_and_failures_are_skipped(self):
+        def broken(ctx):
+            raise RuntimeError("bug in rule")
+
+        engine = RuleEngine([
+            ("broken", broken),
+            ("weak", lambda ctx: make_response("weak", 0.5, rule="weak")),
+            ("strong", lambda ctx: make_response("strong", 0.95, rule="strong")),
+        ])
+        with self.assertLogs("app.utils.rules", "WARNING"):
+            hit = engine.evaluate(context([], "error"))
+        self.assertEqual((hit.rule, hit.confidence), ("strong", 0.95))
+
+    def test_plugins_are_loaded_by_path(self):
+        engine = RuleEngine([])
+        engine.load_plugins("app.utils.rules:missing_module, app.utils.rules:no_such_rule")
+        self.assertEqual([name for name, _ in engine.rules], ["missing_module"])
+
+
+if __name__ == "__main__":
+    unittest.main()
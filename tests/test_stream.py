@@ -0,0 +1,62 @@
+import json
+
+import httpx
+from fastapi.testclient import TestClient
+
+import app.main as m
+from benchmarks.stub_upstream import STUB_DIAGNOSIS, create_app
+
+client = TestClient(m.app)
+
+PAYLOAD = {"files": [], "error_log": "app.py:3: ValueError", "summary": "stream test"}
+
+
+def parse_events(text):
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_stream_simulated_without_api_key(monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    res = client.post("/diagnose/stream", json=PAYLOAD)
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("text/event-stream")
+    events = parse_events(res.text)
+    assert events[0] == ("field", {"name": "root_cause", "value": events[-1][1]["root_cause"]})
+    assert events[-1][0] == "result"
+    assert events[-1][1]["agent_block"].startswith("Simulated")
+    assert events[-1][1]["fallback"] is True
+    assert events[-1][1]["fallback_reason"] == "no_api_key"
+
+
+def test_stream_from_upstream_then_cache(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(m, "response_cache", m.ResponseCache(db_path=None))
+    monkeypatch.setattr(m, "_http_client", httpx.AsyncClient(transport=httpx.ASGITransport(app=create_app(0.0))))
+    events = parse_events(client.post("/diagnose/stream", json=PAYLOAD).text)
+    assert [kind for kind, _ in events] == ["field", "field", "patch", "field", "field", "result"]
+    assert events[0][1] == {"name": "root_cause", "value": STUB_DIAGNOSIS["root_cause"]}
+    assert events[2][1] == {"index": 0, "value": STUB_DIAGNOSIS["patches"][0]}
+    assert events[-1][1] == {**STUB_DIAGNOSIS, "fallback": False, "fallback_reason": None}
+    # The streamed answer was cached; the same request replays it
+    assert m.response_cache.stats()["entries"] == 1
+    again = parse_events(client.post("/diagnose/stream", json=PAYLOAD).text)
+    assert again == events
+
+
+def test_stream_error_after_partial_output(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(m, "response_cache", m.ResponseCache(db_path=None))
+
+    async def broken(model, prompt):
+        yield '{"root_cause": "half", "confidence": '
+        raise httpx.ReadError("connection dropped")
+
+    monkeypatch.setattr(m, "stream_completion", broken)
+    events = parse_events(client.post("/diagnose/stream", json=PAYLOAD).text)
+    assert events[0] == ("field", {"name": "root_cause", "value": "half"})
+    assert events[-1][0] == "error"
+    assert m.response_cache.stats()["entries"] == 0
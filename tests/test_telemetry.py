@@ -0,0 +1,40 @@
+import unittest
+
+from app.utils.telemetry import Registry
+
+
+class TestTelemetry(unittest.TestCase):
+    def test_counter_render(self):
+        registry = Registry()
+        plain = registry.counter('jobs_total', 'Jobs run.')
+        labelled = registry.counter('routes_total', 'Routes taken.', ['model'])
+        plain.inc()
+        labelled.inc(model='gpt-4o')
+        labelled.inc(2, model='gpt-4o')
+        text = registry.render()
+        self.assertIn('# TYPE jobs_total counter\njobs_total 1\n', text)
+        self.assertIn('routes_total{model="gpt-4o"} 3\n', text)
+        with self.assertRaises(ValueError):
+            labelled.inc()
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = Registry()
+        hist = registry.histogram('stage_seconds', 'Stage time.', ['stage'], buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.7, 5.0):
+            hist.observe(value, stage='decode')
+        text = registry.render()
+        self.assertIn('stage_seconds_bucket{stage="decode",le="0.1"} 1\n', text)
+        self.assertIn('stage_seconds_bucket{stage="decode",le="1"} 3\n', text)
+        self.assertIn('stage_seconds_bucket{stage="decode",le="+Inf"} 4\n', text)
+        self.assertIn('stage_seconds_count{stage="decode"} 4\n', text)
+        self.assertIn('stage_seconds_sum{stage="decode"} 6.25\n', text)
+
+    def test_duplicate_names_rejected(self):
+        registry = Registry()
+        registry.counter('x_total', 'x')
+        with self.assertRaises(ValueError):
+            registry.histogram('x_total', 'x')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+
+from app.utils import tokens
+from app.utils.tokens import estimate_tokens, prompt_budget, truncate_to_tokens
+
+
+class TestTokens(unittest.TestCase):
+    def test_estimate_counts_code_punctuation(self):
+        self.assertEqual(estimate_tokens(""), 0)
+        self.assertEqual(estimate_tokens("hello world"), 2)
+        # One whitespace-separated word, several model tokens
+        self.assertGreater(estimate_tokens("foo(bar[0])"), len("foo(bar[0])".split()))
+        # Long identifiers and numbers are split
+        self.assertEqual(estimate_tokens("abcdefghijkl"), 2)
+        self.assertEqual(estimate_tokens("1234567"), 3)
+
+    def test_truncate_keeps_head_or_tail_on_line_boundaries(self):
+        text = "\n".join(f"line number {i}" for i in range(100))
+        head = truncate_to_tokens(text, 30, keep="head")
+        tail = truncate_to_tokens(text, 30, keep="tail")
+        self.assertLessEqual(estimate_tokens(head), 30)
+        self.assertLessEqual(estimate_tokens(tail), 30)
+        self.assertTrue(head.startswith("line number 0") and head.endswith(tuple("0123456789")))
+        self.assertTrue(tail.endswith("line number 99") and tail.startswith("line number"))
+        self.assertEqual(truncate_to_tokens(text, 10_000), text)
+        self.assertEqual(truncate_to_tokens(text, 0), "")
+
+    def test_budgets(self):
+        self.assertEqual(tokens._parse_budgets("gpt-4o=32000, mini = 100"), {"gpt-4o": 32000, "mini": 100})
+        self.assertEqual(prompt_budget("gpt-4o"), tokens.MODEL_BUDGETS["gpt-4o"])
+        self.assertEqual(prompt_budget("unknown-model"), tokens.DEFAULT_BUDGET)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -25,3 +25,30 @@ def test_decode_files_invalid():
     payload = [FilePayload(filename="bad.py", content="not-base64!")]
     decoded = decode_files(payload)
     assert decoded[0]['content'] == ""
+
+
+def test_decode_files_multi_member_and_order(monkeypatch):
+    from app.utils import decoding
+    big = b"x = 1\n" * 50000
+    payload = [
+        FilePayload(filename="multi.py", content=base64.b64encode(gzip.compress(b"a = 1\n") + gzip.compress(b"b = 2\n")).decode()),
+        FilePayload(filename="big.py", content=base64.b64encode(gzip.compress(big)).decode()),
+    ]
+    for parallel_min in (decoding.PARALLEL_MIN_BYTES, 0):
+        monkeypatch.setattr(decoding, "PARALLEL_MIN_BYTES", parallel_min)
+        monkeypatch.setattr(decoding, "DECODE_WORKERS", 2)
+        decoded = decode_files(payload)
+        assert [d['filename'] for d in decoded] == ["multi.py", "big.py"]
+        assert decoded[0]['content'] == "a = 1\nb = 2\n"
+        assert decoded[1]['content'] == big.decode()
+
+
+def test_decode_files_rejects_gzip_bomb():
+    import pytest
+    from app.utils.decoding import PayloadTooLarge
+    bomb = base64.b64encode(gzip.compress(b"\0" * (4 * 1024 * 1024))).decode()
+    with pytest.raises(PayloadTooLarge):
+        decode_files([FilePayload(filename="bomb.py", content=bomb)], max_file_bytes=1024 * 1024)
+    # Files under the per-file cap still count against the per-request cap
+    with pytest.raises(PayloadTooLarge):
+        decode_files([FilePayload(filename=f"f{i}.py", content=bomb) for i in range(3)], max_request_bytes=10 * 1024 * 1024)
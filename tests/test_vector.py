@@ -1,5 +1,6 @@
 import unittest
 
+from app.utils import vector_store
 from app.utils.vector_store import embed_files, query_snippets
 
 
@@ -36,6 +37,91 @@ class TestVectorStore(unittest.TestCase):
         snippets = query_snippets('content', k=3)
         self.assertEqual(len(snippets), 3)
 
+    def test_unchanged_files_are_not_retokenized(self):
+        terms = vector_store.TermVectorCache()
+        store = vector_store.VectorStore(terms)
+        files = [
+            {'filename': 'a.py', 'content': 'alpha beta gamma'},
+            {'filename': 'b.py', 'content': 'beta delta'},
+        ]
+        store.embed(files)
+        before = terms.tokenized_bytes
+        # Re-embedding identical contents, even from another store, reuses the cached term vectors
+        vector_store.VectorStore(terms).embed([dict(f) for f in files])
+        self.assertEqual(terms.tokenized_bytes, before)
+        # Only the changed file is tokenised again
+        files[1] = {'filename': 'b.py', 'content': 'epsilon delta'}
+        store.embed(files)
+        self.assertEqual(terms.tokenized_bytes, before + len('epsilon delta'))
+        self.assertEqual(store.query_snippets('epsilon', k=1), ['epsilon delta'])
+
+    def test_document_frequencies_follow_the_document_set(self):
+        terms = vector_store.TermVectorCache()
+        store = vector_store.VectorStore(terms)
+        store.embed([{'filename': 'a.py', 'content': 'shared alpha'}, {'filename': 'b.py', 'content': 'shared beta'}])
+        store.embed([{'filename': 'a.py', 'content': 'shared alpha'}])
+        _, ids = terms.term_ids(['shared', 'beta'])
+        self.assertEqual([store._df[i] for i, _ in ids], [1, 0])
+
+    def test_chunks_shared_by_files_survive_removing_one(self):
+        terms = vector_store.TermVectorCache()
+        store = vector_store.VectorStore(terms)
+        same = 'shared gamma'
+        store.embed([{'filename': 'a.py', 'content': same}, {'filename': 'b.py', 'content': same}])
+        store.embed([{'filename': 'a.py', 'content': same}])
+        self.assertEqual(store.query_snippets('gamma', k=5), [same])
+        _, ids = terms.term_ids(['gamma'])
+        self.assertEqual([store._df[i] for i, _ in ids], [1])
+
+    def test_stores_are_isolated(self):
+        first = vector_store.VectorStore()
+        second = vector_store.VectorStore()
+        first.embed([{'filename': 'a.py', 'content': 'alpha shared'}])
+        second.embed([{'filename': 'b.py', 'content': 'beta shared'}])
+        self.assertEqual(first.query_snippets('shared', k=5), ['alpha shared'])
+        self.assertEqual(second.query_snippets('shared', k=5), ['beta shared'])
+
+    def test_store_cache_evicts_least_recently_used(self):
+        cache = vector_store.StoreCache(max_bytes=1)
+        cache.get('one').embed([{'filename': 'a.py', 'content': 'alpha'}])
+        cache.trim()
+        cache.get('two').embed([{'filename': 'b.py', 'content': 'beta'}])
+        cache.trim()
+        self.assertNotIn('one', cache)
+        self.assertIn('two', cache)
+        self.assertEqual(len(cache), 1)
+
+    def test_python_files_are_chunked_at_definitions(self):
+        source = (
+            "import os\n"
+            "\n"
+            "def first():\n"
+            "    return 1\n"
+            "\n"
+            "@decorator\n"
+            "class Second:\n"
+            "    pass\n"
+        )
+        chunks = vector_store.split_chunks('mod.py', source)
+        self.assertEqual([(c['start'], c['end']) for c in chunks], [(1, 2), (3, 4), (6, 8)])
+        self.assertTrue(chunks[2]['content'].startswith('@decorator'))
+
+    def test_other_files_use_line_windows(self):
+        text = "\n".join(f"line {i}" for i in range(1, 101))
+        spans = vector_store.chunk_spans('notes.txt', text)
+        self.assertEqual(spans[0], (1, vector_store.CHUNK_WINDOW_LINES))
+        self.assertEqual(spans[-1][1], 100)
+
+    def test_query_returns_best_chunk_with_line_range(self):
+        padding = "".join(f"def helper_{i}():\n    return {i}\n\n" for i in range(200))
+        source = padding + "def load_config(path):\n    raise KeyError(path)\n"
+        store = vector_store.VectorStore()
+        store.embed([{'filename': 'config.py', 'content': source}])
+        [best] = store.query_chunks('KeyError in load_config', k=1)
+        self.assertEqual(best['filename'], 'config.py')
+        self.assertEqual((best['start'], best['end']), (601, 602))
+        self.assertIn('raise KeyError(path)', best['snippet'])
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file